@@ -0,0 +1,198 @@
+"""
+Arquivamento frio do histórico (Parquet particionado por mês)
+
+Os meses fechados mais antigos que MESES_QUENTES saem do banco e vão para
+PASTA_ARQUIVO/<tabela>/ano=AAAA/mes=MM/dados.parquet: vendas, itens_venda
+(com a data da venda) e movimentacoes_estoque. Os rollups de vendas ficam
+no banco, então dashboards e totais continuam cobrindo todo o histórico.
+
+No razão de estoque, as movimentações arquivadas de cada ingrediente viram
+um único ajuste (MOTIVO_SALDO_ARQUIVADO) datado do último instante arquivado:
+estoque_atual continua igual à soma do razão e o saldo em qualquer data
+depois do corte sai só do banco. Para datas anteriores, as consultas
+juntam o arquivo (ler_arquivo / get_saldos_arquivo).
+"""
+import glob
+import os
+from datetime import datetime
+import pandas as pd
+from banco import get_conexao, transacao, registrar_escrita, sql_delta_movimentacao
+
+# ==============================
+# CONFIGURAÇÕES
+# ==============================
+PASTA_ARQUIVO = 'arquivo'
+MESES_QUENTES = 12          # meses (além do atual) que ficam no banco
+MOTIVO_SALDO_ARQUIVADO = 'Saldo arquivado'
+
+# Coluna de data de cada tabela arquivada (define a partição ano/mês)
+COLUNAS_DATA = {
+    'vendas': 'data_venda',
+    'itens_venda': 'data_venda',
+    'movimentacoes_estoque': 'data_movimentacao',
+}
+
+
+# ==============================
+# LEITURA DO ARQUIVO
+# ==============================
+def get_corte_arquivo():
+    """Primeiro dia que ainda está no banco (None se nada foi arquivado)"""
+    return get_conexao().execute("SELECT MAX(ate) FROM arquivamentos").fetchone()[0]
+
+def periodo_arquivado(data_inicio):
+    """Se o período que começa em data_inicio alcança meses já arquivados"""
+    corte = get_corte_arquivo()
+    return corte is not None and str(data_inicio)[:10] < corte
+
+def _caminho_particao(tabela, mes):
+    ano, mes = mes.split('-')
+    return os.path.join(PASTA_ARQUIVO, tabela, f"ano={ano}", f"mes={mes}", "dados.parquet")
+
+def _particoes(tabela, inicio=None, fim=None):
+    """Arquivos de partição da tabela cujo mês cruza [inicio, fim]"""
+    mes_inicio = str(inicio)[:7] if inicio else '0000-00'
+    mes_fim = str(fim)[:7] if fim else '9999-99'
+    padrao = os.path.join(PASTA_ARQUIVO, tabela, 'ano=*', 'mes=*', 'dados.parquet')
+    for caminho in sorted(glob.glob(padrao)):
+        partes = caminho.split(os.sep)
+        mes = f"{partes[-3][len('ano='):]}-{partes[-2][len('mes='):]}"
+        if mes_inicio <= mes <= mes_fim:
+            yield caminho
+
+def ler_arquivo(tabela, inicio=None, fim=None):
+    """
+    Linhas arquivadas da tabela com data entre inicio e fim (inclusive; DataFrame vazio se não há).
+    Só vale o que é anterior ao corte já gravado no banco: partições publicadas por um
+    arquivamento que não chegou ao commit ficam invisíveis até a próxima execução.
+    """
+    corte = get_corte_arquivo()
+    arquivos = list(_particoes(tabela, inicio, fim)) if corte is not None else []
+    if not arquivos:
+        return pd.DataFrame()
+    dados = pd.concat([pd.read_parquet(a) for a in arquivos], ignore_index=True)
+    datas = dados[COLUNAS_DATA[tabela]].astype(str).str[:10]
+    filtro = datas < corte
+    if inicio:
+        filtro &= datas >= str(inicio)[:10]
+    if fim:
+        filtro &= datas <= str(fim)[:10]
+    return dados[filtro].reset_index(drop=True)
+
+def get_saldos_arquivo(corte):
+    """Saldo de cada ingrediente com as movimentações arquivadas anteriores a corte (ingrediente_id, saldo)"""
+    movimentacoes = ler_arquivo('movimentacoes_estoque', fim=corte)
+    if movimentacoes.empty:
+        return pd.DataFrame(columns=['ingrediente_id', 'saldo'])
+    movimentacoes = movimentacoes[movimentacoes['data_movimentacao'].astype(str) < str(corte)]
+    delta = movimentacoes['quantidade'].where(movimentacoes['tipo'] != 'saida', -movimentacoes['quantidade'])
+    return delta.groupby(movimentacoes['ingrediente_id']).sum().rename('saldo').reset_index()
+
+def get_tamanho_arquivo():
+    """(nº de partições, tamanho em MB) do arquivo frio"""
+    arquivos = glob.glob(os.path.join(PASTA_ARQUIVO, '*', 'ano=*', 'mes=*', 'dados.parquet'))
+    return len(arquivos), sum(os.path.getsize(a) for a in arquivos) / (1024 * 1024)
+
+
+# ==============================
+# ARQUIVAMENTO
+# ==============================
+def _gravar_particoes(tabela, dados):
+    """
+    Grava as linhas em arquivos temporários ao lado das partições (juntando com o
+    que já estava arquivado no mês). Retorna [(temporario, final)] para publicar
+    depois do commit.
+    """
+    pendentes = []
+    meses = dados[COLUNAS_DATA[tabela]].astype(str).str[:7]
+    for mes, grupo in dados.groupby(meses):
+        final = _caminho_particao(tabela, mes)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        if os.path.exists(final):
+            grupo = pd.concat([pd.read_parquet(final), grupo], ignore_index=True).drop_duplicates('id', keep='last')
+        temporario = final + '.tmp'
+        grupo.sort_values('id').to_parquet(temporario, index=False)
+        pendentes.append((temporario, final))
+    return pendentes
+
+def arquivar_historico(meses_quentes=MESES_QUENTES):
+    """
+    Move para o arquivo Parquet as vendas, itens e movimentações de estoque dos meses
+    fechados anteriores aos últimos meses_quentes meses. Retorna (sucesso, mensagem).
+    """
+    corte = (pd.Timestamp(datetime.now().date().replace(day=1)) - pd.DateOffset(months=int(meses_quentes)))
+    fim_arquivado = (corte - pd.Timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
+    corte = corte.strftime('%Y-%m-%d')
+    pendentes = []
+    try:
+        with transacao() as conn:
+            vendas = pd.read_sql_query("SELECT * FROM vendas WHERE data_venda < ?", conn, params=(corte,))
+            itens = pd.read_sql_query("""
+                SELECT iv.*, v.data_venda
+                FROM itens_venda iv
+                JOIN vendas v ON v.id = iv.venda_id
+                WHERE v.data_venda < ?
+            """, conn, params=(corte,))
+            # Ajustes de saldo arquivado de execuções anteriores não vão para o arquivo: são refeitos abaixo
+            movimentacoes = pd.read_sql_query("""
+                SELECT * FROM movimentacoes_estoque
+                WHERE data_movimentacao < ? AND NOT (tipo = 'ajuste' AND motivo = ?)
+            """, conn, params=(corte, MOTIVO_SALDO_ARQUIVADO))
+            if vendas.empty and movimentacoes.empty:
+                return True, f"Nada para arquivar antes de {corte}"
+
+            for tabela, dados in (('vendas', vendas), ('itens_venda', itens), ('movimentacoes_estoque', movimentacoes)):
+                if not dados.empty:
+                    pendentes += _gravar_particoes(tabela, dados)
+
+            registrar_escrita('vendas', 'itens_venda', 'movimentacoes_estoque', 'ingredientes', 'snapshots_estoque')
+            # Itens primeiro: foreign_keys não está ligado, o CASCADE não apagaria nada
+            conn.execute("DELETE FROM itens_venda WHERE venda_id IN (SELECT id FROM vendas WHERE data_venda < ?)", (corte,))
+            conn.execute("DELETE FROM vendas WHERE data_venda < ?", (corte,))
+
+            # Razão: snapshots anteriores ao corte perdem o sentido; o saldo arquivado vira um ajuste
+            # por ingrediente, e os triggers da inclusão e da exclusão se anulam no saldo e nos snapshots
+            conn.execute("DELETE FROM snapshots_estoque WHERE data_corte < ?", (corte,))
+            ultimo_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM movimentacoes_estoque").fetchone()[0]
+            conn.execute(f"""
+                INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo, data_movimentacao)
+                SELECT m.ingrediente_id, 'ajuste', SUM({sql_delta_movimentacao("m")}), ?, ?
+                FROM movimentacoes_estoque m
+                JOIN ingredientes i ON i.id = m.ingrediente_id
+                WHERE m.data_movimentacao < ?
+                GROUP BY m.ingrediente_id
+                HAVING ABS(SUM({sql_delta_movimentacao("m")})) > 1e-9
+            """, (MOTIVO_SALDO_ARQUIVADO, fim_arquivado, corte))
+            conn.execute(
+                "DELETE FROM movimentacoes_estoque WHERE data_movimentacao < ? AND id <= ?", (corte, ultimo_id)
+            )
+
+            conn.execute(
+                "INSERT INTO arquivamentos (ate, vendas, itens_venda, movimentacoes) VALUES (?, ?, ?, ?)",
+                (corte, len(vendas), len(itens), len(movimentacoes))
+            )
+
+            # Publica as partições antes do commit: se algo falhar daqui em diante, as linhas
+            # continuam no banco, o corte não avança (ler_arquivo ignora o que passou dele)
+            # e a próxima execução regrava as mesmas linhas (drop_duplicates por id)
+            for temporario, final in pendentes:
+                os.replace(temporario, final)
+    except Exception as e:
+        for temporario, _ in pendentes:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        return False, f"Erro ao arquivar histórico: {e}"
+
+    return True, (
+        f"Arquivados antes de {corte}: {len(vendas)} vendas, {len(itens)} itens "
+        f"e {len(movimentacoes)} movimentações de estoque"
+    )
+
+def get_historico_arquivamentos(limite=10):
+    """Últimas execuções do arquivamento"""
+    return pd.read_sql_query("""
+        SELECT executado_em, ate, vendas, itens_venda, movimentacoes
+        FROM arquivamentos
+        ORDER BY id DESC
+        LIMIT ?
+    """, get_conexao(), params=(int(limite),))
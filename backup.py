@@ -0,0 +1,133 @@
+"""
+Backup online do banco (API de backup do SQLite)
+
+As páginas são copiadas em passos curtos para um arquivo temporário. A
+conexão de origem segura uma transação de leitura durante toda a cópia: no
+WAL o PDV continua gravando, e a cópia sai do retrato tirado no início (sem
+ela, cada commit de outra conexão reinicia a API de backup, e um banco
+gravado sem parar nunca terminaria). A cópia é conferida
+(PRAGMA integrity_check), comprimida (gzip, ou zstd se o pacote zstandard
+estiver instalado) e guardada em PASTA_BACKUPS, mantendo as GERACOES_BACKUP
+mais recentes. Nada é feito até alguém pedir um backup (botão na página de
+configurações ou `python comandos.py backup` no cron).
+
+Cada geração é uma cópia completa: a API de backup do SQLite não tem modo
+incremental, e com o banco pequeno e comprimido a rotação já limita o
+espaço em disco.
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+import pandas as pd
+from banco import CAMINHO_BANCO, BUSY_TIMEOUT_MS
+
+try:
+    import zstandard
+except ImportError:  # zstd é opcional; gzip sempre disponível
+    zstandard = None
+
+# ==============================
+# CONFIGURAÇÕES
+# ==============================
+PASTA_BACKUPS = 'backups'
+GERACOES_BACKUP = 7        # backups mantidos em disco (os mais antigos são apagados)
+PAGINAS_POR_PASSO = 256    # páginas copiadas por passo da API de backup
+PAUSA_PASSO_S = 0.01       # espera quando um passo encontra o banco ocupado
+PREFIXO = 'natureba_'
+
+EXTENSOES = {'gzip': '.db.gz', 'zstd': '.db.zst'}
+
+
+def compressoes_disponiveis():
+    """Formatos de compressão suportados neste ambiente"""
+    return ['gzip', 'zstd'] if zstandard is not None else ['gzip']
+
+
+def _comprimir(origem, destino, compressao):
+    with open(origem, 'rb') as entrada:
+        if compressao == 'zstd':
+            with open(destino, 'wb') as saida:
+                zstandard.ZstdCompressor(level=10).copy_stream(entrada, saida)
+        else:
+            with gzip.open(destino, 'wb', compresslevel=6) as saida:
+                shutil.copyfileobj(entrada, saida, 1024 * 1024)
+
+
+def _rotacionar():
+    """Apaga as gerações além de GERACOES_BACKUP (as mais antigas primeiro)"""
+    for antigo in listar_backups()['caminho'].iloc[GERACOES_BACKUP:]:
+        try:
+            os.remove(antigo)
+        except OSError:
+            pass
+
+
+def gerar_backup(compressao='gzip', progresso=None):
+    """
+    Copia o banco em passos pela API de backup, confere a integridade da cópia,
+    comprime e guarda uma nova geração. progresso(fração) é chamado a cada passo.
+    Retorna (sucesso, mensagem, caminho).
+    """
+    if compressao not in compressoes_disponiveis():
+        return False, f"Compressão indisponível: {compressao}", None
+
+    os.makedirs(PASTA_BACKUPS, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(suffix='.db', dir=PASTA_BACKUPS)
+    os.close(fd)
+    base = os.path.join(PASTA_BACKUPS, f"{PREFIXO}{datetime.now():%Y%m%d_%H%M%S}")
+    destino, n = base + EXTENSOES[compressao], 1
+    while os.path.exists(destino):  # dois backups no mesmo segundo
+        n += 1
+        destino = f"{base}_{n}{EXTENSOES[compressao]}"
+
+    def passo(status, restantes, total):
+        if progresso is not None and total:
+            progresso((total - restantes) / total)
+
+    try:
+        origem = sqlite3.connect(CAMINHO_BANCO, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        copia = sqlite3.connect(temporario)
+        try:
+            # Transação de leitura aberta até o fim: a cópia não reinicia a cada commit do PDV
+            origem.execute('BEGIN')
+            origem.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            origem.backup(copia, pages=PAGINAS_POR_PASSO, progress=passo, sleep=PAUSA_PASSO_S)
+            origem.execute('COMMIT')
+            resultado = copia.execute('PRAGMA integrity_check').fetchone()[0]
+            if resultado != 'ok':
+                return False, f"Cópia reprovada na verificação de integridade: {resultado}", None
+        finally:
+            copia.close()
+            origem.close()
+
+        _comprimir(temporario, destino, compressao)
+        _rotacionar()
+        tamanho = os.path.getsize(destino) / (1024 * 1024)
+        return True, f"Backup gerado: {os.path.basename(destino)} ({tamanho:.2f} MB)", destino
+    except Exception as e:
+        if os.path.exists(destino):
+            os.remove(destino)
+        return False, f"Erro ao gerar backup: {e}", None
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
+def listar_backups():
+    """Gerações guardadas, da mais recente para a mais antiga (arquivo, caminho, criado_em, tamanho_mb)"""
+    linhas = []
+    if os.path.isdir(PASTA_BACKUPS):
+        for nome in os.listdir(PASTA_BACKUPS):
+            if nome.startswith(PREFIXO) and nome.endswith(tuple(EXTENSOES.values())):
+                caminho = os.path.join(PASTA_BACKUPS, nome)
+                linhas.append({
+                    'arquivo': nome,
+                    'caminho': caminho,
+                    'criado_em': datetime.fromtimestamp(os.path.getmtime(caminho)),
+                    'tamanho_mb': os.path.getsize(caminho) / (1024 * 1024),
+                })
+    backups = pd.DataFrame(linhas, columns=['arquivo', 'caminho', 'criado_em', 'tamanho_mb'])
+    return backups.sort_values(['criado_em', 'arquivo'], ascending=False).reset_index(drop=True)
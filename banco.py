@@ -1,15 +1,413 @@
 import sqlite3
+import queue
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 import streamlit as st
 import pandas as pd
 from datetime import datetime
 
-@st.cache_resource
-def iniciar_database():
-    conn = sqlite3.connect('natureba.db', check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+# ==============================
+# CONFIGURAÇÕES DO BANCO
+# ==============================
+CAMINHO_BANCO = 'natureba.db'
+TAMANHO_POOL = 16          # máximo de conexões abertas no processo
+BUSY_TIMEOUT_MS = 5000     # espera por lock de escrita antes de "database is locked"
+TIMEOUT_POOL = 30          # segundos aguardando uma conexão livre no pool
+
+# Tabelas de cadastro lidas por quase todas as páginas (cache com versão própria)
+TABELAS_REFERENCIA = ('produtos', 'ingredientes', 'receitas', 'usuarios')
+# Atraso máximo (s) para enxergar escritas de outro processo no mesmo arquivo
+INTERVALO_SINCRONIZACAO = 2.0
+
+
+# ==============================
+# POOL DE CONEXÕES
+# (uma conexão por thread, WAL + busy timeout)
+# ==============================
+class _Emprestimo:
+    """Conexão emprestada à thread atual; devolvida ao pool quando a thread termina"""
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class PoolConexoes:
+    """Pool limitado de conexões SQLite, uma por thread de execução"""
+
+    def __init__(self, caminho=CAMINHO_BANCO, tamanho=TAMANHO_POOL):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self._livres = queue.LifoQueue()
+        self._abertas = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _nova_conexao(self):
+        conn = sqlite3.connect(
+            self.caminho,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False  # a conexão pode mudar de thread ao voltar para o pool
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL: leitores não bloqueiam o escritor (PDV) e vice-versa
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _saudavel(self, conn):
+        """Health check rápido antes de reutilizar uma conexão ociosa"""
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._abertas -= 1
+
+    def _obter(self):
+        while True:
+            try:
+                conn = self._livres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    pode_abrir = self._abertas < self.tamanho
+                    if pode_abrir:
+                        self._abertas += 1
+                if pode_abrir:
+                    try:
+                        return self._nova_conexao()
+                    except Exception:
+                        with self._lock:
+                            self._abertas -= 1
+                        raise
+                try:
+                    conn = self._livres.get(timeout=TIMEOUT_POOL)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("Pool de conexões esgotado")
+
+            if self._saudavel(conn):
+                return conn
+            self._descartar(conn)
+
+    def _devolver(self, conn):
+        try:
+            # Nunca devolver uma conexão com transação pendente (seguraria o lock de escrita)
+            if conn.in_transaction:
+                conn.rollback()
+            self._livres.put(conn)
+        except sqlite3.Error:
+            self._descartar(conn)
+
+    def conexao(self):
+        """Retorna a conexão da thread atual, emprestando uma do pool se necessário"""
+        emprestimo = getattr(self._local, 'emprestimo', None)
+        if emprestimo is None:
+            emprestimo = _Emprestimo(self._obter())
+            # Quando a thread morre o threading.local é limpo e a conexão volta ao pool
+            weakref.finalize(emprestimo, self._devolver, emprestimo.conn)
+            self._local.emprestimo = emprestimo
+        return emprestimo.conn
+
+
+def get_conexao():
+    """Conexão SQLite da thread atual (via pool do processo)"""
+    return iniciar_database().conexao()
+
+
+# ==============================
+# VERSÃO DOS DADOS
+# (chave de cache: muda a cada escrita confirmada)
+# ==============================
+_versao_dados = 0
+_versoes_tabelas = {}      # tabela -> nº de escritas confirmadas nela
+_lock_versao = threading.Lock()
+
+
+def versao_dados():
+    """Versão atual dos dados do processo, usada como parte da chave dos caches"""
+    _sincronizar_versoes()
+    return _versao_dados
+
+
+def versao_tabelas(*tabelas):
+    """Versões das tabelas informadas; chave dos caches de dados de referência"""
+    _sincronizar_versoes()
+    return tuple(_versoes_tabelas.get(t, 0) for t in tabelas)
+
+
+def invalidar_dados(*tabelas):
+    """
+    Marca que houve escrita: caches montados com versões anteriores deixam de valer.
+    Sem tabelas informadas (escrita de alvo desconhecido), invalida todas.
+    """
+    global _versao_dados
+    with _lock_versao:
+        _versao_dados += 1
+        if not tabelas:
+            tabelas = list(_versoes_tabelas) + list(TABELAS_REFERENCIA)
+        for t in set(tabelas):
+            _versoes_tabelas[t] = _versoes_tabelas.get(t, 0) + 1
+
+
+# ------------------------------
+# Coerência entre processos (PDV e retaguarda no mesmo natureba.db):
+# no máximo a cada INTERVALO_SINCRONIZACAO, uma conexão dedicada lê
+# PRAGMA data_version, que só muda quando outra conexão confirma escrita.
+# Se mudou, compara os contadores da tabela versao_tabelas (mantidos por
+# trigger) e invalida localmente só as tabelas alteradas.
+# ------------------------------
+_lock_sincronizacao = threading.Lock()
+_sincronizacao = {'conn': None, 'data_version': None, 'contadores': None, 'ultima': 0.0}
+
+
+def _sincronizar_versoes():
+    estado = _sincronizacao
+    if time.monotonic() - estado['ultima'] < INTERVALO_SINCRONIZACAO:
+        return
+    # Outra thread já está sincronizando: segue com as versões atuais
+    if not _lock_sincronizacao.acquire(blocking=False):
+        return
+    try:
+        estado['ultima'] = time.monotonic()
+        if estado['conn'] is None:
+            pool = iniciar_database()  # garante as migrações (tabela versao_tabelas)
+            estado['conn'] = sqlite3.connect(pool.caminho, timeout=BUSY_TIMEOUT_MS / 1000,
+                                             check_same_thread=False)
+        conn = estado['conn']
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == estado['data_version']:
+            return
+        estado['data_version'] = data_version
+        contadores = dict(conn.execute('SELECT tabela, versao FROM versao_tabelas').fetchall())
+        anteriores = estado['contadores']
+        estado['contadores'] = contadores
+        if anteriores is None:
+            return
+        alteradas = [t for t, v in contadores.items() if anteriores.get(t) != v]
+        if alteradas:
+            invalidar_dados(*alteradas)
+    except sqlite3.Error:
+        # Falha de leitura não derruba a página; tenta de novo no próximo intervalo
+        if estado['conn'] is not None:
+            estado['conn'].close()
+        estado['conn'] = None
+    finally:
+        _lock_sincronizacao.release()
+
+
+# ==============================
+# TRANSAÇÕES
+# ==============================
+_estado_transacao = threading.local()
+
+
+def em_transacao():
+    """Indica se a thread atual está dentro de um bloco transacao()"""
+    return getattr(_estado_transacao, 'profundidade', 0) > 0
+
+
+def registrar_escrita(*tabelas):
+    """
+    Registra tabelas alteradas. Fora de transacao() invalida na hora; dentro,
+    acumula e invalida só no commit. Sem tabelas, vale como "todas".
+    """
+    if not em_transacao():
+        invalidar_dados(*tabelas)
+    elif not tabelas:
+        _estado_transacao.todas = True
+    else:
+        _estado_transacao.tabelas.update(tabelas)
+
+
+@contextmanager
+def transacao():
+    """
+    Agrupa vários comandos em uma única transação (um único fsync).
+    Blocos aninhados participam da transação mais externa; qualquer erro
+    desfaz tudo. Dentro do bloco, executar_query não faz commit.
+    Quem escreve direto pela conexão deve chamar registrar_escrita().
+    """
+    conn = get_conexao()
+    if em_transacao():
+        _estado_transacao.profundidade += 1
+        try:
+            yield conn
+        finally:
+            _estado_transacao.profundidade -= 1
+        return
+
+    if conn.in_transaction:
+        conn.commit()
+    # IMMEDIATE: pega o lock de escrita já no início (evita deadlock leitor→escritor)
+    conn.execute('BEGIN IMMEDIATE')
+    _estado_transacao.profundidade = 1
+    _estado_transacao.tabelas = set()
+    _estado_transacao.todas = False
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _estado_transacao.profundidade = 0
+    # Bloco sem registro de tabelas (escrita direta pela conexão): invalida todas
+    if _estado_transacao.todas or not _estado_transacao.tabelas:
+        invalidar_dados()
+    else:
+        invalidar_dados(*_estado_transacao.tabelas)
+
+
+# ==============================
+# MIGRAÇÕES DE SCHEMA
+# (versionadas via PRAGMA user_version)
+# ==============================
+# Tabelas de rollup de vendas (agregados por dia, produto/dia e hora)
+TABELAS_ROLLUP = ('vendas_dia', 'vendas_produto_dia', 'vendas_hora')
+# Tabelas com contador de escritas em versao_tabelas (coerência entre processos)
+TABELAS_VERSIONADAS = TABELAS_REFERENCIA + (
+    'vendas', 'itens_venda', 'movimentacoes_estoque', 'estoque_pronto', 'custos_operacionais'
+)
+
+
+def sql_rollups_vendas(filtro_vendas, sinal=1):
+    """
+    Comandos que somam (sinal=1) ou subtraem (sinal=-1) as vendas que satisfazem
+    o filtro (alias v) nas tabelas de rollup. Usado no checkout, na exclusão
+    de vendas e na reconstrução do histórico.
+    """
+    sinal = int(sinal)
+    return [
+        f"""
+        INSERT INTO vendas_dia (data_venda, num_vendas, faturamento, custo_variavel)
+        SELECT v.data_venda,
+               {sinal} * COUNT(*),
+               {sinal} * SUM(v.total),
+               {sinal} * COALESCE(SUM((
+                   SELECT SUM(iv.custo_variavel) FROM itens_venda iv WHERE iv.venda_id = v.id
+               )), 0)
+        FROM vendas v
+        WHERE {filtro_vendas}
+        GROUP BY v.data_venda
+        ON CONFLICT (data_venda) DO UPDATE SET
+            num_vendas = num_vendas + excluded.num_vendas,
+            faturamento = faturamento + excluded.faturamento,
+            custo_variavel = custo_variavel + excluded.custo_variavel
+        """,
+        f"""
+        INSERT INTO vendas_produto_dia (data_venda, produto_id, quantidade, faturamento, custo_variavel, num_vendas)
+        SELECT v.data_venda, iv.produto_id,
+               {sinal} * SUM(iv.quantidade),
+               {sinal} * SUM(iv.subtotal),
+               {sinal} * SUM(iv.custo_variavel),
+               {sinal} * COUNT(DISTINCT iv.venda_id)
+        FROM vendas v
+        JOIN itens_venda iv ON iv.venda_id = v.id
+        WHERE {filtro_vendas}
+        GROUP BY v.data_venda, iv.produto_id
+        ON CONFLICT (data_venda, produto_id) DO UPDATE SET
+            quantidade = quantidade + excluded.quantidade,
+            faturamento = faturamento + excluded.faturamento,
+            custo_variavel = custo_variavel + excluded.custo_variavel,
+            num_vendas = num_vendas + excluded.num_vendas
+        """,
+        f"""
+        INSERT INTO vendas_hora (data_venda, hora, num_vendas, faturamento)
+        SELECT v.data_venda,
+               COALESCE(CAST(strftime('%H', v.hora_venda) AS INTEGER), 0) AS hora,
+               {sinal} * COUNT(*),
+               {sinal} * SUM(v.total)
+        FROM vendas v
+        WHERE {filtro_vendas}
+        GROUP BY v.data_venda, hora
+        ON CONFLICT (data_venda, hora) DO UPDATE SET
+            num_vendas = num_vendas + excluded.num_vendas,
+            faturamento = faturamento + excluded.faturamento
+        """,
+    ]
+
+
+def _sql_triggers_versao(tabela):
+    """Triggers que incrementam o contador de escritas da tabela em versao_tabelas"""
+    return [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.lower()} AFTER {evento} ON {tabela}
+        BEGIN
+            UPDATE versao_tabelas SET versao = versao + 1 WHERE tabela = '{tabela}';
+        END
+        '''
+        for evento in ('INSERT', 'UPDATE', 'DELETE')
+    ]
+
+
+def sql_delta_movimentacao(alias):
+    """Efeito da movimentação (alias) no saldo: saída subtrai, entrada e ajuste (com sinal) somam"""
+    return f"(CASE {alias}.tipo WHEN 'saida' THEN -{alias}.quantidade ELSE {alias}.quantidade END)"
+
 
-    # Tabela de produtos
-    conn.execute('''
+def _sql_aplicar_movimentacao(alias, sinal):
+    """
+    Comandos de trigger que aplicam (sinal=1) ou desfazem (sinal=-1) a movimentação
+    no saldo do ingrediente e nos snapshots com data de corte posterior a ela
+    (movimentação retroativa corrige os checkpoints já gravados).
+    """
+    delta = f"{int(sinal)} * {sql_delta_movimentacao(alias)}"
+    return f"""
+            UPDATE ingredientes SET estoque_atual = estoque_atual + {delta}
+            WHERE id = {alias}.ingrediente_id;
+            UPDATE snapshots_estoque SET saldo = saldo + {delta}
+            WHERE ingrediente_id = {alias}.ingrediente_id AND data_corte > {alias}.data_movimentacao;
+    """
+
+
+def _sql_recalcular_custo(filtro_produtos):
+    """Comando que recalcula custo_produto para os produtos que satisfazem o filtro (alias p)"""
+    return f"""
+        INSERT OR REPLACE INTO custo_produto (produto_id, custo, atualizado_em)
+        SELECT p.id,
+               COALESCE((
+                   SELECT SUM(r.quantidade * i.preco_kg)
+                   FROM receitas r
+                   JOIN ingredientes i ON r.ingrediente_id = i.id
+                   WHERE r.produto_id = p.id
+               ), 0),
+               CURRENT_TIMESTAMP
+        FROM produtos p
+        WHERE {filtro_produtos}
+    """
+
+
+def _sql_recalcular_custo_bom(filtro_produtos):
+    """Como _sql_recalcular_custo, mas pela receita expandida (sub-receitas já explodidas)"""
+    return f"""
+        INSERT OR REPLACE INTO custo_produto (produto_id, custo, atualizado_em)
+        SELECT p.id,
+               COALESCE((
+                   SELECT SUM(re.quantidade * i.preco_kg)
+                   FROM receitas_expandidas re
+                   JOIN ingredientes i ON re.ingrediente_id = i.id
+                   WHERE re.produto_id = p.id
+               ), 0),
+               CURRENT_TIMESTAMP
+        FROM produtos p
+        WHERE {filtro_produtos}
+    """
+
+
+# Cada migração é (versão, descrição, [comandos SQL]) e roda uma única vez.
+# Nunca edite uma migração já publicada: crie uma nova no fim da lista.
+MIGRACOES = [
+    (1, "Schema inicial", [
+        # Tabela de produtos
+        '''
         CREATE TABLE IF NOT EXISTS produtos (
             id INTEGER PRIMARY KEY,
             nome TEXT UNIQUE NOT NULL,
@@ -18,10 +416,9 @@ def iniciar_database():
             ativo BOOLEAN DEFAULT 1,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-
-    # Tabela de ingredientes
-    conn.execute('''
+        ''',
+        # Tabela de ingredientes
+        '''
         CREATE TABLE IF NOT EXISTS ingredientes (
             id INTEGER PRIMARY KEY,
             nome TEXT UNIQUE NOT NULL,
@@ -31,10 +428,9 @@ def iniciar_database():
             fornecedor TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-
-    # NOVA: Tabela de receitas (relaciona produtos com ingredientes)
-    conn.execute('''
+        ''',
+        # Tabela de receitas (relaciona produtos com ingredientes)
+        '''
         CREATE TABLE IF NOT EXISTS receitas (
             id INTEGER PRIMARY KEY,
             produto_id INTEGER NOT NULL,
@@ -44,10 +440,9 @@ def iniciar_database():
             FOREIGN KEY (ingrediente_id) REFERENCES ingredientes (id) ON DELETE CASCADE,
             UNIQUE(produto_id, ingrediente_id)
         )
-    ''')
-
-    # Tabela de vendas - Agrupamento por compra (pedido)
-    conn.execute('''
+        ''',
+        # Tabela de vendas - Agrupamento por compra (pedido)
+        '''
         CREATE TABLE IF NOT EXISTS vendas (
             id INTEGER PRIMARY KEY,
             data_venda DATE NOT NULL,
@@ -55,10 +450,9 @@ def iniciar_database():
             total REAL NOT NULL,
             observacao TEXT
         )
-    ''')
-
-    # NOVA: Tabela de itens de venda (detalhamento dos produtos vendidos)
-    conn.execute('''
+        ''',
+        # Tabela de itens de venda (detalhamento dos produtos vendidos)
+        '''
         CREATE TABLE IF NOT EXISTS itens_venda (
             id INTEGER PRIMARY KEY,
             venda_id INTEGER NOT NULL,
@@ -70,10 +464,9 @@ def iniciar_database():
             FOREIGN KEY (venda_id) REFERENCES vendas (id) ON DELETE CASCADE,
             FOREIGN KEY (produto_id) REFERENCES produtos (id)
         )
-    ''')
-
-    # Tabela de custos operacionais
-    conn.execute('''
+        ''',
+        # Tabela de custos operacionais
+        '''
         CREATE TABLE IF NOT EXISTS custos_operacionais (
             id INTEGER PRIMARY KEY,
             descricao TEXT NOT NULL,
@@ -82,10 +475,9 @@ def iniciar_database():
             data_custo DATE NOT NULL,
             recorrente BOOLEAN DEFAULT 0
         )
-    ''')
-
-    # Tabela de movimentações de estoque
-    conn.execute('''
+        ''',
+        # Tabela de movimentações de estoque
+        '''
         CREATE TABLE IF NOT EXISTS movimentacoes_estoque (
             id INTEGER PRIMARY KEY,
             ingrediente_id INTEGER NOT NULL,
@@ -95,10 +487,9 @@ def iniciar_database():
             data_movimentacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (ingrediente_id) REFERENCES ingredientes (id)
         )
-    ''')
-
-    # Tabela de usuários
-    conn.execute('''
+        ''',
+        # Tabela de usuários
+        '''
         CREATE TABLE IF NOT EXISTS usuarios (
             id INTEGER PRIMARY KEY,
             username TEXT UNIQUE NOT NULL,
@@ -110,8 +501,519 @@ def iniciar_database():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             last_login TIMESTAMP
         )
-    ''')
+        ''',
+        # Estoque de produtos prontos (antes criada na página de receitas)
+        '''
+        CREATE TABLE IF NOT EXISTS estoque_pronto (
+            id INTEGER PRIMARY KEY,
+            produto_id INTEGER NOT NULL,
+            quantidade_atual REAL DEFAULT 0,
+            ultima_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (produto_id) REFERENCES produtos (id)
+        )
+        ''',
+    ]),
+    (2, "Índices das consultas de vendas, estoque e receitas", [
+        "CREATE INDEX IF NOT EXISTS idx_itens_venda_venda ON itens_venda (venda_id)",
+        "CREATE INDEX IF NOT EXISTS idx_itens_venda_produto ON itens_venda (produto_id)",
+        # data_venda + rowid(id) implícito: cobre filtros por período e ordenação por (data, id)
+        "CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas (data_venda)",
+        "CREATE INDEX IF NOT EXISTS idx_mov_ingrediente_data ON movimentacoes_estoque (ingrediente_id, data_movimentacao)",
+        # As telas filtram por DATE(data_movimentacao): índice na expressão
+        "CREATE INDEX IF NOT EXISTS idx_mov_dia ON movimentacoes_estoque (DATE(data_movimentacao))",
+        # receitas(produto_id) já é coberto pelo UNIQUE(produto_id, ingrediente_id);
+        # o índice reverso serve para achar os produtos que usam um ingrediente
+        "CREATE INDEX IF NOT EXISTS idx_receitas_ingrediente ON receitas (ingrediente_id)",
+        "CREATE INDEX IF NOT EXISTS idx_custos_data ON custos_operacionais (data_custo)",
+        "CREATE INDEX IF NOT EXISTS idx_estoque_pronto_produto ON estoque_pronto (produto_id)",
+    ]),
+    (3, "Tabela materializada de custo variável por produto", [
+        '''
+        CREATE TABLE IF NOT EXISTS custo_produto (
+            produto_id INTEGER PRIMARY KEY,
+            custo REAL NOT NULL DEFAULT 0,
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (produto_id) REFERENCES produtos (id) ON DELETE CASCADE
+        )
+        ''',
+        _sql_recalcular_custo("1 = 1"),
+        # Receita alterada: recalcula só o produto da linha
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_receita_ins AFTER INSERT ON receitas
+        BEGIN
+            {_sql_recalcular_custo("p.id = NEW.produto_id")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_receita_upd AFTER UPDATE ON receitas
+        BEGIN
+            {_sql_recalcular_custo("p.id IN (NEW.produto_id, OLD.produto_id)")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_receita_del AFTER DELETE ON receitas
+        BEGIN
+            {_sql_recalcular_custo("p.id = OLD.produto_id")};
+        END
+        ''',
+        # Preço de ingrediente alterado: índice reverso receitas(ingrediente_id)
+        # limita o recálculo aos produtos que usam o ingrediente
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_ingrediente_preco
+        AFTER UPDATE OF preco_kg ON ingredientes
+        WHEN NEW.preco_kg IS NOT OLD.preco_kg
+        BEGIN
+            {_sql_recalcular_custo("p.id IN (SELECT produto_id FROM receitas WHERE ingrediente_id = NEW.id)")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_ingrediente_del AFTER DELETE ON ingredientes
+        BEGIN
+            {_sql_recalcular_custo("p.id IN (SELECT produto_id FROM receitas WHERE ingrediente_id = OLD.id)")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_produto_ins AFTER INSERT ON produtos
+        BEGIN
+            {_sql_recalcular_custo("p.id = NEW.id")};
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_produto_del AFTER DELETE ON produtos
+        BEGIN
+            DELETE FROM custo_produto WHERE produto_id = OLD.id;
+        END
+        ''',
+    ]),
+    (4, "Rollups de vendas por dia, produto/dia e hora", [
+        '''
+        CREATE TABLE IF NOT EXISTS vendas_dia (
+            data_venda DATE PRIMARY KEY,
+            num_vendas INTEGER NOT NULL DEFAULT 0,
+            faturamento REAL NOT NULL DEFAULT 0,
+            custo_variavel REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS vendas_produto_dia (
+            data_venda DATE NOT NULL,
+            produto_id INTEGER NOT NULL,
+            quantidade REAL NOT NULL DEFAULT 0,
+            faturamento REAL NOT NULL DEFAULT 0,
+            custo_variavel REAL NOT NULL DEFAULT 0,
+            num_vendas INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (data_venda, produto_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS vendas_hora (
+            data_venda DATE NOT NULL,
+            hora INTEGER NOT NULL,
+            num_vendas INTEGER NOT NULL DEFAULT 0,
+            faturamento REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (data_venda, hora)
+        ) WITHOUT ROWID
+        ''',
+        *sql_rollups_vendas("1 = 1"),
+    ]),
+    (5, "Contadores de escrita por tabela (invalidação de cache entre processos)", [
+        '''
+        CREATE TABLE IF NOT EXISTS versao_tabelas (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        "INSERT OR IGNORE INTO versao_tabelas (tabela) VALUES "
+        + ", ".join(f"('{t}')" for t in TABELAS_VERSIONADAS),
+        *[comando for t in TABELAS_VERSIONADAS for comando in _sql_triggers_versao(t)],
+    ]),
+    (6, "Reservas de ingredientes para carrinhos em andamento", [
+        '''
+        CREATE TABLE IF NOT EXISTS reservas_estoque (
+            sessao TEXT NOT NULL,
+            ingrediente_id INTEGER NOT NULL,
+            quantidade REAL NOT NULL,
+            expira_em TIMESTAMP NOT NULL,
+            PRIMARY KEY (sessao, ingrediente_id),
+            FOREIGN KEY (ingrediente_id) REFERENCES ingredientes (id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_reservas_ingrediente ON reservas_estoque (ingrediente_id, expira_em)",
+    ]),
+    (7, "Razão de estoque como fonte da verdade, com snapshots por ingrediente", [
+        # Saldo de cada ingrediente com as movimentações anteriores a data_corte
+        '''
+        CREATE TABLE IF NOT EXISTS snapshots_estoque (
+            ingrediente_id INTEGER NOT NULL,
+            data_corte DATE NOT NULL,
+            saldo REAL NOT NULL,
+            PRIMARY KEY (ingrediente_id, data_corte),
+            FOREIGN KEY (ingrediente_id) REFERENCES ingredientes (id)
+        ) WITHOUT ROWID
+        ''',
+        # Abertura: o que o contador tinha a mais (ou a menos) que o razão vira um ajuste
+        f'''
+        INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo)
+        SELECT i.id, 'ajuste',
+               i.estoque_atual - COALESCE(SUM({sql_delta_movimentacao("m")}), 0),
+               'Abertura do razão de estoque'
+        FROM ingredientes i
+        LEFT JOIN movimentacoes_estoque m ON m.ingrediente_id = i.id
+        GROUP BY i.id
+        HAVING ABS(i.estoque_atual - COALESCE(SUM({sql_delta_movimentacao("m")}), 0)) > 1e-9
+        ''',
+        f'''
+        INSERT INTO snapshots_estoque (ingrediente_id, data_corte, saldo)
+        SELECT i.id, DATE('now'), COALESCE(SUM({sql_delta_movimentacao("m")}), 0)
+        FROM ingredientes i
+        LEFT JOIN movimentacoes_estoque m
+            ON m.ingrediente_id = i.id AND m.data_movimentacao < DATE('now')
+        GROUP BY i.id
+        ''',
+        # A partir daqui estoque_atual é só a projeção do razão, mantida por trigger
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_razao_mov_ins AFTER INSERT ON movimentacoes_estoque
+        BEGIN
+            {_sql_aplicar_movimentacao("NEW", 1)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_razao_mov_del AFTER DELETE ON movimentacoes_estoque
+        BEGIN
+            {_sql_aplicar_movimentacao("OLD", -1)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_razao_mov_upd AFTER UPDATE ON movimentacoes_estoque
+        BEGIN
+            {_sql_aplicar_movimentacao("OLD", -1)}
+            {_sql_aplicar_movimentacao("NEW", 1)}
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_razao_ingrediente_del AFTER DELETE ON ingredientes
+        BEGIN
+            DELETE FROM snapshots_estoque WHERE ingrediente_id = OLD.id;
+        END
+        ''',
+    ]),
+    (8, "Registro das execuções de conciliação do estoque", [
+        '''
+        CREATE TABLE IF NOT EXISTS conciliacoes_estoque (
+            id INTEGER PRIMARY KEY,
+            executado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ate_mov_id INTEGER NOT NULL,
+            incremental BOOLEAN NOT NULL,
+            verificados INTEGER NOT NULL,
+            divergentes INTEGER NOT NULL,
+            corrigidos INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    (9, "Sub-receitas e receita expandida (BOM) materializada", [
+        # Componente de receita que é outro produto (massa base, levain...):
+        # quantidade = unidades do subproduto por unidade do produto
+        '''
+        CREATE TABLE IF NOT EXISTS subreceitas (
+            id INTEGER PRIMARY KEY,
+            produto_id INTEGER NOT NULL,
+            subproduto_id INTEGER NOT NULL,
+            quantidade REAL NOT NULL,
+            FOREIGN KEY (produto_id) REFERENCES produtos (id) ON DELETE CASCADE,
+            FOREIGN KEY (subproduto_id) REFERENCES produtos (id) ON DELETE CASCADE,
+            UNIQUE(produto_id, subproduto_id),
+            CHECK (produto_id <> subproduto_id)
+        )
+        ''',
+        # Reverso: produtos que usam um subproduto (propagar mudanças para cima)
+        "CREATE INDEX IF NOT EXISTS idx_subreceitas_subproduto ON subreceitas (subproduto_id)",
+        # Ingredientes crus por unidade de produto, com as sub-receitas explodidas;
+        # regravada pela aplicação (funcoesAux) a cada mudança de receita
+        '''
+        CREATE TABLE IF NOT EXISTS receitas_expandidas (
+            produto_id INTEGER NOT NULL,
+            ingrediente_id INTEGER NOT NULL,
+            quantidade REAL NOT NULL,
+            PRIMARY KEY (produto_id, ingrediente_id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_receitas_expandidas_ingrediente ON receitas_expandidas (ingrediente_id)",
+        # Sem sub-receitas ainda: a expansão é a própria receita
+        '''
+        INSERT OR REPLACE INTO receitas_expandidas (produto_id, ingrediente_id, quantidade)
+        SELECT produto_id, ingrediente_id, SUM(quantidade) FROM receitas GROUP BY produto_id, ingrediente_id
+        ''',
+        "INSERT OR IGNORE INTO versao_tabelas (tabela) VALUES ('subreceitas'), ('receitas_expandidas')",
+        *_sql_triggers_versao('subreceitas'),
+        *_sql_triggers_versao('receitas_expandidas'),
+        # Custo materializado passa a seguir a receita expandida
+        "DROP TRIGGER IF EXISTS trg_custo_receita_ins",
+        "DROP TRIGGER IF EXISTS trg_custo_receita_upd",
+        "DROP TRIGGER IF EXISTS trg_custo_receita_del",
+        "DROP TRIGGER IF EXISTS trg_custo_ingrediente_preco",
+        "DROP TRIGGER IF EXISTS trg_custo_ingrediente_del",
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_bom_ins AFTER INSERT ON receitas_expandidas
+        BEGIN
+            {_sql_recalcular_custo_bom("p.id = NEW.produto_id")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_bom_upd AFTER UPDATE ON receitas_expandidas
+        BEGIN
+            {_sql_recalcular_custo_bom("p.id IN (NEW.produto_id, OLD.produto_id)")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_bom_del AFTER DELETE ON receitas_expandidas
+        BEGIN
+            {_sql_recalcular_custo_bom("p.id = OLD.produto_id")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_ingrediente_preco
+        AFTER UPDATE OF preco_kg ON ingredientes
+        WHEN NEW.preco_kg IS NOT OLD.preco_kg
+        BEGIN
+            {_sql_recalcular_custo_bom("p.id IN (SELECT produto_id FROM receitas_expandidas WHERE ingrediente_id = NEW.id)")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_ingrediente_del AFTER DELETE ON ingredientes
+        BEGIN
+            {_sql_recalcular_custo_bom("p.id IN (SELECT produto_id FROM receitas_expandidas WHERE ingrediente_id = OLD.id)")};
+        END
+        ''',
+        _sql_recalcular_custo_bom("1 = 1"),
+    ]),
+    (10, "Registro do arquivamento de meses fechados em Parquet", [
+        # ate = primeiro dia ainda no banco; o que é anterior está no arquivo frio
+        '''
+        CREATE TABLE IF NOT EXISTS arquivamentos (
+            id INTEGER PRIMARY KEY,
+            executado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ate DATE NOT NULL,
+            vendas INTEGER NOT NULL,
+            itens_venda INTEGER NOT NULL,
+            movimentacoes INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    (11, "Custo materializado por UPSERT (compatível com ON CONFLICT em quem dispara)", [
+        # Dentro de trigger, o INSERT OR REPLACE herda o ON CONFLICT do comando que disparou
+        # (ex.: INSERT ... ON CONFLICT(nome) DO UPDATE da importação de ingredientes) e
+        # falha com UNIQUE em custo_produto; os triggers de custo passam a usar UPSERT
+        "DROP TRIGGER IF EXISTS trg_custo_bom_ins",
+        "DROP TRIGGER IF EXISTS trg_custo_bom_upd",
+        "DROP TRIGGER IF EXISTS trg_custo_bom_del",
+        "DROP TRIGGER IF EXISTS trg_custo_ingrediente_preco",
+        "DROP TRIGGER IF EXISTS trg_custo_ingrediente_del",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_bom_ins
+        AFTER INSERT ON receitas_expandidas
+        BEGIN
+            INSERT INTO custo_produto (produto_id, custo, atualizado_em)
+            SELECT p.id,
+                   COALESCE((
+                       SELECT SUM(re.quantidade * i.preco_kg)
+                       FROM receitas_expandidas re
+                       JOIN ingredientes i ON re.ingrediente_id = i.id
+                       WHERE re.produto_id = p.id
+                   ), 0),
+                   CURRENT_TIMESTAMP
+            FROM produtos p
+            WHERE p.id = NEW.produto_id
+            ON CONFLICT (produto_id) DO UPDATE SET
+                custo = excluded.custo,
+                atualizado_em = excluded.atualizado_em;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_bom_upd
+        AFTER UPDATE ON receitas_expandidas
+        BEGIN
+            INSERT INTO custo_produto (produto_id, custo, atualizado_em)
+            SELECT p.id,
+                   COALESCE((
+                       SELECT SUM(re.quantidade * i.preco_kg)
+                       FROM receitas_expandidas re
+                       JOIN ingredientes i ON re.ingrediente_id = i.id
+                       WHERE re.produto_id = p.id
+                   ), 0),
+                   CURRENT_TIMESTAMP
+            FROM produtos p
+            WHERE p.id IN (NEW.produto_id, OLD.produto_id)
+            ON CONFLICT (produto_id) DO UPDATE SET
+                custo = excluded.custo,
+                atualizado_em = excluded.atualizado_em;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_bom_del
+        AFTER DELETE ON receitas_expandidas
+        BEGIN
+            INSERT INTO custo_produto (produto_id, custo, atualizado_em)
+            SELECT p.id,
+                   COALESCE((
+                       SELECT SUM(re.quantidade * i.preco_kg)
+                       FROM receitas_expandidas re
+                       JOIN ingredientes i ON re.ingrediente_id = i.id
+                       WHERE re.produto_id = p.id
+                   ), 0),
+                   CURRENT_TIMESTAMP
+            FROM produtos p
+            WHERE p.id = OLD.produto_id
+            ON CONFLICT (produto_id) DO UPDATE SET
+                custo = excluded.custo,
+                atualizado_em = excluded.atualizado_em;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_ingrediente_preco
+        AFTER UPDATE OF preco_kg ON ingredientes
+        WHEN NEW.preco_kg IS NOT OLD.preco_kg
+        BEGIN
+            INSERT INTO custo_produto (produto_id, custo, atualizado_em)
+            SELECT p.id,
+                   COALESCE((
+                       SELECT SUM(re.quantidade * i.preco_kg)
+                       FROM receitas_expandidas re
+                       JOIN ingredientes i ON re.ingrediente_id = i.id
+                       WHERE re.produto_id = p.id
+                   ), 0),
+                   CURRENT_TIMESTAMP
+            FROM produtos p
+            WHERE p.id IN (SELECT produto_id FROM receitas_expandidas WHERE ingrediente_id = NEW.id)
+            ON CONFLICT (produto_id) DO UPDATE SET
+                custo = excluded.custo,
+                atualizado_em = excluded.atualizado_em;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_custo_ingrediente_del
+        AFTER DELETE ON ingredientes
+        BEGIN
+            INSERT INTO custo_produto (produto_id, custo, atualizado_em)
+            SELECT p.id,
+                   COALESCE((
+                       SELECT SUM(re.quantidade * i.preco_kg)
+                       FROM receitas_expandidas re
+                       JOIN ingredientes i ON re.ingrediente_id = i.id
+                       WHERE re.produto_id = p.id
+                   ), 0),
+                   CURRENT_TIMESTAMP
+            FROM produtos p
+            WHERE p.id IN (SELECT produto_id FROM receitas_expandidas WHERE ingrediente_id = OLD.id)
+            ON CONFLICT (produto_id) DO UPDATE SET
+                custo = excluded.custo,
+                atualizado_em = excluded.atualizado_em;
+        END
+        ''',
+    ]),
+    (12, "Ingredientes pendentes de conciliação, marcados por trigger", [
+        # Qualquer mudança em estoque_atual (pelo razão ou por fora dele) e qualquer
+        # movimentação incluída, alterada ou excluída marca o ingrediente para a
+        # próxima conciliação incremental; a conciliação desmarca o que conferiu
+        '''
+        CREATE TABLE IF NOT EXISTS conciliacao_pendente (
+            ingrediente_id INTEGER PRIMARY KEY
+        )
+        ''',
+        "INSERT OR IGNORE INTO conciliacao_pendente (ingrediente_id) SELECT id FROM ingredientes",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_conciliacao_ingrediente_ins AFTER INSERT ON ingredientes
+        BEGIN
+            INSERT INTO conciliacao_pendente (ingrediente_id)
+            SELECT NEW.id WHERE NOT EXISTS (SELECT 1 FROM conciliacao_pendente WHERE ingrediente_id = NEW.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_conciliacao_ingrediente_upd
+        AFTER UPDATE OF estoque_atual ON ingredientes
+        WHEN NEW.estoque_atual IS NOT OLD.estoque_atual
+        BEGIN
+            INSERT INTO conciliacao_pendente (ingrediente_id)
+            SELECT NEW.id WHERE NOT EXISTS (SELECT 1 FROM conciliacao_pendente WHERE ingrediente_id = NEW.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_conciliacao_mov_ins AFTER INSERT ON movimentacoes_estoque
+        BEGIN
+            INSERT INTO conciliacao_pendente (ingrediente_id)
+            SELECT NEW.ingrediente_id WHERE NOT EXISTS (SELECT 1 FROM conciliacao_pendente WHERE ingrediente_id = NEW.ingrediente_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_conciliacao_mov_del AFTER DELETE ON movimentacoes_estoque
+        BEGIN
+            INSERT INTO conciliacao_pendente (ingrediente_id)
+            SELECT OLD.ingrediente_id WHERE NOT EXISTS (SELECT 1 FROM conciliacao_pendente WHERE ingrediente_id = OLD.ingrediente_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_conciliacao_mov_upd AFTER UPDATE ON movimentacoes_estoque
+        BEGIN
+            INSERT INTO conciliacao_pendente (ingrediente_id)
+            SELECT OLD.ingrediente_id WHERE NOT EXISTS (SELECT 1 FROM conciliacao_pendente WHERE ingrediente_id = OLD.ingrediente_id);
+            INSERT INTO conciliacao_pendente (ingrediente_id)
+            SELECT NEW.ingrediente_id WHERE NOT EXISTS (SELECT 1 FROM conciliacao_pendente WHERE ingrediente_id = NEW.ingrediente_id);
+        END
+        ''',
+    ]),
+    (13, "Abertura do razão de estoque datada no início do histórico de cada ingrediente", [
+        # A abertura da migração 7 ficou com a data do upgrade, depois das movimentações que
+        # já existiam: o saldo em qualquer data anterior ao upgrade saía errado. Ela passa
+        # para a primeira movimentação do ingrediente (ou o cadastro, se anterior); o trigger
+        # de alteração do razão leva a diferença aos snapshots do intervalo
+        '''
+        UPDATE movimentacoes_estoque
+        SET data_movimentacao = MIN(
+            data_movimentacao,
+            COALESCE((
+                SELECT MIN(o.data_movimentacao) FROM movimentacoes_estoque o
+                WHERE o.ingrediente_id = movimentacoes_estoque.ingrediente_id
+                AND o.id <> movimentacoes_estoque.id
+            ), data_movimentacao),
+            COALESCE((
+                SELECT i.created_at FROM ingredientes i
+                WHERE i.id = movimentacoes_estoque.ingrediente_id
+            ), data_movimentacao)
+        )
+        WHERE tipo = 'ajuste' AND motivo = 'Abertura do razão de estoque'
+        ''',
+    ]),
+]
+
+
+def versao_schema(conn):
+    """Versão atual do schema gravada no arquivo do banco"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
 
-    conn.commit()
-    return conn
-    
\ No newline at end of file
+
+def aplicar_migracoes(conn):
+    """Aplica, em ordem, as migrações ainda não executadas neste banco"""
+    for versao, descricao, comandos in MIGRACOES:
+        if versao <= versao_schema(conn):
+            continue
+        # BEGIN IMMEDIATE: se dois processos sobem juntos, só um migra por vez
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if versao <= versao_schema(conn):
+                conn.rollback()
+                continue
+            for comando in comandos:
+                conn.execute(comando)
+            conn.execute(f'PRAGMA user_version = {int(versao)}')
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise RuntimeError(f"Falha na migração {versao} ({descricao}): {e}") from e
+    return versao_schema(conn)
+
+
+@st.cache_resource
+def iniciar_database():
+    """Cria o pool de conexões e aplica as migrações (uma vez por processo)"""
+    pool = PoolConexoes(CAMINHO_BANCO)
+    aplicar_migracoes(pool.conexao())
+    return pool
@@ -0,0 +1,120 @@
+"""
+Comandos de manutenção do Natureba (rodar no terminal, fora do Streamlit)
+
+    python comandos.py rollups [--inicio AAAA-MM-DD] [--fim AAAA-MM-DD]
+    python comandos.py snapshot-estoque [--data AAAA-MM-DD | --se-necessario]
+    python comandos.py conciliar-estoque [--incremental] [--corrigir]
+    python comandos.py backup [--compressao gzip|zstd]
+    python comandos.py arquivar [--meses N]
+    python comandos.py importar-vendas ARQUIVO [--baixar-estoque] [--ignorar-invalidos]
+    python comandos.py importar-ingredientes ARQUIVO [--simular]
+"""
+import argparse
+import sys
+from funcoesAux import reconstruir_rollups, gerar_snapshot_estoque, snapshot_estoque_se_necessario, conciliar_estoque
+from backup import gerar_backup, compressoes_disponiveis
+from arquivamento import arquivar_historico, MESES_QUENTES
+from importacao import importar_vendas, importar_ingredientes
+
+
+def cmd_rollups(args):
+    sucesso, msg = reconstruir_rollups(args.inicio, args.fim)
+    print(msg)
+    return 0 if sucesso else 1
+
+
+def cmd_snapshot_estoque(args):
+    if args.se_necessario:
+        sucesso, msg = snapshot_estoque_se_necessario()
+    else:
+        sucesso, msg = gerar_snapshot_estoque(args.data)
+    print(msg)
+    return 0 if sucesso else 1
+
+
+def cmd_conciliar_estoque(args):
+    sucesso, msg, divergencias = conciliar_estoque(args.incremental, args.corrigir)
+    print(msg)
+    if divergencias is not None and not divergencias.empty:
+        print(divergencias.to_string(index=False))
+    return 0 if sucesso else 1
+
+
+def cmd_backup(args):
+    sucesso, msg, _ = gerar_backup(args.compressao)
+    print(msg)
+    return 0 if sucesso else 1
+
+
+def cmd_arquivar(args):
+    sucesso, msg = arquivar_historico(args.meses)
+    print(msg)
+    return 0 if sucesso else 1
+
+
+def cmd_importar_vendas(args):
+    sucesso, msg, erros = importar_vendas(args.arquivo, baixar_estoque=args.baixar_estoque,
+                                          ignorar_invalidos=args.ignorar_invalidos)
+    print(msg)
+    if erros is not None and not erros.empty:
+        print(erros.head(50).to_string(index=False))
+    return 0 if sucesso else 1
+
+
+def cmd_importar_ingredientes(args):
+    sucesso, msg, alteracoes, produtos = importar_ingredientes(args.arquivo, aplicar=not args.simular)
+    print(msg)
+    for tabela in (alteracoes, produtos):
+        if tabela is not None and not tabela.empty:
+            print(tabela.to_string(index=False))
+    return 0 if sucesso else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Comandos de manutenção do Natureba")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("rollups", help="Reconstrói os rollups de vendas a partir do histórico")
+    p.add_argument("--inicio", help="Data inicial (AAAA-MM-DD); padrão: todo o histórico")
+    p.add_argument("--fim", help="Data final (AAAA-MM-DD)")
+    p.set_defaults(func=cmd_rollups)
+
+    p = sub.add_parser("snapshot-estoque", help="Grava o checkpoint do razão de estoque (agendar no cron)")
+    grupo = p.add_mutually_exclusive_group()
+    grupo.add_argument("--data", help="Data de corte (AAAA-MM-DD); padrão: hoje")
+    grupo.add_argument("--se-necessario", action="store_true",
+                       help="Só grava se o último snapshot tiver INTERVALO_SNAPSHOT_DIAS dias ou mais")
+    p.set_defaults(func=cmd_snapshot_estoque)
+
+    p = sub.add_parser("conciliar-estoque", help="Confere o estoque dos ingredientes contra o razão de movimentações")
+    p.add_argument("--incremental", action="store_true", help="Só ingredientes alterados (ou divergentes) desde a última conciliação")
+    p.add_argument("--corrigir", action="store_true", help="Realinha os contadores divergentes ao razão")
+    p.set_defaults(func=cmd_conciliar_estoque)
+
+    p = sub.add_parser("backup", help="Gera um backup online comprimido do banco (agendar no cron)")
+    p.add_argument("--compressao", choices=compressoes_disponiveis(), default="gzip",
+                   help="Algoritmo de compressão; padrão: gzip")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("arquivar", help="Move os meses fechados antigos para o arquivo Parquet (agendar no cron)")
+    p.add_argument("--meses", type=int, default=MESES_QUENTES,
+                   help=f"Meses, além do atual, que ficam no banco; padrão: {MESES_QUENTES}")
+    p.set_defaults(func=cmd_arquivar)
+
+    p = sub.add_parser("importar-vendas", help="Importa o histórico de vendas de um CSV/Parquet (uma linha por item)")
+    p.add_argument("arquivo", help="Colunas: pedido, data_venda, hora_venda, produto, quantidade, preco_unitario, observacao")
+    p.add_argument("--baixar-estoque", action="store_true", help="Lança o consumo de ingredientes no razão de estoque")
+    p.add_argument("--ignorar-invalidos", action="store_true", help="Importa as linhas válidas mesmo se houver erros")
+    p.set_defaults(func=cmd_importar_vendas)
+
+    p = sub.add_parser("importar-ingredientes", help="Atualiza ingredientes e preços a partir da lista do fornecedor")
+    p.add_argument("arquivo", help="Colunas: nome, preco_kg, unidade, fornecedor, estoque")
+    p.add_argument("--simular", action="store_true", help="Só mostra o que mudaria, sem gravar")
+    p.set_defaults(func=cmd_importar_ingredientes)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
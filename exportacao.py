@@ -0,0 +1,296 @@
+"""
+Exportação de relatórios em streaming (Excel, CSV ou Parquet)
+
+As consultas são lidas em lotes (fetchmany) e gravadas direto em um arquivo
+temporário: Excel no modo constant_memory do xlsxwriter, CSV e Parquet como
+um .zip com um arquivo por aba. Abas de dados brutos recebem, depois das
+linhas do banco, as dos meses arquivados em Parquet. A exportação roda em
+uma thread própria e a página acompanha o progresso pela tarefa.
+"""
+import csv
+import io
+import itertools
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+import pandas as pd
+from banco import get_conexao
+from arquivamento import ler_arquivo
+
+# ==============================
+# CONFIGURAÇÕES
+# ==============================
+TAMANHO_LOTE = 5000          # linhas lidas do banco por vez
+PASTA_EXPORTACOES = os.path.join(tempfile.gettempdir(), "natureba_exportacoes")
+VALIDADE_ARQUIVOS_S = 3600   # arquivos gerados há mais tempo que isso são apagados
+
+FORMATOS = {
+    'xlsx': ("Excel (.xlsx)", ".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    'csv': ("CSV (.zip)", ".zip", "application/zip"),
+    'parquet': ("Parquet (.zip)", ".zip", "application/zip"),
+}
+
+def _itens_arquivados(inicio, fim):
+    """Linhas da aba Itens Vendidos a partir do arquivo Parquet"""
+    itens = ler_arquivo('itens_venda', inicio, fim)
+    if itens.empty:
+        return itens
+    vendas = ler_arquivo('vendas', inicio, fim)[['id', 'hora_venda']].rename(columns={'id': 'venda_id'})
+    produtos = pd.read_sql_query(
+        "SELECT id AS produto_id, nome AS produto, categoria FROM produtos", get_conexao()
+    )
+    linhas = itens.merge(vendas, on='venda_id').merge(produtos, on='produto_id')
+    linhas['total'] = linhas['subtotal']
+    linhas['margem'] = linhas['subtotal'] - linhas['custo_variavel']
+    return linhas.sort_values(['data_venda', 'venda_id'], ascending=False)
+
+
+def _movimentacoes_arquivadas(inicio, fim):
+    return ler_arquivo('movimentacoes_estoque', inicio, fim)
+
+
+# (aba, consulta, arquivo); :inicio e :fim delimitam o período e arquivo(inicio, fim),
+# quando há, traz as linhas dos meses que já saíram do banco
+ABAS_RELATORIO = [
+    ("Itens Vendidos", """
+        SELECT
+            v.data_venda,
+            v.hora_venda,
+            p.nome AS produto,
+            p.categoria,
+            iv.quantidade,
+            iv.preco_unitario,
+            iv.subtotal AS total,
+            iv.custo_variavel,
+            (iv.subtotal - iv.custo_variavel) AS margem
+        FROM vendas v
+        JOIN itens_venda iv ON iv.venda_id = v.id
+        JOIN produtos p ON iv.produto_id = p.id
+        WHERE v.data_venda BETWEEN :inicio AND :fim
+        ORDER BY v.data_venda DESC, v.id DESC
+    """, _itens_arquivados),
+    # Resumo diário direto do rollup produto/dia (sem agrupar os itens em memória)
+    ("Resumo Vendas", """
+        SELECT data_venda,
+               SUM(faturamento) AS total_venda,
+               SUM(custo_variavel) AS custo_total,
+               SUM(faturamento - custo_variavel) AS margem_total,
+               SUM(quantidade) AS qtd_itens
+        FROM vendas_produto_dia
+        WHERE data_venda BETWEEN :inicio AND :fim
+        GROUP BY data_venda
+        ORDER BY data_venda
+    """, None),
+    ("Produtos", "SELECT * FROM produtos", None),
+    ("Custos Operacionais", """
+        SELECT * FROM custos_operacionais
+        WHERE data_custo BETWEEN :inicio AND :fim
+    """, None),
+    ("Movimentacoes Estoque", """
+        SELECT * FROM movimentacoes_estoque
+        WHERE DATE(data_movimentacao) BETWEEN :inicio AND :fim
+    """, _movimentacoes_arquivadas),
+]
+
+
+# ==============================
+# LEITURA EM LOTES
+# ==============================
+def _lotes(consulta, params):
+    """(colunas, gerador de lotes de linhas) de uma consulta, TAMANHO_LOTE por vez"""
+    cursor = get_conexao().execute(consulta, params)
+    colunas = [d[0] for d in cursor.description]
+
+    def gerar():
+        try:
+            while True:
+                linhas = cursor.fetchmany(TAMANHO_LOTE)
+                if not linhas:
+                    return
+                yield [tuple(linha) for linha in linhas]
+        finally:
+            cursor.close()
+
+    return colunas, gerar()
+
+
+def _lotes_dataframe(dados, colunas):
+    """Lotes de linhas (tuplas, na ordem de colunas) de um DataFrame, TAMANHO_LOTE por vez"""
+    dados = dados.reindex(columns=colunas).astype(object)
+    dados = dados.where(dados.notna(), None)
+    for inicio in range(0, len(dados), TAMANHO_LOTE):
+        yield list(dados.iloc[inicio:inicio + TAMANHO_LOTE].itertuples(index=False, name=None))
+
+
+# ==============================
+# ESCRITORES (um por formato)
+# ==============================
+def _gravar_xlsx(caminho, abas, progresso):
+    import xlsxwriter
+    # constant_memory: cada linha vai para o disco assim que a próxima começa
+    with xlsxwriter.Workbook(caminho, {'constant_memory': True, 'strings_to_numbers': False}) as livro:
+        for nome, colunas, lotes in abas:
+            planilha = livro.add_worksheet(nome[:31])
+            planilha.write_row(0, 0, colunas)
+            linha_atual = 1
+            for lote in lotes:
+                for linha in lote:
+                    planilha.write_row(linha_atual, 0, linha)
+                    linha_atual += 1
+                progresso(len(lote))
+
+
+def _gravar_csv(caminho, abas, progresso):
+    with zipfile.ZipFile(caminho, 'w', compression=zipfile.ZIP_DEFLATED) as pacote:
+        for nome, colunas, lotes in abas:
+            with pacote.open(f"{nome}.csv", 'w') as destino:
+                texto = io.TextIOWrapper(destino, encoding='utf-8-sig', newline='')
+                escritor = csv.writer(texto, delimiter=';')
+                escritor.writerow(colunas)
+                for lote in lotes:
+                    escritor.writerows(lote)
+                    progresso(len(lote))
+                texto.flush()
+                texto.detach()
+
+
+def _gravar_parquet(caminho, abas, progresso):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with zipfile.ZipFile(caminho, 'w', compression=zipfile.ZIP_STORED) as pacote:
+        for nome, colunas, lotes in abas:
+            with pacote.open(f"{nome}.parquet", 'w') as destino:
+                escritor = None
+                for lote in lotes:
+                    colunas_lote = list(zip(*lote))
+                    if escritor is None:
+                        # Coluna só com nulos no primeiro lote vira texto (o tipo real é desconhecido)
+                        tabela = pa.table({c: v for c, v in zip(colunas, colunas_lote)})
+                        schema = pa.schema([
+                            pa.field(campo.name, pa.string()) if pa.types.is_null(campo.type) else campo
+                            for campo in tabela.schema
+                        ])
+                        escritor = pq.ParquetWriter(destino, schema)
+                    tabela = pa.table({
+                        campo.name: pa.array(
+                            [None if v is None else str(v) for v in valores]
+                            if pa.types.is_string(campo.type) else valores,
+                            type=campo.type
+                        )
+                        for campo, valores in zip(schema, colunas_lote)
+                    })
+                    escritor.write_table(tabela)
+                    progresso(len(lote))
+                if escritor is None:
+                    escritor = pq.ParquetWriter(destino, pa.schema([pa.field(c, pa.string()) for c in colunas]))
+                escritor.close()
+
+
+_ESCRITORES = {'xlsx': _gravar_xlsx, 'csv': _gravar_csv, 'parquet': _gravar_parquet}
+
+
+# ==============================
+# TAREFAS EM SEGUNDO PLANO
+# ==============================
+class TarefaExportacao:
+    """Estado de uma exportação em andamento, compartilhado com a página"""
+
+    def __init__(self, formato, inicio, fim):
+        self.id = uuid.uuid4().hex
+        self.formato = formato
+        self.inicio = str(inicio)
+        self.fim = str(fim)
+        self.status = 'pendente'    # pendente → executando → concluida | erro
+        self.aba_atual = None
+        self.abas_concluidas = 0
+        self.linhas = 0
+        self.caminho = None
+        self.erro = None
+
+    @property
+    def progresso(self):
+        """Fração concluída, pelas abas já gravadas"""
+        return self.abas_concluidas / len(ABAS_RELATORIO)
+
+    @property
+    def nome_arquivo(self):
+        return f"relatorio_natureba_{self.inicio}_{self.fim}{FORMATOS[self.formato][1]}"
+
+    @property
+    def mime(self):
+        return FORMATOS[self.formato][2]
+
+
+_tarefas = {}
+_lock_tarefas = threading.Lock()
+
+
+def _limpar_antigos():
+    """Apaga arquivos de exportações antigas da pasta temporária"""
+    limite = time.time() - VALIDADE_ARQUIVOS_S
+    for nome in os.listdir(PASTA_EXPORTACOES):
+        caminho = os.path.join(PASTA_EXPORTACOES, nome)
+        try:
+            if os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+        except OSError:
+            pass
+    with _lock_tarefas:
+        for tarefa_id in [t.id for t in _tarefas.values() if t.caminho and not os.path.exists(t.caminho)]:
+            _tarefas.pop(tarefa_id, None)
+
+
+def exportar_relatorio(tarefa):
+    """Executa a exportação da tarefa, gravando o arquivo em PASTA_EXPORTACOES"""
+    tarefa.status = 'executando'
+    params = {'inicio': tarefa.inicio, 'fim': tarefa.fim}
+    fd, caminho = tempfile.mkstemp(suffix=FORMATOS[tarefa.formato][1], dir=PASTA_EXPORTACOES)
+    os.close(fd)
+
+    def abas():
+        for nome, consulta, arquivo in ABAS_RELATORIO:
+            tarefa.aba_atual = nome
+            colunas, lotes = _lotes(consulta, params)
+            if arquivo is not None:
+                lotes = itertools.chain(lotes, _lotes_dataframe(arquivo(tarefa.inicio, tarefa.fim), colunas))
+            yield nome, colunas, lotes
+            tarefa.abas_concluidas += 1
+
+    def progresso(linhas):
+        tarefa.linhas += linhas
+
+    try:
+        _ESCRITORES[tarefa.formato](caminho, abas(), progresso)
+        tarefa.caminho = caminho
+        tarefa.status = 'concluida'
+    except Exception as e:
+        tarefa.erro = str(e)
+        tarefa.status = 'erro'
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+def iniciar_exportacao(formato, inicio, fim):
+    """Dispara a exportação em uma thread e retorna a tarefa para acompanhamento"""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportação desconhecido: {formato}")
+    os.makedirs(PASTA_EXPORTACOES, exist_ok=True)
+    _limpar_antigos()
+    tarefa = TarefaExportacao(formato, inicio, fim)
+    with _lock_tarefas:
+        _tarefas[tarefa.id] = tarefa
+    threading.Thread(target=exportar_relatorio, args=(tarefa,), daemon=True,
+                     name=f"exportacao-{tarefa.id[:8]}").start()
+    return tarefa
+
+
+def get_tarefa(tarefa_id):
+    """Tarefa de exportação pelo id (None se já expirou)"""
+    with _lock_tarefas:
+        return _tarefas.get(tarefa_id)
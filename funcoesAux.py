@@ -1,6 +1,15 @@
 import hashlib
-from banco import sqlite3
+import json
+import re
+import time
+from banco import (
+    sqlite3, get_conexao, transacao, em_transacao,
+    versao_dados, versao_tabelas, invalidar_dados, registrar_escrita,
+    sql_rollups_vendas, sql_delta_movimentacao, TABELAS_ROLLUP
+)
+from arquivamento import get_corte_arquivo, ler_arquivo, get_saldos_arquivo
 import streamlit as st
+import numpy as np
 import pandas as pd
 from datetime import datetime   
 
@@ -8,36 +17,55 @@ from datetime import datetime
 # CONSTANTES / CONFIGURAÇÕES
 # ==============================
 SALT = "natureba_padaria_2025"
+TTL_RESERVA_MIN = 15        # minutos que a reserva de um carrinho segura o estoque
+TENTATIVAS_CHECKOUT = 3     # tentativas de gravar a venda quando o banco está ocupado
+INTERVALO_SNAPSHOT_DIAS = 7 # dias entre snapshots automáticos do razão de estoque
+TOLERANCIA_CONCILIACAO = 1e-6  # diferença contador x razão considerada arredondamento
 
 
 # ==============================
 # FUNÇÕES DE BANCO DE DADOS
 # (conexão e wrappers)
 # ==============================
-@st.cache_resource
-def iniciar_database():
-    conn = sqlite3.connect('natureba.db', check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 # Funções auxiliares de acesso ao DB
+# (cada thread usa sua própria conexão do pool definido em banco.py)
+_RE_TABELA_ESCRITA = re.compile(
+    r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+["`\[]?(\w+)',
+    re.IGNORECASE
+)
+
+def _tabelas_alteradas(query):
+    """Tabela alvo de um INSERT/UPDATE/DELETE; vazio quando não dá para saber"""
+    m = _RE_TABELA_ESCRITA.match(query)
+    return (m.group(1).lower(),) if m else ()
+
 def executar_query(query, params=None):
     """Executa uma query no banco de dados"""
-    conn = iniciar_database()
-    if params:
-        result = conn.execute(query, params)
-    else:
-        result = conn.execute(query)
+    conn = get_conexao()
+    try:
+        if params:
+            result = conn.execute(query, params)
+        else:
+            result = conn.execute(query)
+    except Exception:
+        # Não deixar a conexão da thread presa em uma transação aberta
+        # (dentro de transacao() quem desfaz é o próprio bloco)
+        if conn.in_transaction and not em_transacao():
+            conn.rollback()
+        raise
     
     if query.strip().upper().startswith('SELECT'):
         return result.fetchall()
     else:
-        conn.commit()
+        if not em_transacao():
+            conn.commit()
+        # Invalida os caches da tabela alterada (dentro de transacao(), no commit)
+        registrar_escrita(*_tabelas_alteradas(query))
         return result.lastrowid
 
 def get_dataframe(query, params=None):
     """Retorna um DataFrame a partir de uma query"""
-    conn = iniciar_database()
+    conn = get_conexao()
     if params:
         return pd.read_sql_query(query, conn, params=params)
     else:
@@ -69,12 +97,96 @@ def format_brl_percent(valor):
     return f"{s}%"
 
 
+# ==============================
+# DADOS DE REFERÊNCIA
+# (cadastros compartilhados entre sessões; cada cache usa a versão das
+#  tabelas que lê e é invalidado por executar_query/registrar_escrita)
+# ==============================
+@st.cache_data(max_entries=4, show_spinner=False)
+def _produtos(versao):
+    return get_dataframe("SELECT id, nome, preco_venda, categoria, ativo FROM produtos ORDER BY nome")
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _ingredientes(versao):
+    return get_dataframe("""
+        SELECT id, nome, preco_kg, estoque_atual, unidade, fornecedor
+        FROM ingredientes
+        ORDER BY nome
+    """)
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _receitas(versao):
+    return get_dataframe("SELECT id, produto_id, ingrediente_id, quantidade FROM receitas ORDER BY produto_id, id")
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _subreceitas(versao):
+    return get_dataframe("SELECT id, produto_id, subproduto_id, quantidade FROM subreceitas ORDER BY produto_id, id")
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _receitas_expandidas(versao):
+    return get_dataframe("SELECT produto_id, ingrediente_id, quantidade FROM receitas_expandidas ORDER BY produto_id, ingrediente_id")
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _usuarios(versao):
+    return get_dataframe("""
+        SELECT id, username, nome_completo, email, nivel, ativo, 
+               created_at, last_login
+        FROM usuarios 
+        ORDER BY created_at DESC
+    """)
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _indice_produtos(versao):
+    return _produtos(versao).set_index('id').to_dict('index')
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _indice_ingredientes(versao):
+    return _ingredientes(versao).set_index('id').to_dict('index')
+
+def get_produtos(apenas_ativos=False):
+    """Produtos cadastrados (id, nome, preco_venda, categoria, ativo), por nome"""
+    produtos = _produtos(versao_tabelas('produtos'))
+    if apenas_ativos:
+        produtos = produtos[produtos['ativo'] == 1].reset_index(drop=True)
+    return produtos
+
+def get_produtos_com_receita():
+    """Produtos ativos que têm receita cadastrada (ingredientes ou sub-receitas)"""
+    produtos = get_produtos(apenas_ativos=True)
+    receitas = get_receitas_expandidas()
+    return produtos[produtos['id'].isin(receitas['produto_id'])].reset_index(drop=True)
+
+def get_ingredientes():
+    """Ingredientes cadastrados (id, nome, preco_kg, estoque_atual, unidade, fornecedor), por nome"""
+    return _ingredientes(versao_tabelas('ingredientes'))
+
+def get_receitas():
+    """Linhas de receita (id, produto_id, ingrediente_id, quantidade)"""
+    return _receitas(versao_tabelas('receitas'))
+
+def get_subreceitas():
+    """Linhas de sub-receita (id, produto_id, subproduto_id, quantidade)"""
+    return _subreceitas(versao_tabelas('subreceitas'))
+
+def get_receitas_expandidas():
+    """Receita expandida (BOM): ingredientes crus por unidade de produto (produto_id, ingrediente_id, quantidade)"""
+    return _receitas_expandidas(versao_tabelas('receitas_expandidas'))
+
+def get_indice_produtos():
+    """Dicionário {id: {nome, preco_venda, categoria, ativo}} de todos os produtos"""
+    return _indice_produtos(versao_tabelas('produtos'))
+
+def get_indice_ingredientes():
+    """Dicionário {id: {nome, preco_kg, estoque_atual, unidade, fornecedor}} de todos os ingredientes"""
+    return _indice_ingredientes(versao_tabelas('ingredientes'))
+
+
 # ==============================
 # FUNÇÕES DE USUÁRIOS
 # ==============================
 def authenticate_user(username, password):
     """Autentica usuário e retorna dados se válido"""
-    conn = iniciar_database()
+    conn = get_conexao()
     
     password_hash = hash_password(password)
     user = conn.execute(
@@ -88,6 +200,7 @@ def authenticate_user(username, password):
             (datetime.now(), user['id'])
         )
         conn.commit()
+        invalidar_dados('usuarios')
         return dict(user)
     
     return None
@@ -108,12 +221,7 @@ def create_user(username, password, nome_completo, email="", nivel="operador"):
 
 def get_all_users():
     """Retorna todos os usuários cadastrados"""
-    return get_dataframe("""
-        SELECT id, username, nome_completo, email, nivel, ativo, 
-               created_at, last_login
-        FROM usuarios 
-        ORDER BY created_at DESC
-    """)
+    return _usuarios(versao_tabelas('usuarios'))
 
 def update_user_status(user_id, ativo):
     """Ativa/desativa usuário"""
@@ -195,13 +303,81 @@ def update_user(username, nome_completo=None, email=None, nivel=None, senha=None
 # ==============================
 # FUNÇÕES DE RECEITAS
 # ==============================
+class ReceitaCiclica(Exception):
+    """Uma sub-receita acaba usando o próprio produto"""
+
+
+def _explodir_receitas(produto_ids, diretas, subreceitas):
+    """
+    Explode as sub-receitas até os ingredientes crus, com memoização: cada
+    subproduto é expandido uma única vez, não importa quantos produtos o usem.
+    diretas = {produto: {ingrediente: qtd}}, subreceitas = {produto: {subproduto: qtd}}.
+    Retorna {produto: {ingrediente: qtd por unidade}}.
+    """
+    memo = {}
+    em_andamento = set()
+    
+    def explodir(produto):
+        if produto in memo:
+            return memo[produto]
+        if produto in em_andamento:
+            raise ReceitaCiclica(f"Sub-receita cíclica envolvendo o produto ID {produto}")
+        em_andamento.add(produto)
+        total = dict(diretas.get(produto, {}))
+        for subproduto, qtd_sub in subreceitas.get(produto, {}).items():
+            for ingrediente, qtd in explodir(subproduto).items():
+                total[ingrediente] = total.get(ingrediente, 0.0) + qtd_sub * qtd
+        em_andamento.discard(produto)
+        memo[produto] = total
+        return total
+    
+    return {produto: explodir(produto) for produto in produto_ids}
+
+def _atualizar_receitas_expandidas(conn, produto_ids):
+    """
+    Regrava a receita expandida dos produtos informados e de todos que os usam
+    como sub-receita (direta ou indiretamente). Chamar dentro de transacao().
+    """
+    afetados = [linha[0] for linha in conn.execute("""
+        WITH RECURSIVE afetados(id) AS (
+            SELECT value FROM json_each(?)
+            UNION
+            SELECT s.produto_id FROM subreceitas s JOIN afetados a ON s.subproduto_id = a.id
+        )
+        SELECT id FROM afetados
+    """, (json.dumps([int(p) for p in produto_ids]),))]
+    
+    diretas, subreceitas = {}, {}
+    for produto, ingrediente, qtd in conn.execute(
+        "SELECT produto_id, ingrediente_id, SUM(quantidade) FROM receitas GROUP BY produto_id, ingrediente_id"
+    ):
+        diretas.setdefault(produto, {})[ingrediente] = qtd
+    for produto, subproduto, qtd in conn.execute("SELECT produto_id, subproduto_id, quantidade FROM subreceitas"):
+        subreceitas.setdefault(produto, {})[subproduto] = qtd
+    expandidas = _explodir_receitas(afetados, diretas, subreceitas)
+    
+    registrar_escrita('receitas_expandidas')
+    conn.execute(
+        "DELETE FROM receitas_expandidas WHERE produto_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(afetados),)
+    )
+    conn.executemany(
+        "INSERT INTO receitas_expandidas (produto_id, ingrediente_id, quantidade) VALUES (?, ?, ?)",
+        [(produto, ingrediente, qtd)
+         for produto, itens in expandidas.items()
+         for ingrediente, qtd in itens.items()]
+    )
+
 def adicionar_item_receita(produto_id, ingrediente_id, quantidade):
     """Adiciona um ingrediente à receita de um produto"""
     try:
-        executar_query(
-            "INSERT INTO receitas (produto_id, ingrediente_id, quantidade) VALUES (?, ?, ?)",
-            (produto_id, ingrediente_id, quantidade)
-        )
+        with transacao() as conn:
+            registrar_escrita('receitas')
+            conn.execute(
+                "INSERT INTO receitas (produto_id, ingrediente_id, quantidade) VALUES (?, ?, ?)",
+                (produto_id, ingrediente_id, quantidade)
+            )
+            _atualizar_receitas_expandidas(conn, [produto_id])
         return True, "Ingrediente adicionado à receita"
     except sqlite3.IntegrityError:
         return False, "Este ingrediente já está na receita"
@@ -211,11 +387,74 @@ def adicionar_item_receita(produto_id, ingrediente_id, quantidade):
 def remover_item_receita(receita_id):
     """Remove um ingrediente da receita"""
     try:
-        executar_query("DELETE FROM receitas WHERE id = ?", (receita_id,))
+        with transacao() as conn:
+            registrar_escrita('receitas')
+            linha = conn.execute("SELECT produto_id FROM receitas WHERE id = ?", (receita_id,)).fetchone()
+            conn.execute("DELETE FROM receitas WHERE id = ?", (receita_id,))
+            if linha is not None:
+                _atualizar_receitas_expandidas(conn, [linha[0]])
         return True, "Ingrediente removido da receita"
     except Exception as e:
         return False, f"Erro ao remover da receita: {e}"
 
+def adicionar_subreceita(produto_id, subproduto_id, quantidade):
+    """Usa outro produto (massa base, levain...) como componente da receita"""
+    try:
+        with transacao() as conn:
+            # Recusa ciclos: o subproduto não pode depender (nem ser) o próprio produto
+            ciclo = conn.execute("""
+                WITH RECURSIVE componentes(id) AS (
+                    SELECT ?
+                    UNION
+                    SELECT s.subproduto_id FROM subreceitas s JOIN componentes c ON s.produto_id = c.id
+                )
+                SELECT 1 FROM componentes WHERE id = ?
+            """, (int(subproduto_id), int(produto_id))).fetchone()
+            if ciclo:
+                return False, "Sub-receita inválida: o subproduto já usa este produto"
+            registrar_escrita('subreceitas')
+            conn.execute(
+                "INSERT INTO subreceitas (produto_id, subproduto_id, quantidade) VALUES (?, ?, ?)",
+                (int(produto_id), int(subproduto_id), quantidade)
+            )
+            _atualizar_receitas_expandidas(conn, [produto_id])
+        return True, "Sub-receita adicionada"
+    except sqlite3.IntegrityError:
+        return False, "Esta sub-receita já está na receita"
+    except Exception as e:
+        return False, f"Erro: {e}"
+
+def remover_subreceita(subreceita_id):
+    """Remove uma sub-receita da receita"""
+    try:
+        with transacao() as conn:
+            registrar_escrita('subreceitas')
+            linha = conn.execute("SELECT produto_id FROM subreceitas WHERE id = ?", (subreceita_id,)).fetchone()
+            conn.execute("DELETE FROM subreceitas WHERE id = ?", (subreceita_id,))
+            if linha is not None:
+                _atualizar_receitas_expandidas(conn, [linha[0]])
+        return True, "Sub-receita removida"
+    except Exception as e:
+        return False, f"Erro ao remover sub-receita: {e}"
+
+def excluir_produto(produto_id):
+    """Exclui um produto com sua receita; quem o usava como sub-receita é recalculado"""
+    try:
+        with transacao() as conn:
+            registrar_escrita('produtos', 'receitas', 'subreceitas', 'receitas_expandidas')
+            pais = [linha[0] for linha in conn.execute(
+                "SELECT produto_id FROM subreceitas WHERE subproduto_id = ?", (produto_id,)
+            )]
+            conn.execute("DELETE FROM subreceitas WHERE produto_id = ? OR subproduto_id = ?", (produto_id, produto_id))
+            conn.execute("DELETE FROM receitas WHERE produto_id = ?", (produto_id,))
+            conn.execute("DELETE FROM receitas_expandidas WHERE produto_id = ?", (produto_id,))
+            conn.execute("DELETE FROM produtos WHERE id = ?", (produto_id,))
+            if pais:
+                _atualizar_receitas_expandidas(conn, pais)
+        return True, "Produto excluído"
+    except Exception as e:
+        return False, f"Erro ao excluir produto: {e}"
+
 def get_receita_produto(produto_id):
     """Retorna a receita completa de um produto"""
     return get_dataframe("""
@@ -227,102 +466,714 @@ def get_receita_produto(produto_id):
         WHERE r.produto_id = ?
     """, (produto_id,))
 
+def get_receita_expandida_produto(produto_id):
+    """Ingredientes crus de um produto (sub-receitas explodidas), no formato de get_receita_produto"""
+    return get_dataframe("""
+        SELECT re.quantidade, i.nome as ingrediente,
+               i.preco_kg, i.unidade, i.estoque_atual,
+               (re.quantidade * i.preco_kg) as custo_item
+        FROM receitas_expandidas re
+        JOIN ingredientes i ON re.ingrediente_id = i.id
+        WHERE re.produto_id = ?
+        ORDER BY i.nome
+    """, (produto_id,))
+
+def get_subreceitas_produto(produto_id):
+    """Sub-receitas de um produto, com o custo de cada uma pela receita expandida"""
+    return get_dataframe("""
+        SELECT s.id, s.subproduto_id, p.nome AS subproduto, s.quantidade,
+               COALESCE(cp.custo, 0) AS custo_unitario,
+               s.quantidade * COALESCE(cp.custo, 0) AS custo_item
+        FROM subreceitas s
+        JOIN produtos p ON s.subproduto_id = p.id
+        LEFT JOIN custo_produto cp ON cp.produto_id = s.subproduto_id
+        WHERE s.produto_id = ?
+    """, (produto_id,))
+
+def calcular_custos_produtos(produto_ids=None):
+    """
+    Custo variável (pela receita) de todos os produtos, ou só dos ids informados.
+    Lê a tabela materializada custo_produto, mantida por triggers quando a
+    receita expandida ou preços de ingredientes mudam. Retorna uma Series indexada por produto_id.
+    """
+    query = "SELECT produto_id, custo FROM custo_produto"
+    params = None
+    ids = None
+    if produto_ids is not None:
+        ids = [int(x) for x in produto_ids]
+        query += " WHERE produto_id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(ids),)
+    
+    custos = get_dataframe(query, params).set_index('produto_id')['custo'].astype(float)
+    if ids is not None:
+        custos = custos.reindex(ids, fill_value=0.0)
+    return custos
+
 def calcular_custo_produto(produto_id):
     """Calcula o custo variável total de um produto baseado na receita"""
-    receita = get_receita_produto(produto_id)
-    if receita.empty:
-        return 0.0
-    return float(receita['custo_item'].sum())
+    return float(calcular_custos_produtos([produto_id]).iloc[0])
 
 def verificar_disponibilidade_receita(produto_id, quantidade_producao):
     """Verifica se há estoque suficiente para produzir X unidades"""
-    receita = get_receita_produto(produto_id)
-    if receita.empty:
-        return True, "Produto sem receita cadastrada"
-    
-    faltantes = []
-    for _, item in receita.iterrows():
-        necessario = item['quantidade'] * quantidade_producao
-        if item['estoque_atual'] < necessario:
-            faltantes.append(f"{item['ingrediente']}: falta {necessario - item['estoque_atual']:.2f} {item['unidade']}")
-    
-    if faltantes:
-        return False, "Estoque insuficiente: " + ", ".join(faltantes)
-    return True, "Estoque OK"
+    disponivel, mensagem, _ = verificar_disponibilidade_cesta([(produto_id, quantidade_producao)])
+    return disponivel, mensagem
 
 def baixar_estoque_por_receita(produto_id, quantidade_produzida):
     """Baixa o estoque dos ingredientes ao produzir/vender um produto"""
-    receita = get_receita_produto(produto_id)
-    if receita.empty:
-        return True, "Sem receita cadastrada"
+    return baixar_estoque_por_receitas([(produto_id, quantidade_produzida)])
+
+def baixar_estoque_por_receitas(itens):
+    """
+    Baixa o estoque dos ingredientes de vários (produto_id, quantidade) de uma vez:
+    o lote inteiro custa dois comandos, em uma única transação.
+    """
+    try:
+        with transacao() as conn:
+            baixados = _baixar_estoque_cesta(conn, list(itens))
+        if baixados == 0:
+            return True, "Sem receita cadastrada"
+        return True, "Estoque baixado com sucesso"
+    except Exception as e:
+        return False, f"Erro ao baixar estoque: {e}"
+
+def registrar_producao_lote(itens, data_producao=None):
+    """
+    Registra a produção de vários (produto_id, quantidade) de uma vez: confere o
+    estoque do lote inteiro, baixa os ingredientes e soma o estoque pronto,
+    tudo em uma única transação. Retorna (sucesso, mensagem, faltantes).
+    """
+    lote = {}
+    for produto_id, quantidade in itens:
+        if quantidade > 0:
+            lote[int(produto_id)] = lote.get(int(produto_id), 0) + quantidade
+    if not lote:
+        return False, "Nenhuma quantidade informada", None
+    
+    disponivel, msg, faltantes = verificar_disponibilidade_cesta(lote.items())
+    if not disponivel:
+        return False, msg, faltantes
+    
+    momento = data_producao or datetime.now()
+    try:
+        with transacao() as conn:
+            registrar_escrita('estoque_pronto')
+            _baixar_estoque_cesta(conn, lote.items())
+            # Soma em quem já tem linha no estoque pronto; cria para os demais
+            conn.executemany(
+                "UPDATE estoque_pronto SET quantidade_atual = quantidade_atual + ?, ultima_atualizacao = ? WHERE produto_id = ?",
+                [(quantidade, momento, produto_id) for produto_id, quantidade in lote.items()]
+            )
+            conn.executemany(
+                """
+                INSERT INTO estoque_pronto (produto_id, quantidade_atual, ultima_atualizacao)
+                SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM estoque_pronto WHERE produto_id = ?)
+                """,
+                [(produto_id, quantidade, momento, produto_id) for produto_id, quantidade in lote.items()]
+            )
+        total = sum(lote.values())
+        return True, f"Produção registrada: {total:.0f} unidades de {len(lote)} produto(s)", None
+    except EstoqueInsuficiente as e:
+        return False, str(e), None
+    except Exception as e:
+        return False, f"Erro ao registrar produção: {e}", None
+
+
+# Cesta de (produto_id, quantidade) passada como JSON em um único parâmetro
+_CTE_CESTA = """
+    cesta AS (
+        SELECT json_extract(value, '$[0]') AS produto_id,
+               json_extract(value, '$[1]') AS quantidade
+        FROM json_each(?)
+    )
+"""
+
+def _json_cesta(itens):
+    """Serializa [(produto_id, quantidade), ...] para o parâmetro de _CTE_CESTA"""
+    return json.dumps([[int(produto_id), quantidade] for produto_id, quantidade in itens])
+
+class EstoqueInsuficiente(Exception):
+    """Algum ingrediente não cobre o consumo no momento da baixa"""
+
+
+# Folga para arredondamento de ponto flutuante nas comparações de estoque
+_TOLERANCIA_ESTOQUE = 1e-9
+
+def _baixar_estoque_cesta(conn, itens, sessao=None):
+    """
+    Baixa os ingredientes de vários (produto_id, quantidade) gravando as saídas no
+    razão (movimentacoes_estoque); o trigger do razão atualiza estoque_atual.
+    A baixa é condicional: se algum ingrediente não cobre o consumo (descontadas
+    as reservas ativas de outras sessões), levanta EstoqueInsuficiente e a
+    transação inteira é desfeita. Chamar dentro de transacao(): o BEGIN IMMEDIATE
+    garante que ninguém escreve entre a conferência e a baixa.
+    """
+    cesta = _json_cesta(itens)
+    registrar_escrita('movimentacoes_estoque', 'ingredientes')
     
+    # Consumo total agregado por ingrediente contra o disponível (saldo menos reservas alheias)
+    consumo = conn.execute(f"""
+        WITH {_CTE_CESTA},
+        reservado AS (
+            SELECT ingrediente_id, SUM(quantidade) AS quantidade
+            FROM reservas_estoque
+            WHERE expira_em > datetime('now') AND sessao IS NOT ?
+            GROUP BY ingrediente_id
+        )
+        SELECT i.nome, i.unidade,
+               SUM(r.quantidade * c.quantidade) - (i.estoque_atual - COALESCE(rs.quantidade, 0)) AS falta
+        FROM cesta c
+        JOIN receitas_expandidas r ON r.produto_id = c.produto_id
+        JOIN ingredientes i ON i.id = r.ingrediente_id
+        LEFT JOIN reservado rs ON rs.ingrediente_id = i.id
+        GROUP BY i.id
+    """, (cesta, sessao)).fetchall()
+    detalhes = [f"{nome}: falta {falta:.2f} {unidade}" for nome, unidade, falta in consumo if falta > _TOLERANCIA_ESTOQUE]
+    if detalhes:
+        raise EstoqueInsuficiente("Estoque insuficiente: " + ", ".join(detalhes))
+    
+    # Registrar saídas (uma por ingrediente de cada linha), só de ingredientes que existem
+    conn.execute(f"""
+        WITH {_CTE_CESTA}
+        INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo)
+        SELECT r.ingrediente_id, 'saida', r.quantidade * c.quantidade,
+               'Produção/Venda: ' || c.quantidade || 'x produto ID ' || c.produto_id
+        FROM cesta c
+        JOIN receitas_expandidas r ON r.produto_id = c.produto_id
+        JOIN ingredientes i ON i.id = r.ingrediente_id
+    """, (cesta,))
+    return len(consumo)
+
+def verificar_disponibilidade_cesta(itens, sessao=None):
+    """
+    Verifica o estoque para a cesta inteira [(produto_id, quantidade), ...]:
+    soma a demanda de cada ingrediente em todas as linhas e compara com o
+    disponível (estoque menos reservas ativas de outras sessões).
+    Retorna (disponivel, mensagem, faltantes) com um DataFrame dos ingredientes em falta.
+    """
+    demanda = get_dataframe(f"""
+        WITH {_CTE_CESTA},
+        reservado AS (
+            SELECT ingrediente_id, SUM(quantidade) AS quantidade
+            FROM reservas_estoque
+            WHERE expira_em > datetime('now') AND sessao IS NOT ?
+            GROUP BY ingrediente_id
+        )
+        SELECT i.id AS ingrediente_id, i.nome AS ingrediente, i.unidade, i.estoque_atual,
+               COALESCE(rs.quantidade, 0) AS reservado,
+               SUM(r.quantidade * c.quantidade) AS necessario
+        FROM cesta c
+        JOIN receitas_expandidas r ON r.produto_id = c.produto_id
+        JOIN ingredientes i ON i.id = r.ingrediente_id
+        LEFT JOIN reservado rs ON rs.ingrediente_id = i.id
+        GROUP BY i.id
+    """, (_json_cesta(itens), sessao))
+    
+    if demanda.empty:
+        return True, "Produto sem receita cadastrada", demanda
+    
+    demanda['disponivel'] = demanda['estoque_atual'] - demanda['reservado']
+    demanda['falta'] = demanda['necessario'] - demanda['disponivel']
+    faltantes = demanda[demanda['falta'] > _TOLERANCIA_ESTOQUE].reset_index(drop=True)
+    if faltantes.empty:
+        return True, "Estoque OK", faltantes
+    
+    detalhes = [f"{f.ingrediente}: falta {f.falta:.2f} {f.unidade}" for f in faltantes.itertuples()]
+    return False, "Estoque insuficiente: " + ", ".join(detalhes), faltantes
+
+def reservar_cesta(sessao, itens):
+    """
+    Reserva os ingredientes do carrinho da sessão por TTL_RESERVA_MIN minutos,
+    substituindo a reserva anterior. Só reserva se o disponível cobre o pedido.
+    Retorna (sucesso, mensagem, faltantes).
+    """
     try:
-        for _, item in receita.iterrows():
-            qtd_usar = item['quantidade'] * quantidade_produzida
-            # Buscar ID do ingrediente
-            ing_id = executar_query(
-                "SELECT id FROM ingredientes WHERE nome = ?", (item['ingrediente'],)
-            )[0]['id']
+        with transacao() as conn:
+            registrar_escrita('reservas_estoque')
+            conn.execute("DELETE FROM reservas_estoque WHERE expira_em <= datetime('now')")
             
-            # Baixar estoque
-            executar_query(
-                "UPDATE ingredientes SET estoque_atual = estoque_atual - ? WHERE id = ?",
-                (qtd_usar, ing_id)
+            disponivel, msg, faltantes = verificar_disponibilidade_cesta(itens, sessao)
+            if not disponivel:
+                return False, msg, faltantes
+            
+            conn.execute("DELETE FROM reservas_estoque WHERE sessao = ?", (sessao,))
+            conn.execute(f"""
+                WITH {_CTE_CESTA}
+                INSERT INTO reservas_estoque (sessao, ingrediente_id, quantidade, expira_em)
+                SELECT ?, r.ingrediente_id, SUM(r.quantidade * c.quantidade), datetime('now', ?)
+                FROM cesta c
+                JOIN receitas_expandidas r ON r.produto_id = c.produto_id
+                GROUP BY r.ingrediente_id
+            """, (_json_cesta(itens), sessao, f"+{int(TTL_RESERVA_MIN)} minutes"))
+        return True, msg, faltantes
+    except Exception as e:
+        return False, f"Erro ao reservar estoque: {e}", None
+
+def liberar_reserva(sessao):
+    """Libera a reserva de estoque do carrinho da sessão"""
+    try:
+        executar_query("DELETE FROM reservas_estoque WHERE sessao = ?", (sessao,))
+        return True, "Reserva liberada"
+    except Exception as e:
+        return False, f"Erro ao liberar reserva: {e}"
+
+
+# ==============================
+# FUNÇÕES DE ESTOQUE (RAZÃO)
+# (movimentacoes_estoque é a fonte da verdade; estoque_atual é a projeção
+#  mantida por trigger e snapshots_estoque guarda checkpoints por ingrediente)
+# ==============================
+def registrar_movimentacao(ingrediente_id, tipo, quantidade, motivo, data_movimentacao=None):
+    """Grava uma entrada/saída/ajuste no razão; o saldo do ingrediente acompanha por trigger"""
+    try:
+        with transacao() as conn:
+            registrar_escrita('movimentacoes_estoque', 'ingredientes', 'snapshots_estoque')
+            conn.execute(
+                "INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo, data_movimentacao) VALUES (?, ?, ?, ?, ?)",
+                (int(ingrediente_id), tipo, float(quantidade), motivo, data_movimentacao or datetime.now())
+            )
+        return True, "Movimentação registrada"
+    except Exception as e:
+        return False, f"Erro ao registrar movimentação: {e}"
+
+def excluir_movimentacao(movimentacao_id):
+    """Exclui uma movimentação do razão, revertendo seu efeito no saldo"""
+    try:
+        with transacao() as conn:
+            registrar_escrita('movimentacoes_estoque', 'ingredientes', 'snapshots_estoque')
+            conn.execute("DELETE FROM movimentacoes_estoque WHERE id = ?", (int(movimentacao_id),))
+        return True, "Movimentação excluída e estoque revertido"
+    except Exception as e:
+        return False, f"Erro ao excluir movimentação: {e}"
+
+def _ajustar_saldo(conn, ingrediente_id, novo_saldo, motivo):
+    """Grava no razão, dentro da transação em curso, o ajuste que leva o saldo a novo_saldo"""
+    atual = conn.execute(
+        "SELECT estoque_atual FROM ingredientes WHERE id = ?", (int(ingrediente_id),)
+    ).fetchone()[0]
+    diferenca = float(novo_saldo) - float(atual or 0)
+    if abs(diferenca) > _TOLERANCIA_ESTOQUE:
+        registrar_escrita('movimentacoes_estoque', 'ingredientes', 'snapshots_estoque')
+        conn.execute(
+            "INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo, data_movimentacao) VALUES (?, 'ajuste', ?, ?, ?)",
+            (int(ingrediente_id), diferenca, motivo, datetime.now())
+        )
+
+def ajustar_estoque(ingrediente_id, novo_saldo, motivo="Ajuste manual"):
+    """Leva o saldo do ingrediente a novo_saldo gravando a diferença como ajuste no razão"""
+    try:
+        with transacao() as conn:
+            _ajustar_saldo(conn, ingrediente_id, novo_saldo, motivo)
+        return True, "Estoque ajustado"
+    except Exception as e:
+        return False, f"Erro ao ajustar estoque: {e}"
+
+def atualizar_ingrediente(ingrediente_id, nome, preco_kg, unidade, fornecedor, novo_saldo, motivo="Ajuste na edição do ingrediente"):
+    """
+    Atualiza o cadastro do ingrediente e, se o saldo mudou, grava o ajuste no razão,
+    tudo na mesma transação: ou entram os dois, ou nenhum.
+    """
+    try:
+        with transacao() as conn:
+            registrar_escrita('ingredientes')
+            conn.execute(
+                "UPDATE ingredientes SET nome = ?, preco_kg = ?, unidade = ?, fornecedor = ? WHERE id = ?",
+                (nome, float(preco_kg), unidade, fornecedor, int(ingrediente_id))
+            )
+            _ajustar_saldo(conn, ingrediente_id, novo_saldo, motivo)
+        return True, "Ingrediente atualizado"
+    except Exception as e:
+        return False, f"Erro ao atualizar ingrediente: {e}"
+
+def cadastrar_ingrediente(nome, preco_kg, estoque_inicial=0, unidade="kg", fornecedor="Não informado"):
+    """Cadastra um ingrediente; o estoque inicial entra no razão como movimentação"""
+    try:
+        with transacao() as conn:
+            registrar_escrita('ingredientes', 'movimentacoes_estoque')
+            ingrediente_id = conn.execute(
+                "INSERT INTO ingredientes (nome, preco_kg, unidade, fornecedor) VALUES (?, ?, ?, ?)",
+                (nome, float(preco_kg), unidade, fornecedor)
+            ).lastrowid
+            if estoque_inicial > 0:
+                conn.execute(
+                    "INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo, data_movimentacao) VALUES (?, 'entrada', ?, 'Estoque inicial', ?)",
+                    (ingrediente_id, float(estoque_inicial), datetime.now())
+                )
+        return True, "Ingrediente cadastrado", ingrediente_id
+    except sqlite3.IntegrityError:
+        return False, "Já existe um ingrediente com esse nome", None
+    except Exception as e:
+        return False, f"Erro ao cadastrar: {e}", None
+
+# Saldo de cada ingrediente com as movimentações anteriores a :corte:
+# snapshot mais recente até o corte + delta das movimentações depois dele
+# (varredura curta no índice (ingrediente_id, data_movimentacao))
+_SQL_SALDOS_ATE = f"""
+    SELECT i.id AS ingrediente_id,
+           COALESCE(s.saldo, 0) + COALESCE((
+               SELECT SUM({sql_delta_movimentacao("m")})
+               FROM movimentacoes_estoque m
+               WHERE m.ingrediente_id = i.id
+               AND m.data_movimentacao >= COALESCE(s.data_corte, '')
+               AND m.data_movimentacao < :corte
+           ), 0) AS saldo
+    FROM ingredientes i
+    LEFT JOIN snapshots_estoque s
+        ON s.ingrediente_id = i.id
+        AND s.data_corte = (
+            SELECT MAX(data_corte) FROM snapshots_estoque
+            WHERE ingrediente_id = i.id AND data_corte <= :corte
+        )
+"""
+
+def get_saldos_estoque(data=None):
+    """
+    Saldo de cada ingrediente pelo razão (snapshot + delta): o atual, ou o do
+    fim do dia informado. Retorna DataFrame (ingrediente_id, nome, unidade, saldo).
+    """
+    corte = '9999-12-31' if data is None else (pd.Timestamp(data) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    saldos = get_dataframe(f"""
+        SELECT s.ingrediente_id, i.nome, i.unidade, s.saldo
+        FROM ({_SQL_SALDOS_ATE}) s
+        JOIN ingredientes i ON i.id = s.ingrediente_id
+        ORDER BY i.nome
+    """, {'corte': corte})
+    # Antes do corte do arquivamento o ajuste de saldo arquivado ainda não vale:
+    # soma as movimentações que estão no arquivo Parquet
+    corte_arquivo = get_corte_arquivo()
+    if corte_arquivo is not None and corte < corte_arquivo:
+        arquivadas = get_saldos_arquivo(corte).set_index('ingrediente_id')['saldo']
+        saldos['saldo'] += saldos['ingrediente_id'].map(arquivadas).fillna(0.0)
+    return saldos
+
+def gerar_snapshot_estoque(data_corte=None):
+    """Grava o checkpoint do saldo de todos os ingredientes no início do dia (padrão: hoje)"""
+    corte = pd.Timestamp(data_corte or datetime.now().date()).strftime('%Y-%m-%d')
+    try:
+        with transacao() as conn:
+            registrar_escrita('snapshots_estoque')
+            conn.execute(f"""
+                INSERT OR REPLACE INTO snapshots_estoque (ingrediente_id, data_corte, saldo)
+                SELECT ingrediente_id, :corte, saldo FROM ({_SQL_SALDOS_ATE})
+            """, {'corte': corte})
+        return True, f"Snapshot de estoque gravado em {corte}"
+    except Exception as e:
+        return False, f"Erro ao gravar snapshot de estoque: {e}"
+
+def conciliar_estoque(incremental=False, corrigir=False):
+    """
+    Confere estoque_atual contra o saldo do razão (entradas - saídas + ajustes),
+    calculado para todos os ingredientes em uma consulta agrupada e comparado em pandas.
+    incremental=True confere só os ingredientes marcados em conciliacao_pendente
+    (por trigger, a cada mudança no contador ou no razão, inclusive por fora do razão);
+    corrigir=True realinha os contadores divergentes ao razão em um único lote.
+    Divergências não corrigidas continuam marcadas para a próxima execução.
+    Retorna (sucesso, mensagem, divergencias).
+    """
+    try:
+        with transacao() as conn:
+            ate_mov_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM movimentacoes_estoque").fetchone()[0]
+            
+            filtro = ""
+            if incremental:
+                filtro = "WHERE {col} IN (SELECT ingrediente_id FROM conciliacao_pendente)"
+            
+            contadores = get_dataframe(f"""
+                SELECT id AS ingrediente_id, nome, unidade, estoque_atual
+                FROM ingredientes {filtro.format(col='id')}
+            """)
+            razao = get_dataframe(f"""
+                SELECT ingrediente_id, SUM({sql_delta_movimentacao("m")}) AS saldo_razao
+                FROM movimentacoes_estoque m {filtro.format(col='ingrediente_id')}
+                GROUP BY ingrediente_id
+            """)
+            
+            relatorio = contadores.merge(razao, on='ingrediente_id', how='left')
+            relatorio['saldo_razao'] = relatorio['saldo_razao'].fillna(0.0)
+            relatorio['diferenca'] = relatorio['estoque_atual'].fillna(0.0) - relatorio['saldo_razao']
+            divergencias = relatorio[relatorio['diferenca'].abs() > TOLERANCIA_CONCILIACAO].reset_index(drop=True)
+            
+            corrigidos = 0
+            if corrigir and not divergencias.empty:
+                registrar_escrita('ingredientes')
+                conn.executemany(
+                    "UPDATE ingredientes SET estoque_atual = ? WHERE id = ?",
+                    zip(divergencias['saldo_razao'].astype(float), divergencias['ingrediente_id'].astype(int))
+                )
+                corrigidos = len(divergencias)
+            
+            # Desmarca o que foi conferido (depois da correção, que marca de novo pelo trigger)
+            conferidos = relatorio['ingrediente_id']
+            if not corrigir:
+                conferidos = conferidos[~conferidos.isin(divergencias['ingrediente_id'])]
+            conn.executemany(
+                "DELETE FROM conciliacao_pendente WHERE ingrediente_id = ?",
+                ((int(i),) for i in conferidos)
             )
+            conn.execute("DELETE FROM conciliacao_pendente WHERE ingrediente_id NOT IN (SELECT id FROM ingredientes)")
             
-            # Registrar movimentação
-            executar_query(
-                "INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo) VALUES (?, 'saida', ?, ?)",
-                (ing_id, qtd_usar, f"Produção/Venda: {quantidade_produzida}x produto ID {produto_id}")
+            conn.execute(
+                "INSERT INTO conciliacoes_estoque (ate_mov_id, incremental, verificados, divergentes, corrigidos) VALUES (?, ?, ?, ?, ?)",
+                (ate_mov_id, bool(incremental), len(relatorio), len(divergencias), corrigidos)
             )
         
-        return True, "Estoque baixado com sucesso"
+        msg = f"{len(relatorio)} ingredientes conferidos, {len(divergencias)} com divergência"
+        if corrigidos:
+            msg += f", {corrigidos} corrigidos"
+        return True, msg, divergencias
     except Exception as e:
-        return False, f"Erro ao baixar estoque: {e}"
+        return False, f"Erro ao conciliar estoque: {e}", None
+
+def get_historico_conciliacoes(limite=10):
+    """Últimas execuções da conciliação de estoque"""
+    return get_dataframe("""
+        SELECT executado_em, incremental, verificados, divergentes, corrigidos
+        FROM conciliacoes_estoque
+        ORDER BY id DESC
+        LIMIT ?
+    """, (int(limite),))
 
+def snapshot_estoque_se_necessario():
+    """Grava um snapshot se o último tiver mais de INTERVALO_SNAPSHOT_DIAS dias"""
+    ultimo = executar_query("SELECT MAX(data_corte) FROM snapshots_estoque")[0][0]
+    hoje = datetime.now().date()
+    if ultimo is None or (hoje - pd.Timestamp(ultimo).date()).days >= INTERVALO_SNAPSHOT_DIAS:
+        return gerar_snapshot_estoque(hoje)
+    return True, "Snapshot de estoque em dia"
+
+# ==============================
+# FUNÇÕES DE PLANEJAMENTO DE PRODUÇÃO
+# (matriz produto × ingrediente em NumPy, cacheada pela versão da receita expandida)
+# ==============================
+@st.cache_data(max_entries=4, show_spinner=False)
+def _matriz_receitas(versao):
+    receitas = get_receitas_expandidas()
+    produto_ids = np.unique(receitas['produto_id'].to_numpy(dtype=np.int64))
+    ingrediente_ids = np.unique(receitas['ingrediente_id'].to_numpy(dtype=np.int64))
+    matriz = np.zeros((len(produto_ids), len(ingrediente_ids)))
+    np.add.at(
+        matriz,
+        (np.searchsorted(produto_ids, receitas['produto_id'].to_numpy(dtype=np.int64)),
+         np.searchsorted(ingrediente_ids, receitas['ingrediente_id'].to_numpy(dtype=np.int64))),
+        receitas['quantidade'].to_numpy(dtype=float)
+    )
+    return produto_ids, ingrediente_ids, matriz
+
+def matriz_receitas():
+    """
+    (produto_ids, ingrediente_ids, matriz) com o consumo de cada ingrediente
+    (coluna) por unidade de cada produto com receita (linha), sub-receitas explodidas
+    """
+    produto_ids, ingrediente_ids, matriz = _matriz_receitas(versao_tabelas('receitas_expandidas'))
+    # Linhas de receita órfãs (produto ou ingrediente excluído) ficam de fora
+    linhas = np.isin(produto_ids, list(get_indice_produtos()))
+    colunas = np.isin(ingrediente_ids, list(get_indice_ingredientes()))
+    matriz = matriz[np.ix_(linhas, colunas)]
+    # Produto cuja receita só tinha ingredientes excluídos ficaria com a linha zerada
+    # (capacidade infinita): tratado como produto sem receita
+    com_receita = (matriz > 0).any(axis=1)
+    return produto_ids[linhas][com_receita], ingrediente_ids[colunas], matriz[com_receita]
+
+def _estoque_vetor(ingrediente_ids):
+    """Estoque atual (>= 0) alinhado às colunas da matriz de receitas"""
+    estoque = get_ingredientes().set_index('id')['estoque_atual'].astype(float)
+    return estoque.reindex(ingrediente_ids, fill_value=0.0).clip(lower=0).to_numpy()
+
+def _unidades_possiveis(matriz, estoque):
+    """Máximo de unidades inteiras de cada produto que o estoque comporta, sozinho"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        razao = np.where(matriz > 0, estoque / matriz, np.inf)
+    return razao, np.floor(razao.min(axis=1, initial=np.inf) + _TOLERANCIA_ESTOQUE)
+
+def get_capacidade_producao():
+    """
+    Quantas unidades de cada produto ativo dá para fazer com o estoque atual
+    (cada produto isoladamente) e qual ingrediente limita.
+    Retorna DataFrame (produto_id, produto, max_unidades, gargalo).
+    """
+    produto_ids, ingrediente_ids, matriz = matriz_receitas()
+    if len(produto_ids) == 0:
+        return pd.DataFrame(columns=['produto_id', 'produto', 'max_unidades', 'gargalo'])
+    
+    razao, maximo = _unidades_possiveis(matriz, _estoque_vetor(ingrediente_ids))
+    indice_produtos = get_indice_produtos()
+    indice_ingredientes = get_indice_ingredientes()
+    capacidade = pd.DataFrame({
+        'produto_id': produto_ids,
+        'produto': [indice_produtos[p]['nome'] for p in produto_ids],
+        'max_unidades': maximo.astype(int),
+        'gargalo': [indice_ingredientes[ingrediente_ids[j]]['nome'] for j in razao.argmin(axis=1)],
+    })
+    ativos = [bool(indice_produtos[p]['ativo']) for p in produto_ids]
+    return capacidade[ativos].sort_values('produto').reset_index(drop=True)
+
+def plano_producao(metas=None, objetivo="margem"):
+    """
+    Plano de produção combinado para todos os produtos ativos com receita,
+    dividindo o estoque compartilhado de ingredientes.
+    metas = {produto_id: quantidade}: teto por produto (sem metas, só os ingredientes limitam).
+    objetivo = "margem" maximiza a margem total; "metas" maximiza as unidades das metas.
+    Heurística gulosa: a cada rodada o produto com mais valor por consumo relativo ao
+    estoque restante recebe tudo o que ainda cabe (até a meta).
+    Retorna (plano, consumo) em DataFrames.
+    """
+    produto_ids, ingrediente_ids, matriz = matriz_receitas()
+    estoque = _estoque_vetor(ingrediente_ids)
+    indice_produtos = get_indice_produtos()
+    indice_ingredientes = get_indice_ingredientes()
+    
+    preco = np.array([float(indice_produtos[p]['preco_venda']) for p in produto_ids])
+    margem = preco - calcular_custos_produtos(produto_ids).to_numpy()
+    teto = np.full(len(produto_ids), np.inf)
+    if metas is not None:
+        teto = pd.Series(metas, dtype=float).reindex(produto_ids, fill_value=0.0).to_numpy()
+    valor = margem if objetivo == "margem" else np.ones(len(produto_ids))
+    candidatos = (
+        np.array([bool(indice_produtos[p]['ativo']) for p in produto_ids], dtype=bool)
+        & (valor > 0) & (teto >= 1)
+    )
+    
+    quantidades = np.zeros(len(produto_ids))
+    restante = estoque.copy()
+    while candidatos.any():
+        _, possiveis = _unidades_possiveis(matriz, restante)
+        possiveis = np.where(candidatos, np.minimum(possiveis, teto - quantidades), 0)
+        candidatos &= np.isfinite(possiveis) & (possiveis >= 1)
+        if not candidatos.any():
+            break
+        # Consumo ponderado pela escassez: ingredientes quase no fim pesam mais
+        escassez = (matriz / np.maximum(restante, _TOLERANCIA_ESTOQUE)).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pontuacao = np.where(candidatos, valor / escassez, -np.inf)
+        j = int(np.argmax(pontuacao))
+        quantidades[j] += possiveis[j]
+        restante = np.maximum(restante - matriz[j] * possiveis[j], 0)
+        candidatos[j] = False
+    
+    plano = pd.DataFrame({
+        'produto_id': produto_ids,
+        'produto': [indice_produtos[p]['nome'] for p in produto_ids],
+        'quantidade': quantidades.astype(int),
+        'meta': teto if metas is not None else np.nan,
+        'margem_unitaria': margem,
+        'margem_total': margem * quantidades,
+        'receita_total': preco * quantidades,
+    })
+    plano = plano[plano['quantidade'] > 0].sort_values('margem_total', ascending=False).reset_index(drop=True)
+    
+    uso = quantidades @ matriz
+    consumo = pd.DataFrame({
+        'ingrediente_id': ingrediente_ids,
+        'ingrediente': [indice_ingredientes[i]['nome'] for i in ingrediente_ids],
+        'unidade': [indice_ingredientes[i]['unidade'] for i in ingrediente_ids],
+        'disponivel': estoque,
+        'consumo': uso,
+        'sobra': estoque - uso,
+    })
+    consumo = consumo[consumo['consumo'] > 0].sort_values('ingrediente').reset_index(drop=True)
+    return plano, consumo
 
 # ==============================
 # FUNÇÕES DE VENDAS (AGRUPAMENTO POR COMPRA)
 # ==============================
-def criar_venda(data_venda, itens, observacao=""):
+def criar_venda(data_venda, itens, observacao="", sessao=None):
     """
     Cria uma venda (compra/pedido) com múltiplos itens
     itens = lista de dicts: [{'produto_id': 1, 'quantidade': 2, 'preco_unitario': 5.0}, ...]
+    Pedido, itens e baixa de estoque são gravados em uma única transação:
+    ou a venda entra inteira, ou nada é gravado. A reserva da sessão
+    (se houver) é liberada na mesma transação.
     """
-    try:
-        conn = iniciar_database()
-        
-        # Calcular total da venda
-        total_venda = sum(item['quantidade'] * item['preco_unitario'] for item in itens)
-        
-        # Criar venda (pedido)
-        venda_id = executar_query(
-            "INSERT INTO vendas (data_venda, total, observacao) VALUES (?, ?, ?)",
-            (data_venda, total_venda, observacao)
-        )
-        
-        # Adicionar itens e processar estoque
-        for item in itens:
-            # Calcular custo variável
-            custo_var = calcular_custo_produto(item['produto_id']) * item['quantidade']
-            subtotal = item['quantidade'] * item['preco_unitario']
-            
-            # Inserir item
-            executar_query(
-                "INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario, subtotal, custo_variavel) VALUES (?, ?, ?, ?, ?, ?)",
-                (venda_id, item['produto_id'], item['quantidade'], item['preco_unitario'], subtotal, custo_var)
-            )
+    # Calcular total da venda
+    total_venda = sum(item['quantidade'] * item['preco_unitario'] for item in itens)
+    
+    for tentativa in range(TENTATIVAS_CHECKOUT):
+        try:
+            with transacao() as conn:
+                registrar_escrita('vendas', 'itens_venda', 'reservas_estoque', *TABELAS_ROLLUP)
+                
+                # Criar venda (pedido)
+                venda_id = conn.execute(
+                    "INSERT INTO vendas (data_venda, total, observacao) VALUES (?, ?, ?)",
+                    (data_venda, total_venda, observacao)
+                ).lastrowid
+                
+                # Custo unitário de todos os produtos da cesta em uma consulta
+                custos = calcular_custos_produtos(item['produto_id'] for item in itens)
+                
+                # Inserir todos os itens de uma vez
+                conn.executemany(
+                    "INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario, subtotal, custo_variavel) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (venda_id, item['produto_id'], item['quantidade'], item['preco_unitario'],
+                         item['quantidade'] * item['preco_unitario'],
+                         float(custos.iloc[i]) * item['quantidade'])
+                        for i, item in enumerate(itens)
+                    ]
+                )
+                
+                # Baixar estoque da cesta inteira (condicional: nunca fica negativo)
+                _baixar_estoque_cesta(conn, [(item['produto_id'], item['quantidade']) for item in itens], sessao)
+                
+                # Acumular nos rollups do dashboard (mesma transação)
+                for comando in sql_rollups_vendas("v.id = ?"):
+                    conn.execute(comando, (venda_id,))
+                
+                if sessao is not None:
+                    conn.execute("DELETE FROM reservas_estoque WHERE sessao = ?", (sessao,))
             
-            # Baixar estoque por receita
-            baixar_estoque_por_receita(item['produto_id'], item['quantidade'])
-        
-        return True, "Venda registrada com sucesso", venda_id
+            return True, "Venda registrada com sucesso", venda_id
+        except EstoqueInsuficiente as e:
+            return False, str(e), None
+        except sqlite3.OperationalError as e:
+            # Banco ocupado por outro caixa além do busy_timeout: tenta de novo em instantes
+            if "locked" in str(e) and tentativa < TENTATIVAS_CHECKOUT - 1:
+                time.sleep(0.05 * 2 ** tentativa)
+                continue
+            return False, f"Erro ao registrar venda: {e}", None
+        except Exception as e:
+            return False, f"Erro ao registrar venda: {e}", None
+
+def excluir_venda(venda_id):
+    """Exclui uma venda e seus itens, descontando-a dos rollups (não reverte estoque)"""
+    try:
+        with transacao() as conn:
+            registrar_escrita('vendas', 'itens_venda', *TABELAS_ROLLUP)
+            for comando in sql_rollups_vendas("v.id = ?", sinal=-1):
+                conn.execute(comando, (venda_id,))
+            _limpar_rollups_vazios(conn)
+            conn.execute("DELETE FROM itens_venda WHERE venda_id = ?", (venda_id,))
+            conn.execute("DELETE FROM vendas WHERE id = ?", (venda_id,))
+        return True, "Venda excluída"
     except Exception as e:
-        return False, f"Erro ao registrar venda: {e}", None
+        return False, f"Erro ao excluir venda: {e}"
+
+def _limpar_rollups_vazios(conn):
+    """Remove linhas de rollup que ficaram zeradas após exclusões"""
+    for tabela in TABELAS_ROLLUP:
+        conn.execute(f"DELETE FROM {tabela} WHERE num_vendas <= 0")
+
+def reconstruir_rollups(data_inicio=None, data_fim=None):
+    """Recalcula os rollups de vendas a partir das tabelas brutas (todo o histórico no banco ou um período)"""
+    data_inicio = data_inicio or '0001-01-01'
+    data_fim = data_fim or '9999-12-31'
+    # Meses arquivados não têm mais as vendas brutas: o rollup deles é preservado
+    corte_arquivo = get_corte_arquivo()
+    if corte_arquivo is not None and str(data_inicio) < corte_arquivo:
+        data_inicio = corte_arquivo
+    try:
+        with transacao() as conn:
+            registrar_escrita(*TABELAS_ROLLUP)
+            for tabela in TABELAS_ROLLUP:
+                conn.execute(f"DELETE FROM {tabela} WHERE data_venda BETWEEN ? AND ?", (data_inicio, data_fim))
+            for comando in sql_rollups_vendas("v.data_venda BETWEEN ? AND ?"):
+                conn.execute(comando, (data_inicio, data_fim))
+        return True, "Rollups de vendas reconstruídos"
+    except Exception as e:
+        return False, f"Erro ao reconstruir rollups: {e}"
 
 def get_vendas_detalhadas(data_inicio, data_fim):
-    """Retorna vendas com detalhamento de itens"""
-    return get_dataframe("""
+    """Retorna vendas com detalhamento de itens (inclui os meses arquivados do período)"""
+    vendas = get_dataframe("""
         SELECT 
             v.id as venda_id,
             v.data_venda,
@@ -341,6 +1192,25 @@ def get_vendas_detalhadas(data_inicio, data_fim):
         WHERE v.data_venda BETWEEN ? AND ?
         ORDER BY v.data_venda DESC, v.id DESC
     """, (data_inicio, data_fim))
+    arquivadas = _vendas_detalhadas_arquivo(data_inicio, data_fim)
+    if arquivadas.empty:
+        return vendas
+    return pd.concat([vendas, arquivadas[vendas.columns]], ignore_index=True).sort_values(
+        ['data_venda', 'venda_id'], ascending=False, ignore_index=True
+    )
+
+def _vendas_detalhadas_arquivo(data_inicio, data_fim):
+    """Mesmas colunas de get_vendas_detalhadas, a partir do arquivo Parquet"""
+    itens = ler_arquivo('itens_venda', data_inicio, data_fim)
+    if itens.empty:
+        return itens
+    vendas = ler_arquivo('vendas', data_inicio, data_fim)[['id', 'hora_venda', 'total', 'observacao']]
+    nomes = get_produtos().set_index('id')['nome']
+    detalhadas = itens.merge(vendas, left_on='venda_id', right_on='id', suffixes=('', '_venda'))
+    detalhadas['produto'] = detalhadas['produto_id'].map(nomes)
+    detalhadas = detalhadas.dropna(subset=['produto'])
+    detalhadas['margem_contribuicao'] = detalhadas['subtotal'] - detalhadas['custo_variavel']
+    return detalhadas
 
 def get_resumo_vendas(data_inicio, data_fim):
     """Retorna resumo de vendas agrupadas por pedido"""
@@ -379,3 +1249,175 @@ def get_resumo_vendas(data_inicio, data_fim):
         GROUP BY v.id
         ORDER BY v.data_venda DESC, v.id DESC
     """, (data_inicio, data_fim))
+
+
+def get_totais_vendas(data_inicio, data_fim):
+    """Totais do período (faturamento, nº de vendas, custo e margem) pelo rollup diário"""
+    return get_dataframe("""
+        SELECT COALESCE(SUM(num_vendas), 0) AS num_vendas,
+               COALESCE(SUM(faturamento), 0) AS faturamento,
+               COALESCE(SUM(custo_variavel), 0) AS custo,
+               COALESCE(SUM(faturamento - custo_variavel), 0) AS margem
+        FROM vendas_dia
+        WHERE data_venda BETWEEN ? AND ?
+    """, (data_inicio, data_fim)).iloc[0].to_dict()
+
+def get_custo_entradas(data_inicio, data_fim):
+    """Valor das entradas de estoque no período (ao preço atual), incluindo meses arquivados"""
+    total = float(get_dataframe("""
+        SELECT COALESCE(SUM(m.quantidade * i.preco_kg), 0) AS total_custo
+        FROM movimentacoes_estoque m
+        JOIN ingredientes i ON m.ingrediente_id = i.id
+        WHERE m.tipo = 'entrada'
+        AND DATE(m.data_movimentacao) BETWEEN ? AND ?
+    """, (data_inicio, data_fim))['total_custo'].iloc[0])
+    arquivadas = ler_arquivo('movimentacoes_estoque', data_inicio, data_fim)
+    if not arquivadas.empty:
+        entradas = arquivadas[arquivadas['tipo'] == 'entrada']
+        precos = get_ingredientes().set_index('id')['preco_kg']
+        total += float((entradas['quantidade'] * entradas['ingrediente_id'].map(precos)).sum())
+    return total
+
+def get_resumo_vendas_pagina(data_inicio, data_fim, limite=20, apos=None):
+    """
+    Uma página do resumo de vendas (mais recentes primeiro), paginada por chave:
+    apos = (data_venda, id) da última venda da página anterior.
+    """
+    filtro_chave = ""
+    params = [data_inicio, data_fim]
+    if apos is not None:
+        filtro_chave = "AND (data_venda, id) < (?, ?)"
+        params += [apos[0], int(apos[1])]
+    params.append(int(limite))
+    
+    return get_dataframe(f"""
+        SELECT 
+            v.id,
+            v.data_venda,
+            v.hora_venda,
+            v.total,
+            COUNT(iv.id) as qtd_itens,
+            COALESCE(SUM(iv.custo_variavel), 0) as custo_total,
+            (v.total - COALESCE(SUM(iv.custo_variavel), 0)) as margem_total,
+            v.observacao
+        FROM (
+            SELECT * FROM vendas
+            WHERE data_venda BETWEEN ? AND ? {filtro_chave}
+            ORDER BY data_venda DESC, id DESC
+            LIMIT ?
+        ) v
+        LEFT JOIN itens_venda iv ON v.id = iv.venda_id
+        GROUP BY v.id
+        ORDER BY v.data_venda DESC, v.id DESC
+    """, tuple(params))
+
+def get_itens_vendas(venda_ids):
+    """Itens de várias vendas em uma única consulta"""
+    return get_dataframe("""
+        SELECT iv.venda_id, p.nome as produto, iv.quantidade, iv.preco_unitario, 
+               iv.subtotal, iv.custo_variavel,
+               (iv.subtotal - iv.custo_variavel) as margem
+        FROM itens_venda iv
+        JOIN produtos p ON iv.produto_id = p.id
+        WHERE iv.venda_id IN (SELECT value FROM json_each(?))
+        ORDER BY iv.venda_id, iv.id
+    """, (json.dumps([int(v) for v in venda_ids]),))
+
+# ==============================
+# FUNÇÕES DE INDICADORES (DASHBOARD)
+# (consultas consolidadas, cacheadas por período + versão dos dados)
+# ==============================
+LIMITE_ESTOQUE_BAIXO = 5
+LIMITE_PRONTO_BAIXO = 10
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _kpis_periodo(data_inicio, data_fim, hoje, versao):
+    kpis = get_dataframe("""
+        SELECT
+            (SELECT COALESCE(SUM(faturamento), 0) FROM vendas_dia
+             WHERE data_venda BETWEEN :inicio AND :fim) AS receita,
+            (SELECT COALESCE(SUM(valor), 0) FROM custos_operacionais
+             WHERE recorrente = 1 AND data_custo BETWEEN :inicio AND :fim) AS custos_fixos,
+            (SELECT COALESCE(SUM(num_vendas), 0) FROM vendas_dia WHERE data_venda = :hoje) AS vendas_hoje,
+            (SELECT COALESCE(SUM(faturamento), 0) FROM vendas_dia WHERE data_venda = :hoje) AS faturamento_hoje
+    """, {'inicio': data_inicio, 'fim': data_fim, 'hoje': hoje}).iloc[0].to_dict()
+    # Mesma conta dos relatórios: as entradas de meses arquivados também contam
+    kpis['custos_variaveis'] = get_custo_entradas(data_inicio, data_fim)
+    return kpis
+
+def get_kpis_dashboard(data_inicio, data_fim):
+    """Indicadores financeiros do período + resumo de hoje (cacheados pela versão dos dados)"""
+    return _kpis_periodo(data_inicio, data_fim, datetime.now().date(), versao_dados())
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _estoque_dashboard(versao):
+    return get_dataframe(f"""
+        SELECT 'ingrediente' AS tipo, nome, estoque_atual AS quantidade, unidade, NULL AS categoria
+        FROM (
+            SELECT nome, estoque_atual, unidade
+            FROM ingredientes
+            WHERE estoque_atual <= {LIMITE_ESTOQUE_BAIXO} AND estoque_atual > 0
+            ORDER BY estoque_atual ASC
+            LIMIT 5
+        )
+        UNION ALL
+        SELECT 'pronto', p.nome, ep.quantidade_atual, 'un', p.categoria
+        FROM estoque_pronto ep
+        JOIN produtos p ON ep.produto_id = p.id
+        WHERE ep.quantidade_atual > 0
+        UNION ALL
+        SELECT 'zerados', NULL, COUNT(*), NULL, NULL
+        FROM ingredientes
+        WHERE estoque_atual <= 0
+    """)
+
+def get_estoque_dashboard():
+    """
+    Alertas de estoque do dashboard em uma consulta:
+    (ingredientes com estoque baixo, produtos prontos em estoque, nº de ingredientes zerados)
+    """
+    df = _estoque_dashboard(versao_dados())
+    ingredientes_baixos = df[df['tipo'] == 'ingrediente']
+    estoque_pronto = df[df['tipo'] == 'pronto'].sort_values('quantidade', ascending=False)
+    zerados = int(df.loc[df['tipo'] == 'zerados', 'quantidade'].iloc[0])
+    return ingredientes_baixos, estoque_pronto, zerados
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _top_produtos(data_inicio, data_fim, limite, versao):
+    return get_dataframe("""
+        SELECT 
+            p.nome, 
+            SUM(vp.quantidade) AS total_vendido, 
+            SUM(vp.faturamento) AS faturamento
+        FROM vendas_produto_dia vp
+        JOIN produtos p ON vp.produto_id = p.id
+        WHERE vp.data_venda BETWEEN ? AND ?
+        GROUP BY p.nome
+        ORDER BY total_vendido DESC
+        LIMIT ?
+    """, (data_inicio, data_fim, limite))
+
+def get_top_produtos(data_inicio, data_fim, limite=10):
+    """Produtos mais vendidos no período (rollup produto/dia)"""
+    return _top_produtos(data_inicio, data_fim, limite, versao_dados())
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _evolucao_receita(data_inicio, data_fim, por_mes, versao):
+    if por_mes:
+        return get_dataframe("""
+            SELECT strftime('%Y-%m', data_venda) as mes, SUM(faturamento) as faturamento
+            FROM vendas_dia
+            WHERE data_venda BETWEEN ? AND ?
+            GROUP BY mes
+            ORDER BY mes
+        """, (data_inicio, data_fim))
+    return get_dataframe("""
+        SELECT data_venda, faturamento
+        FROM vendas_dia
+        WHERE data_venda BETWEEN ? AND ?
+        ORDER BY data_venda
+    """, (data_inicio, data_fim))
+
+def get_evolucao_receita(data_inicio, data_fim, por_mes=False):
+    """Faturamento por dia (ou por mês) no período (rollup diário)"""
+    return _evolucao_receita(data_inicio, data_fim, por_mes, versao_dados())
@@ -0,0 +1,394 @@
+"""
+Importação em massa (histórico de vendas de outro PDV e listas de preços de ingredientes)
+
+O arquivo (CSV ou Parquet, uma linha por item vendido) é validado inteiro
+com operações vetorizadas do pandas e os produtos são mapeados pelo nome
+(sem diferenciar maiúsculas/espaços). A carga roda em uma única transação
+com executemany em lotes de TAMANHO_LOTE; em cargas grandes os índices de
+vendas/itens são recriados só no final. Os rollups recebem as vendas
+importadas e, opcionalmente, o consumo de ingredientes entra no razão de
+estoque como uma saída por ingrediente e dia de venda, lançada na data da
+importação.
+
+Listas de preços de fornecedores são comparadas em memória com o cadastro
+de ingredientes e só as linhas novas ou alteradas vão para o banco, em um
+único lote de INSERT ... ON CONFLICT(nome) DO UPDATE.
+"""
+import json
+import time
+from datetime import datetime
+import pandas as pd
+from banco import get_conexao, transacao, registrar_escrita, sql_rollups_vendas, TABELAS_ROLLUP
+
+# ==============================
+# CONFIGURAÇÕES
+# ==============================
+TAMANHO_LOTE = 10000            # linhas por executemany
+LIMIAR_INDICES_ADIADOS = 20000  # a partir daqui, índices são recriados só no fim da carga
+MOTIVO_IMPORTACAO = 'Importação de vendas'
+
+# Colunas do arquivo de vendas (uma linha por item)
+COLUNAS_VENDAS = ['pedido', 'data_venda', 'hora_venda', 'produto', 'quantidade', 'preco_unitario', 'observacao']
+COLUNAS_OBRIGATORIAS_VENDAS = ['data_venda', 'produto', 'quantidade']
+
+# Colunas da lista de ingredientes (estoque só vale para ingredientes novos)
+COLUNAS_INGREDIENTES = ['nome', 'preco_kg', 'unidade', 'fornecedor', 'estoque']
+UNIDADES = ["kg", "litros", "unidades", "dúzia", "pacotes"]
+
+
+# ==============================
+# LEITURA E CONVERSÕES
+# ==============================
+def _separador(origem):
+    """';' ou ',' conforme o cabeçalho do CSV"""
+    if hasattr(origem, 'read'):
+        inicio = origem.read(4096)
+        origem.seek(0)
+        if isinstance(inicio, bytes):
+            inicio = inicio.decode('utf-8', errors='ignore')
+    else:
+        with open(origem, encoding='utf-8', errors='ignore') as arquivo:
+            inicio = arquivo.read(4096)
+    cabecalho = inicio.splitlines()[0] if inicio else ''
+    return ';' if cabecalho.count(';') > cabecalho.count(',') else ','
+
+def ler_tabela(origem, nome=None):
+    """DataFrame (colunas em minúsculas) de um CSV, Parquet ou Excel, por caminho ou arquivo enviado"""
+    nome = str(nome or getattr(origem, 'name', origem))
+    if nome.lower().endswith('.parquet'):
+        dados = pd.read_parquet(origem)
+    elif nome.lower().endswith('.xlsx'):
+        dados = pd.read_excel(origem, dtype=str)
+    else:
+        dados = pd.read_csv(origem, sep=_separador(origem), dtype=str, encoding='utf-8-sig',
+                            keep_default_na=False, na_values=[''])
+    dados.columns = [str(c).strip().lower() for c in dados.columns]
+    return dados
+
+def _texto(serie):
+    """Texto sem espaços nas pontas, com vazios como NA"""
+    return serie.astype('string').str.strip().replace('', pd.NA)
+
+def _numero(serie):
+    """Número aceitando vírgula decimal; inválidos viram NaN"""
+    return pd.to_numeric(_texto(serie).str.replace(',', '.', regex=False), errors='coerce').astype('float64')
+
+def _data(serie):
+    """Datas ISO (AAAA-MM-DD) ou brasileiras (DD/MM/AAAA); inválidas viram NaT"""
+    texto = _texto(serie)
+    datas = pd.to_datetime(texto, format='ISO8601', errors='coerce')
+    return datas.fillna(pd.to_datetime(texto, format='%d/%m/%Y', errors='coerce'))
+
+def _hora(serie):
+    """Horas HH:MM[:SS]; inválidas viram NaT"""
+    texto = _texto(serie)
+    horas = pd.to_datetime(texto, format='%H:%M:%S', errors='coerce')
+    return horas.fillna(pd.to_datetime(texto, format='%H:%M', errors='coerce'))
+
+def _chave_nome(serie):
+    """Nome normalizado para casar produtos/ingredientes do arquivo com o cadastro"""
+    return _texto(serie).str.casefold()
+
+def _relatorio_erros(verificacoes):
+    """
+    (invalidas, erros) a partir de [(mascara, motivo)]: máscara das linhas reprovadas
+    em alguma verificação e DataFrame (linha do arquivo, erro)
+    """
+    invalidas = pd.concat([mascara for mascara, _ in verificacoes], axis=1).any(axis=1)
+    posicoes = pd.Series(range(2, len(invalidas) + 2), index=invalidas.index)  # linha 1 é o cabeçalho
+    partes = [
+        pd.DataFrame({'linha': posicoes[mascara], 'erro': motivo})
+        for mascara, motivo in verificacoes if mascara.any()
+    ]
+    if not partes:
+        return invalidas, pd.DataFrame(columns=['linha', 'erro'])
+    return invalidas, pd.concat(partes, ignore_index=True).sort_values('linha', ignore_index=True)
+
+def _linhas(dados):
+    """Tuplas com tipos nativos do Python (o sqlite3 não aceita escalares do NumPy)"""
+    dados = dados.astype(object)
+    return list(dados.where(dados.notna(), None).itertuples(index=False, name=None))
+
+def _executar_em_lotes(conn, comando, dados):
+    for inicio in range(0, len(dados), TAMANHO_LOTE):
+        conn.executemany(comando, _linhas(dados.iloc[inicio:inicio + TAMANHO_LOTE]))
+
+
+# ==============================
+# IMPORTAÇÃO DE VENDAS
+# ==============================
+def validar_vendas(dados):
+    """
+    Confere e normaliza o arquivo de vendas. Retorna (itens, erros): itens com
+    pedido, data_venda, hora_venda, produto_id, quantidade, preco_unitario,
+    subtotal e observacao; erros com a linha do arquivo e o motivo.
+    """
+    faltando = [c for c in COLUNAS_OBRIGATORIAS_VENDAS if c not in dados.columns]
+    if faltando:
+        return pd.DataFrame(), pd.DataFrame({'linha': [1], 'erro': [f"Colunas obrigatórias ausentes: {', '.join(faltando)}"]})
+    dados = dados.reindex(columns=COLUNAS_VENDAS)
+
+    produtos = pd.read_sql_query("SELECT id, nome, preco_venda FROM produtos", get_conexao())
+    produtos['chave'] = _chave_nome(produtos['nome'])
+    produtos = produtos.drop_duplicates('chave').set_index('chave')
+
+    datas = _data(dados['data_venda'])
+    horas = _hora(dados['hora_venda'])
+    chaves = _chave_nome(dados['produto'])
+    produto_id = chaves.map(produtos['id'])
+    quantidade = _numero(dados['quantidade'])
+    preco = _numero(dados['preco_unitario']).fillna(chaves.map(produtos['preco_venda']))
+    # Sem coluna de pedido, cada linha é uma venda
+    pedido = _texto(dados['pedido']).fillna(pd.Series(
+        [f"#linha{i}" for i in range(2, len(dados) + 2)], index=dados.index, dtype='string'
+    ))
+
+    datas_pedido = datas.dt.strftime('%Y-%m-%d').groupby(pedido).transform('nunique')
+    verificacoes = [
+        (datas.isna(), "data_venda inválida"),
+        (horas.isna() & _texto(dados['hora_venda']).notna(), "hora_venda inválida"),
+        (produto_id.isna(), "produto não cadastrado"),
+        (~(quantidade > 0) | (quantidade % 1 != 0), "quantidade deve ser inteira e positiva"),
+        (~(preco >= 0), "preco_unitario inválido"),
+        (datas_pedido > 1, "pedido com mais de uma data"),
+    ]
+    # Um pedido nunca entra pela metade: uma linha ruim reprova o pedido todo
+    reprovadas = pd.concat([mascara for mascara, _ in verificacoes], axis=1).any(axis=1)
+    verificacoes.append((reprovadas.groupby(pedido).transform('any') & ~reprovadas, "outra linha do pedido é inválida"))
+    invalidas, erros = _relatorio_erros(verificacoes)
+
+    itens = pd.DataFrame({
+        'pedido': pedido,
+        'data_venda': datas.dt.strftime('%Y-%m-%d'),
+        'hora_venda': horas.dt.strftime('%H:%M:%S'),
+        'produto_id': produto_id,
+        'quantidade': quantidade,
+        'preco_unitario': preco,
+        'observacao': _texto(dados['observacao']),
+    })[~invalidas]
+    itens = itens.astype({'produto_id': 'int64', 'quantidade': 'int64', 'preco_unitario': 'float64'})
+    itens['subtotal'] = itens['quantidade'] * itens['preco_unitario']
+    return itens.reset_index(drop=True), erros
+
+def _adiar_indices(conn, tabelas):
+    """Remove os índices das tabelas e devolve os comandos para recriá-los"""
+    indices = conn.execute(f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL
+        AND tbl_name IN ({', '.join('?' * len(tabelas))})
+    """, tabelas).fetchall()
+    for nome, _ in indices:
+        conn.execute(f'DROP INDEX "{nome}"')
+    return [sql for _, sql in indices]
+
+def importar_vendas(origem, nome=None, baixar_estoque=False, ignorar_invalidos=False):
+    """
+    Importa o histórico de vendas de um arquivo CSV/Parquet (uma linha por item).
+    Com erros de validação nada é gravado, a menos que ignorar_invalidos=True.
+    baixar_estoque=True lança o consumo de ingredientes no razão (sem conferir saldo):
+    uma saída por ingrediente e dia de venda, datada no momento da importação e com
+    o dia da venda no motivo, para não cair antes do saldo de abertura do razão.
+    Retorna (sucesso, mensagem, erros).
+    """
+    inicio = time.perf_counter()
+    try:
+        itens, erros = validar_vendas(ler_tabela(origem, nome))
+    except Exception as e:
+        return False, f"Erro ao ler o arquivo: {e}", None
+    if not erros.empty and not ignorar_invalidos:
+        return False, f"{len(erros)} problemas encontrados; nada foi importado", erros
+    if itens.empty:
+        return False, "Nenhuma linha válida para importar", erros
+
+    try:
+        with transacao() as conn:
+            registrar_escrita('vendas', 'itens_venda', *TABELAS_ROLLUP)
+            primeiro_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM vendas").fetchone()[0]
+
+            pedidos = itens.groupby('pedido', sort=False).agg(
+                data_venda=('data_venda', 'first'),
+                hora_venda=('hora_venda', 'first'),
+                total=('subtotal', 'sum'),
+                observacao=('observacao', 'first'),
+            )
+            pedidos.insert(0, 'id', range(primeiro_id, primeiro_id + len(pedidos)))
+            ultimo_id = primeiro_id + len(pedidos) - 1
+
+            custos = pd.read_sql_query("SELECT produto_id, custo FROM custo_produto", conn)
+            custos = custos.set_index('produto_id')['custo']
+            itens['venda_id'] = itens['pedido'].map(pedidos['id'])
+            itens['custo_variavel'] = itens['produto_id'].map(custos).fillna(0.0) * itens['quantidade']
+
+            recriar = []
+            if len(itens) >= LIMIAR_INDICES_ADIADOS:
+                recriar = _adiar_indices(conn, ('vendas', 'itens_venda'))
+
+            _executar_em_lotes(
+                conn,
+                "INSERT INTO vendas (id, data_venda, hora_venda, total, observacao) VALUES (?, ?, ?, ?, ?)",
+                pedidos[['id', 'data_venda', 'hora_venda', 'total', 'observacao']]
+            )
+            _executar_em_lotes(
+                conn,
+                "INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario, subtotal, custo_variavel) VALUES (?, ?, ?, ?, ?, ?)",
+                itens[['venda_id', 'produto_id', 'quantidade', 'preco_unitario', 'subtotal', 'custo_variavel']]
+            )
+            for comando in recriar:
+                conn.execute(comando)
+
+            for comando in sql_rollups_vendas("v.id BETWEEN ? AND ?"):
+                conn.execute(comando, (primeiro_id, ultimo_id))
+
+            if baixar_estoque:
+                # Uma saída por ingrediente e dia de venda, datada agora (o dia vai no motivo):
+                # datada no passado, cairia antes do saldo de abertura do razão e deixaria
+                # o estoque negativo em todas as datas entre a venda e a abertura
+                registrar_escrita('movimentacoes_estoque', 'ingredientes', 'snapshots_estoque')
+                conn.execute("""
+                    INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo, data_movimentacao)
+                    SELECT r.ingrediente_id, 'saida', SUM(iv.quantidade * r.quantidade),
+                           ? || ' de ' || strftime('%d/%m/%Y', v.data_venda), ?
+                    FROM vendas v
+                    JOIN itens_venda iv ON iv.venda_id = v.id
+                    JOIN receitas_expandidas r ON r.produto_id = iv.produto_id
+                    JOIN ingredientes i ON i.id = r.ingrediente_id
+                    WHERE v.id BETWEEN ? AND ?
+                    GROUP BY v.data_venda, r.ingrediente_id
+                """, (MOTIVO_IMPORTACAO, datetime.now(), primeiro_id, ultimo_id))
+    except Exception as e:
+        return False, f"Erro ao importar vendas: {e}", erros
+
+    segundos = time.perf_counter() - inicio
+    msg = (f"{len(pedidos)} vendas e {len(itens)} itens importados em {segundos:.1f} s "
+           f"({len(itens) / max(segundos, 1e-9) * 60:,.0f} linhas/min)")
+    if not erros.empty:
+        msg += f"; {len(erros)} problemas ignorados"
+    return True, msg, erros
+
+
+# ==============================
+# IMPORTAÇÃO DE INGREDIENTES (LISTA DE PREÇOS)
+# ==============================
+def comparar_ingredientes(dados):
+    """
+    Compara a lista com o cadastro de ingredientes. Retorna (alteracoes, erros):
+    alteracoes só com as linhas novas ou diferentes do cadastro (id, nome, situacao,
+    preco_anterior, preco_kg, unidade, fornecedor, estoque); erros com a linha e o motivo.
+    Campos vazios em ingredientes já cadastrados mantêm o valor atual.
+    """
+    if 'nome' not in dados.columns:
+        return pd.DataFrame(), pd.DataFrame({'linha': [1], 'erro': ["Coluna obrigatória ausente: nome"]})
+    dados = dados.reindex(columns=COLUNAS_INGREDIENTES)
+
+    atuais = pd.read_sql_query("SELECT id, nome, preco_kg, unidade, fornecedor FROM ingredientes", get_conexao())
+    atuais['chave'] = _chave_nome(atuais['nome'])
+    atuais = atuais.drop_duplicates('chave').set_index('chave')
+
+    nomes = _texto(dados['nome'])
+    chaves = _chave_nome(dados['nome'])
+    cadastro = atuais.reindex(chaves.to_numpy()).set_axis(dados.index)
+    existe = cadastro['id'].notna()
+    preco = _numero(dados['preco_kg'])
+    estoque = _numero(dados['estoque'])
+    unidade = _texto(dados['unidade'])
+    fornecedor = _texto(dados['fornecedor'])
+
+    invalidas, erros = _relatorio_erros([
+        (nomes.isna(), "nome vazio"),
+        (chaves.notna() & chaves.duplicated(keep=False), "ingrediente repetido na lista"),
+        (_texto(dados['preco_kg']).notna() & ~(preco >= 0), "preco_kg inválido"),
+        (nomes.notna() & ~existe & preco.isna(), "preco_kg obrigatório para ingrediente novo"),
+        (unidade.notna() & ~unidade.isin(UNIDADES), f"unidade deve ser uma de: {', '.join(UNIDADES)}"),
+        (_texto(dados['estoque']).notna() & ~(estoque >= 0), "estoque inválido"),
+    ])
+
+    lista = pd.DataFrame({
+        'id': cadastro['id'],
+        # Já cadastrado: grava com o nome do cadastro para o ON CONFLICT(nome) casar
+        'nome': cadastro['nome'].where(existe, nomes.astype(object)),
+        'situacao': pd.Series('alterado', index=dados.index).where(existe, 'novo'),
+        'preco_anterior': cadastro['preco_kg'],
+        'preco_kg': preco.fillna(cadastro['preco_kg']),
+        'unidade': unidade.astype(object).fillna(cadastro['unidade']).fillna('kg'),
+        'fornecedor': fornecedor.astype(object).where(fornecedor.notna(), cadastro['fornecedor'])
+                      .where(existe | fornecedor.notna(), 'Não informado'),
+        'estoque': estoque.where(~existe).fillna(0.0),
+    })[~invalidas]
+
+    mudou = (
+        lista['id'].isna()
+        | ((lista['preco_kg'] - lista['preco_anterior']).abs() > 1e-9)
+        | (lista['unidade'] != cadastro.loc[lista.index, 'unidade'])
+        | (lista['fornecedor'].fillna('') != cadastro.loc[lista.index, 'fornecedor'].fillna(''))
+    )
+    return lista[mudou].reset_index(drop=True), erros
+
+def _custos_produtos_afetados(conn, ingrediente_ids):
+    """Custo atual dos produtos que usam algum dos ingredientes (índice reverso da receita expandida)"""
+    return pd.read_sql_query("""
+        SELECT p.id AS produto_id, p.nome AS produto, p.preco_venda, COALESCE(cp.custo, 0) AS custo
+        FROM produtos p
+        LEFT JOIN custo_produto cp ON cp.produto_id = p.id
+        WHERE p.id IN (
+            SELECT DISTINCT produto_id FROM receitas_expandidas
+            WHERE ingrediente_id IN (SELECT value FROM json_each(?))
+        )
+        ORDER BY p.nome
+    """, conn, params=(json.dumps([int(i) for i in ingrediente_ids]),))
+
+def importar_ingredientes(origem, nome=None, aplicar=True):
+    """
+    Importa uma lista de preços de ingredientes (CSV/Parquet/Excel com nome, preco_kg,
+    unidade, fornecedor, estoque). Só as linhas que mudam algo são gravadas, em uma
+    transação; aplicar=False apenas compara. Retorna (sucesso, mensagem, alteracoes, produtos),
+    com produtos = produtos cujo custo mudou (custo_anterior, custo, preco_venda, margem).
+    Se a validação falha, o terceiro item traz os erros (linha, erro).
+    """
+    try:
+        alteracoes, erros = comparar_ingredientes(ler_tabela(origem, nome))
+    except Exception as e:
+        return False, f"Erro ao ler o arquivo: {e}", None, None
+    if not erros.empty:
+        return False, f"{len(erros)} problemas encontrados; nada foi importado", erros, None
+    if alteracoes.empty:
+        return True, "A lista já está igual ao cadastro", alteracoes, None
+
+    novos = int((alteracoes['situacao'] == 'novo').sum())
+    resumo = f"{novos} ingredientes novos e {len(alteracoes) - novos} alterados"
+    if not aplicar:
+        return True, resumo, alteracoes, None
+
+    repreciados = alteracoes.loc[
+        (alteracoes['situacao'] == 'alterado') & ((alteracoes['preco_kg'] - alteracoes['preco_anterior']).abs() > 1e-9), 'id'
+    ]
+    try:
+        with transacao() as conn:
+            registrar_escrita('ingredientes')
+            antes = _custos_produtos_afetados(conn, repreciados)
+            # Os triggers de custo recalculam custo_produto dos produtos afetados
+            conn.executemany("""
+                INSERT INTO ingredientes (nome, preco_kg, unidade, fornecedor) VALUES (?, ?, ?, ?)
+                ON CONFLICT(nome) DO UPDATE SET
+                    preco_kg = excluded.preco_kg,
+                    unidade = excluded.unidade,
+                    fornecedor = excluded.fornecedor
+            """, _linhas(alteracoes[['nome', 'preco_kg', 'unidade', 'fornecedor']]))
+
+            # Estoque inicial dos novos entra no razão; o trigger atualiza estoque_atual
+            iniciais = alteracoes[(alteracoes['situacao'] == 'novo') & (alteracoes['estoque'] > 0)]
+            if not iniciais.empty:
+                registrar_escrita('movimentacoes_estoque')
+                conn.executemany("""
+                    INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo, data_movimentacao)
+                    SELECT id, 'entrada', ?, 'Estoque inicial', ? FROM ingredientes WHERE nome = ?
+                """, [(float(q), datetime.now(), n) for q, n in zip(iniciais['estoque'], iniciais['nome'])])
+
+            depois = _custos_produtos_afetados(conn, repreciados)
+    except Exception as e:
+        return False, f"Erro ao importar ingredientes: {e}", alteracoes, None
+
+    produtos = antes[['produto_id', 'custo']].rename(columns={'custo': 'custo_anterior'}).merge(depois, on='produto_id')
+    produtos = produtos[(produtos['custo'] - produtos['custo_anterior']).abs() > 1e-9]
+    produtos['margem'] = produtos['preco_venda'] - produtos['custo']
+    produtos = produtos[['produto_id', 'produto', 'custo_anterior', 'custo', 'preco_venda', 'margem']].reset_index(drop=True)
+    return True, f"{resumo}; custo de {len(produtos)} produtos atualizado", alteracoes, produtos
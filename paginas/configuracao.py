@@ -1,9 +1,22 @@
 import streamlit as st
-import pandas as pd
-from datetime import datetime, timedelta
-from funcoesAux import get_dataframe, executar_query
+from datetime import datetime
+from funcoesAux import executar_query, reconstruir_rollups, conciliar_estoque, get_historico_conciliacoes
+from exportacao import FORMATOS, iniciar_exportacao, get_tarefa
+from arquivamento import (
+    arquivar_historico, get_corte_arquivo, get_tamanho_arquivo, get_historico_arquivamentos,
+    MESES_QUENTES, PASTA_ARQUIVO
+)
+from importacao import importar_vendas
+from backup import gerar_backup, listar_backups, compressoes_disponiveis, GERACOES_BACKUP, PASTA_BACKUPS
 import os
-from io import BytesIO  # <- necessário para Excel em memória
+
+@st.fragment(run_every=1)
+def progresso_exportacao(tarefa):
+    """Acompanha a exportação em andamento; ao terminar, recarrega a página uma vez"""
+    if tarefa.status in ('pendente', 'executando'):
+        st.progress(tarefa.progresso, text=f"Exportando {tarefa.aba_atual or '...'} — {tarefa.linhas} linhas")
+    else:
+        st.rerun()
 
 def modulo_configuracao():
 
@@ -18,80 +31,71 @@ def modulo_configuracao():
 
         with col1:
             st.markdown("### 💾 Exportar Dados")
-            # Ler o arquivo do banco
-            with open("natureba.db", "rb") as f:
-                dados_db = f.read()
-            st.download_button(
-                label="📥 Baixar Backup do Banco de Dados",
-                data=dados_db,
-                file_name="natureba_backup.db",
-                mime="application/x-sqlite3"
-            )
+            compressao = st.selectbox("Compressão", compressoes_disponiveis())
+
+            if st.button("💾 Gerar Backup Agora"):
+                # Cópia online em passos: as vendas continuam sendo gravadas durante o backup
+                barra = st.progress(0.0, text="Copiando banco...")
+                sucesso, msg, _ = gerar_backup(compressao, lambda f: barra.progress(f, text="Copiando banco..."))
+                barra.empty()
+                if sucesso:
+                    st.success(msg)
+                else:
+                    st.error(msg)
+
+            backups = listar_backups()
+            if backups.empty:
+                st.info("Nenhum backup gerado ainda.")
+            else:
+                st.caption(f"Últimas {GERACOES_BACKUP} gerações guardadas em `{PASTA_BACKUPS}/`")
+                st.dataframe(
+                    backups[['arquivo', 'criado_em', 'tamanho_mb']],
+                    column_config={'tamanho_mb': st.column_config.NumberColumn("Tamanho (MB)", format="%.2f")},
+                    hide_index=True,
+                    use_container_width=True
+                )
+                # O arquivo só é lido quando uma geração é escolhida
+                escolhido = st.selectbox("Baixar geração", [None] + backups['arquivo'].tolist(),
+                                         format_func=lambda x: "Selecione..." if x is None else x)
+                if escolhido:
+                    caminho = backups.loc[backups['arquivo'] == escolhido, 'caminho'].iloc[0]
+                    with open(caminho, "rb") as arquivo:
+                        st.download_button(
+                            label="📥 Baixar Backup do Banco de Dados",
+                            data=arquivo,
+                            file_name=escolhido,
+                            mime="application/zstd" if escolhido.endswith(".zst") else "application/gzip"
+                        )
 
         with col2:
             st.markdown("### 📈 Exportar Relatórios")
             data_inicio = st.date_input("Data Início", value=datetime.now().date().replace(day=1))
             data_fim = st.date_input("Data Fim", value=datetime.now().date())
 
-            if st.button("📊 Gerar Relatório Excel"):
-                # Itens vendidos detalhados
-                itens_vendidos = get_dataframe("""
-                    SELECT 
-                        v.data_venda,
-                        v.hora_venda,
-                        p.nome AS produto,
-                        p.categoria,
-                        iv.quantidade,
-                        iv.preco_unitario,
-                        iv.subtotal AS total,
-                        iv.custo_variavel,
-                        (iv.subtotal - iv.custo_variavel) AS margem
-                    FROM itens_venda iv
-                    JOIN vendas v ON iv.venda_id = v.id
-                    JOIN produtos p ON iv.produto_id = p.id
-                    WHERE v.data_venda BETWEEN ? AND ?
-                    ORDER BY v.data_venda DESC
-                """, (data_inicio, data_fim))
-
-                # Resumo diário das vendas
-                resumo_vendas = itens_vendidos.groupby(['data_venda']).agg(
-                    total_venda=('total', 'sum'),
-                    custo_total=('custo_variavel', 'sum'),
-                    margem_total=('margem', 'sum'),
-                    qtd_itens=('quantidade', 'sum')
-                ).reset_index()
-
-                # Produtos cadastrados
-                produtos = get_dataframe("SELECT * FROM produtos")
-
-                # Custos operacionais no período
-                custos = get_dataframe("""
-                    SELECT * FROM custos_operacionais
-                    WHERE data_custo BETWEEN ? AND ?
-                """, (data_inicio, data_fim))
-
-                # Movimentações de estoque
-                movimentos = get_dataframe("""
-                    SELECT * FROM movimentacoes_estoque
-                    WHERE data_movimentacao BETWEEN ? AND ?
-                """, (data_inicio, data_fim))
-
-                # Criar Excel em memória
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    itens_vendidos.to_excel(writer, sheet_name='Itens Vendidos', index=False)
-                    resumo_vendas.to_excel(writer, sheet_name='Resumo Vendas', index=False)
-                    produtos.to_excel(writer, sheet_name='Produtos', index=False)
-                    custos.to_excel(writer, sheet_name='Custos Operacionais', index=False)
-                    movimentos.to_excel(writer, sheet_name='Movimentacoes Estoque', index=False)
-
-                output.seek(0)
-                st.download_button(
-                    label="📥 Baixar Relatório Completo",
-                    data=output,
-                    file_name=f"relatorio_natureba_{data_inicio}_{data_fim}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            formato = st.selectbox("Formato", list(FORMATOS), format_func=lambda x: FORMATOS[x][0])
+
+            if st.button("📊 Gerar Relatório"):
+                # Exporta em segundo plano; a página só acompanha o progresso
+                tarefa = iniciar_exportacao(formato, data_inicio, data_fim)
+                st.session_state["exportacao_id"] = tarefa.id
+
+            tarefa = get_tarefa(st.session_state.get("exportacao_id"))
+            if tarefa is None:
+                st.session_state.pop("exportacao_id", None)
+            elif tarefa.status in ('pendente', 'executando'):
+                progresso_exportacao(tarefa)
+            elif tarefa.status == 'erro':
+                st.error(f"Erro ao gerar relatório: {tarefa.erro}")
+                st.session_state.pop("exportacao_id", None)
+            else:
+                st.success(f"✅ Relatório pronto ({tarefa.linhas} linhas)")
+                with open(tarefa.caminho, "rb") as arquivo:
+                    st.download_button(
+                        label="📥 Baixar Relatório Completo",
+                        data=arquivo,
+                        file_name=tarefa.nome_arquivo,
+                        mime=tarefa.mime
+                    )
 
 
     # ------------------ TAB 2: Gerenciar Dados ------------------
@@ -101,16 +105,20 @@ def modulo_configuracao():
 
         with col1:
             st.markdown("### 🧹 Limpeza de Dados")
-            if st.button("🗑️ Limpar Vendas Antigas (>1 ano)"):
-                data_limite = datetime.now().date() - timedelta(days=365)
-                vendas_antigas = executar_query(
-                    "SELECT COUNT(*) FROM vendas WHERE data_venda < ?", (data_limite,)
-                )
-                if vendas_antigas and vendas_antigas[0][0] > 0:
-                    executar_query("DELETE FROM vendas WHERE data_venda < ?", (data_limite,))
-                    st.success(f"✅ {vendas_antigas[0][0]} vendas antigas removidas!")
+            # Meses antigos vão para o arquivo Parquet (os rollups e os relatórios continuam cobrindo)
+            if st.button(f"📦 Arquivar Histórico (>{MESES_QUENTES} meses)"):
+                sucesso, msg = arquivar_historico()
+                if sucesso:
+                    st.success(f"✅ {msg}")
                 else:
-                    st.info("Nenhuma venda antiga encontrada.")
+                    st.error(msg)
+
+            corte_arquivo = get_corte_arquivo()
+            if corte_arquivo:
+                particoes, tamanho_arquivo = get_tamanho_arquivo()
+                st.caption(f"Arquivado até {corte_arquivo}: {particoes} partições, {tamanho_arquivo:.2f} MB em `{PASTA_ARQUIVO}/`")
+                with st.expander("📜 Últimos arquivamentos"):
+                    st.dataframe(get_historico_arquivamentos(), use_container_width=True, hide_index=True)
             
             if st.button("🔄 Recalcular Totais"):
                 executar_query("""
@@ -120,6 +128,13 @@ def modulo_configuracao():
                 """)
                 st.success("✅ Totais recalculados!")
 
+            if st.button("📊 Reconstruir Rollups de Vendas"):
+                sucesso, msg = reconstruir_rollups()
+                if sucesso:
+                    st.success(f"✅ {msg}")
+                else:
+                    st.error(msg)
+
         with col2:
             st.markdown("### 📊 Estatísticas do Banco")
             stats_produtos = executar_query("SELECT COUNT(*) FROM produtos")[0][0]
@@ -136,6 +151,63 @@ def modulo_configuracao():
             except:
                 st.metric("💾 Tamanho do Banco", "N/A")
 
+        # Importação do histórico de vendas de outro PDV
+        st.markdown("---")
+        st.markdown("### 📥 Importar Vendas Históricas")
+        st.caption(
+            "CSV ou Parquet com uma linha por item: pedido, data_venda, hora_venda, produto, "
+            "quantidade, preco_unitario, observacao (só data_venda, produto e quantidade são obrigatórias)"
+        )
+        with st.form("form_importar_vendas"):
+            arquivo_vendas = st.file_uploader("Arquivo de vendas", type=["csv", "parquet"])
+            baixar_estoque = st.checkbox("Lançar o consumo de ingredientes no estoque")
+            ignorar_invalidos = st.checkbox("Importar as linhas válidas mesmo se houver erros")
+            importar = st.form_submit_button("📥 Importar Vendas")
+        if importar and arquivo_vendas is not None:
+            with st.spinner("Importando vendas..."):
+                sucesso, msg, erros = importar_vendas(
+                    arquivo_vendas, baixar_estoque=baixar_estoque, ignorar_invalidos=ignorar_invalidos
+                )
+            if sucesso:
+                st.success(f"✅ {msg}")
+            else:
+                st.error(msg)
+            if erros is not None and not erros.empty:
+                st.dataframe(erros, use_container_width=True, hide_index=True)
+
+        # Conciliação: estoque dos ingredientes x razão de movimentações
+        st.markdown("---")
+        st.markdown("### 🧮 Conciliação de Estoque")
+        incremental = st.checkbox("Só ingredientes alterados (ou divergentes) desde a última conciliação", value=True)
+        c1, c2 = st.columns(2)
+        with c1:
+            conferir = st.button("🔍 Conferir Estoque x Razão")
+        with c2:
+            corrigir = st.button("🛠️ Corrigir Divergências")
+        if conferir or corrigir:
+            sucesso, msg, divergencias = conciliar_estoque(incremental=incremental, corrigir=corrigir)
+            if not sucesso:
+                st.error(msg)
+            else:
+                st.success(f"✅ {msg}")
+                if not divergencias.empty:
+                    st.dataframe(
+                        divergencias[['nome', 'estoque_atual', 'saldo_razao', 'diferenca', 'unidade']].rename(columns={
+                            'nome': 'Ingrediente',
+                            'estoque_atual': 'Contador',
+                            'saldo_razao': 'Razão',
+                            'diferenca': 'Diferença',
+                            'unidade': 'Unidade'
+                        }).style.format({'Contador': '{:.2f}', 'Razão': '{:.2f}', 'Diferença': '{:+.2f}'}),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+
+        historico = get_historico_conciliacoes()
+        if not historico.empty:
+            with st.expander("📜 Últimas conciliações"):
+                st.dataframe(historico, use_container_width=True, hide_index=True)
+
     # ------------------ TAB 3: Informações do Sistema ------------------
     with tab3:
         st.subheader("Informações do Sistema")
@@ -1,6 +1,12 @@
 import streamlit as st
 import pandas as pd
-from funcoesAux import get_dataframe
+from funcoesAux import (
+    get_kpis_dashboard,
+    get_estoque_dashboard,
+    get_top_produtos,
+    get_evolucao_receita,
+    LIMITE_PRONTO_BAIXO
+)
 from datetime import datetime
 import plotly.express as px
 from dateutil.relativedelta import relativedelta
@@ -46,50 +52,7 @@ def dashboard():
     # =============================
     # ALERTAS E NOTIFICAÇÕES
     # =============================
-    st.subheader("🔔 Alertas e Notificações")
-    
-    # Verificar estoque baixo de ingredientes
-    ingredientes_baixos = get_dataframe("""
-        SELECT nome, estoque_atual, unidade
-        FROM ingredientes
-        WHERE estoque_atual <= 5 AND estoque_atual > 0
-        ORDER BY estoque_atual ASC
-        LIMIT 5
-    """)
-    
-    # Verificar estoque zerado
-    ingredientes_zerados = get_dataframe("""
-        SELECT COUNT(*) as total
-        FROM ingredientes
-        WHERE estoque_atual <= 0
-    """)
-    
-    # Estoque de produtos prontos baixo
-    produtos_baixos = get_dataframe("""
-        SELECT p.nome, ep.quantidade_atual
-        FROM estoque_pronto ep
-        JOIN produtos p ON ep.produto_id = p.id
-        WHERE ep.quantidade_atual <= 10 AND ep.quantidade_atual > 0
-        ORDER BY ep.quantidade_atual ASC
-        LIMIT 5
-    """)
-    
-    alerta_col1, alerta_col2 = st.columns(2)
-    
-    with alerta_col1:
-        if not ingredientes_zerados.empty and ingredientes_zerados.iloc[0]['total'] > 0:
-            st.error(f"🔴 **{ingredientes_zerados.iloc[0]['total']} ingrediente(s) zerado(s)!**")
-        
-        if not ingredientes_baixos.empty:
-            st.warning("🟡 **Ingredientes com estoque baixo:**")
-            for _, item in ingredientes_baixos.iterrows():
-                st.write(f"• {item['nome']}: {item['estoque_atual']:.2f} {item['unidade']}")
-    
-    with alerta_col2:
-        if not produtos_baixos.empty:
-            st.warning("🟡 **Produtos prontos com estoque baixo:**")
-            for _, item in produtos_baixos.iterrows():
-                st.write(f"• {item['nome']}: {item['quantidade_atual']:.0f} unidades")
+    painel_alertas()
     
     st.markdown("---")
     
@@ -106,27 +69,11 @@ def dashboard():
     # =============================
     # MÉTRICAS FINANCEIRAS
     # =============================
-    # Receita total
-    receita_total = float(get_dataframe(
-        "SELECT COALESCE(SUM(total),0) as total FROM vendas WHERE data_venda BETWEEN ? AND ?", 
-        (data_inicio, data_fim)
-    )['total'].iloc[0])
-
-    # Custos variáveis (entradas de estoque)
-    custos_variaveis = float(get_dataframe("""
-        SELECT COALESCE(SUM(m.quantidade * i.preco_kg), 0) AS total_custo
-        FROM movimentacoes_estoque m
-        JOIN ingredientes i ON m.ingrediente_id = i.id
-        WHERE m.tipo = 'entrada' 
-        AND DATE(m.data_movimentacao) BETWEEN ? AND ?
-    """, (data_inicio, data_fim))['total_custo'].iloc[0])
-
-    # Custos fixos
-    custos_fixos = float(get_dataframe("""
-        SELECT COALESCE(SUM(valor),0) as total_custo_fixo
-        FROM custos_operacionais
-        WHERE recorrente = 1 AND data_custo BETWEEN ? AND ?
-    """, (data_inicio, data_fim))['total_custo_fixo'].iloc[0])
+    # Receita (rollup diário), custos variáveis e fixos: uma consulta, cacheada
+    kpis = get_kpis_dashboard(data_inicio, data_fim)
+    receita_total = float(kpis['receita'])
+    custos_variaveis = float(kpis['custos_variaveis'])
+    custos_fixos = float(kpis['custos_fixos'])
 
     # Margens e indicadores
     margem_contrib_total = receita_total - custos_variaveis
@@ -155,44 +102,67 @@ def dashboard():
     # =============================
     st.subheader("📅 Resumo de Hoje")
     
-    hoje = datetime.now().date()
-    vendas_hoje = get_dataframe("""
-        SELECT COUNT(*) as total_vendas, 
-               COALESCE(SUM(total), 0) as faturamento_hoje
-        FROM vendas
-        WHERE data_venda = ?
-    """, (hoje,))
+    # Resumo de hoje vem na mesma consulta dos KPIs
+    c1, c2, c3 = st.columns(3)
+    c1.metric("🛒 Vendas Hoje", int(kpis['vendas_hoje']))
+    c2.metric("💰 Faturamento Hoje", format_brl(kpis['faturamento_hoje']))
     
-    if not vendas_hoje.empty:
-        c1, c2, c3 = st.columns(3)
-        c1.metric("🛒 Vendas Hoje", int(vendas_hoje.iloc[0]['total_vendas']))
-        c2.metric("💰 Faturamento Hoje", format_brl(vendas_hoje.iloc[0]['faturamento_hoje']))
-        
-        # Meta diária (exemplo: R$ 500)
-        meta_diaria = 500.0
-        percentual_meta = (vendas_hoje.iloc[0]['faturamento_hoje'] / meta_diaria * 100) if meta_diaria > 0 else 0
-        c3.metric("🎯 Meta Diária", f"{percentual_meta:.1f}%", delta=f"Meta: {format_brl(meta_diaria)}")
+    # Meta diária (exemplo: R$ 500)
+    meta_diaria = 500.0
+    percentual_meta = (kpis['faturamento_hoje'] / meta_diaria * 100) if meta_diaria > 0 else 0
+    c3.metric("🎯 Meta Diária", f"{percentual_meta:.1f}%", delta=f"Meta: {format_brl(meta_diaria)}")
     
     st.markdown("---")
 
     # =============================
     # GRÁFICOS
     # =============================
-    # Vendas por produto
+    painel_top_produtos(data_inicio, data_fim)
+
+    painel_evolucao(data_inicio, data_fim)
+    
+    # =============================
+    # PRODUTOS PRONTOS EM ESTOQUE
+    # =============================
+    st.markdown("---")
+    painel_estoque_pronto()
+
+# -----------------------------
+# Painéis (fragmentos reexecutados de forma independente)
+# -----------------------------
+@st.fragment
+def painel_alertas():
+    """Alertas de estoque de ingredientes e produtos prontos"""
+    st.subheader("🔔 Alertas e Notificações")
+
+    # Alertas vêm do cache de estoque (uma consulta para o painel inteiro)
+    ingredientes_baixos, estoque_pronto, zerados = get_estoque_dashboard()
+    produtos_baixos = estoque_pronto[estoque_pronto['quantidade'] <= LIMITE_PRONTO_BAIXO] \
+        .sort_values('quantidade').head(5)
+
+    alerta_col1, alerta_col2 = st.columns(2)
+
+    with alerta_col1:
+        if zerados > 0:
+            st.error(f"🔴 **{zerados} ingrediente(s) zerado(s)!**")
+        
+        if not ingredientes_baixos.empty:
+            st.warning("🟡 **Ingredientes com estoque baixo:**")
+            for _, item in ingredientes_baixos.iterrows():
+                st.write(f"• {item['nome']}: {item['quantidade']:.2f} {item['unidade']}")
+
+    with alerta_col2:
+        if not produtos_baixos.empty:
+            st.warning("🟡 **Produtos prontos com estoque baixo:**")
+            for _, item in produtos_baixos.iterrows():
+                st.write(f"• {item['nome']}: {item['quantidade']:.0f} unidades")
+
+
+@st.fragment
+def painel_top_produtos(data_inicio, data_fim):
+    """Gráfico dos produtos mais vendidos no período"""
     st.subheader("📊 Produtos Mais Vendidos")
-    vendas_produto = get_dataframe(f"""
-        SELECT 
-            p.nome, 
-            SUM(iv.quantidade) AS total_vendido, 
-            SUM(iv.subtotal) AS faturamento
-        FROM itens_venda iv
-        JOIN produtos p ON iv.produto_id = p.id
-        JOIN vendas v ON iv.venda_id = v.id
-        WHERE v.data_venda BETWEEN ? AND ?
-        GROUP BY p.nome
-        ORDER BY total_vendido DESC
-        LIMIT 10
-    """, (data_inicio, data_fim))
+    vendas_produto = get_top_produtos(data_inicio, data_fim)
 
     if not vendas_produto.empty:
         fig_produtos = px.bar(
@@ -207,28 +177,19 @@ def dashboard():
     else:
         st.info("Nenhuma venda registrada no período selecionado.")
 
-    # Evolução de receita
+
+@st.fragment
+def painel_evolucao(data_inicio, data_fim):
+    """Evolução de receita; o agrupamento por mês reexecuta só este painel"""
     st.subheader("📈 Evolução de Receita")
     agrupar_por_mes = st.checkbox("📅 Agrupar por Mês", value=False)
-    
+
+    # Cache próprio: alternar o agrupamento não reconsulta os KPIs financeiros
+    vendas_agrupadas = get_evolucao_receita(data_inicio, data_fim, por_mes=agrupar_por_mes)
     if agrupar_por_mes:
-        vendas_agrupadas = get_dataframe(f"""
-            SELECT strftime('%Y-%m', data_venda) as mes, SUM(total) as faturamento
-            FROM vendas
-            WHERE data_venda BETWEEN ? AND ?
-            GROUP BY mes
-            ORDER BY mes
-        """, (data_inicio, data_fim))
         eixo_x = 'mes'
         titulo = "Evolução de Receita por Mês"
     else:
-        vendas_agrupadas = get_dataframe(f"""
-            SELECT data_venda, SUM(total) as faturamento
-            FROM vendas
-            WHERE data_venda BETWEEN ? AND ?
-            GROUP BY data_venda
-            ORDER BY data_venda
-        """, (data_inicio, data_fim))
         eixo_x = 'data_venda'
         titulo = "Evolução de Receita por Dia"
 
@@ -240,32 +201,26 @@ def dashboard():
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("Nenhuma venda registrada no período selecionado.")
-    
-    # =============================
-    # PRODUTOS PRONTOS EM ESTOQUE
-    # =============================
-    st.markdown("---")
+
+
+@st.fragment
+def painel_estoque_pronto():
+    """Gráfico do estoque de produtos prontos"""
     st.subheader("🍞 Estoque de Produtos Prontos")
-    
-    estoque_pronto = get_dataframe("""
-        SELECT p.nome, ep.quantidade_atual, p.categoria
-        FROM estoque_pronto ep
-        JOIN produtos p ON ep.produto_id = p.id
-        WHERE ep.quantidade_atual > 0
-        ORDER BY ep.quantidade_atual DESC
-    """)
-    
+
+    # Mesmo DataFrame cacheado usado pelos alertas (sem nova consulta)
+    _, estoque_pronto, _ = get_estoque_dashboard()
     if not estoque_pronto.empty:
         fig_estoque = px.bar(
             estoque_pronto,
             x='nome',
-            y='quantidade_atual',
-            text='quantidade_atual',
+            y='quantidade',
+            text='quantidade',
             color='categoria',
             title="Estoque Atual de Produtos Prontos",
-            labels={'quantidade_atual': 'Quantidade', 'nome': 'Produto'}
+            labels={'quantidade': 'Quantidade', 'nome': 'Produto'}
         )
         fig_estoque.update_traces(texttemplate='%{text:.0f}', textposition='outside')
         st.plotly_chart(fig_estoque, use_container_width=True)
     else:
-        st.info("Nenhum produto pronto em estoque no momento")
\ No newline at end of file
+        st.info("Nenhum produto pronto em estoque no momento")
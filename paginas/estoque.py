@@ -1,7 +1,12 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from funcoesAux import get_dataframe, executar_query
+from funcoesAux import (
+    get_dataframe, executar_query, get_ingredientes, get_indice_ingredientes,
+    cadastrar_ingrediente, registrar_movimentacao, excluir_movimentacao, atualizar_ingrediente,
+    get_saldos_estoque
+)
+from importacao import importar_ingredientes
 import plotly.express as px
 
 def modulo_estoque():
@@ -41,37 +46,62 @@ def modulo_estoque():
                     if not nome or preco_kg <= 0:
                         st.error("Preencha nome e preço corretamente.")
                     else:
-                        try:
-                            # Insert e registro de estoque inicial (movimentação) se > 0
-                            executar_query(
-                                "INSERT INTO ingredientes (nome, preco_kg, estoque_atual, unidade, fornecedor) VALUES (?, ?, ?, ?, ?)",
-                                (nome.strip(), float(preco_kg), float(estoque_inicial), unidade, fornecedor or "Não informado")
-                            )
-                            if estoque_inicial > 0:
-                                # pega id recém-criado (assume que executar_query retorna algo ou temos que consultar)
-                                # aqui utilizamos SELECT para garantir compatibilidade
-                                novo = get_dataframe("SELECT id FROM ingredientes WHERE nome = ? ORDER BY id DESC LIMIT 1", (nome.strip(),))
-                                if novo is not None and not novo.empty:
-                                    ing_id = int(novo.iloc[0]['id'])
-                                    executar_query(
-                                        "INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo, data_movimentacao) VALUES (?, 'entrada', ?, 'Estoque inicial', ?)",
-                                        (ing_id, float(estoque_inicial), datetime.now())
-                                    )
+                        # Ingrediente e estoque inicial (movimentação no razão) na mesma transação
+                        sucesso, msg, _ = cadastrar_ingrediente(
+                            nome.strip(), float(preco_kg), float(estoque_inicial), unidade, fornecedor or "Não informado"
+                        )
+                        if sucesso:
                             st.success("Ingrediente cadastrado.")
                             st.rerun()
-                        except Exception as e:
-                            if "UNIQUE constraint failed" in str(e):
-                                st.error("Já existe um ingrediente com esse nome.")
-                            else:
-                                st.error(f"Erro ao cadastrar: {e}")
+                        else:
+                            st.error(f"{msg}.")
+
+        # --- Lista de preços do fornecedor: compara com o cadastro e grava só o que mudou
+        with st.expander("📥 Importar Lista de Preços", expanded=False):
+            st.caption(
+                "CSV, Excel ou Parquet com as colunas nome, preco_kg, unidade, fornecedor e estoque. "
+                "Campos vazios mantêm o valor atual; estoque só vale para ingredientes novos."
+            )
+            arquivo_precos = st.file_uploader("Lista de preços", type=["csv", "xlsx", "parquet"], key="lista_precos")
+            if arquivo_precos is not None:
+                sucesso, msg, alteracoes, _ = importar_ingredientes(arquivo_precos, aplicar=False)
+                if not sucesso:
+                    st.error(msg)
+                    if alteracoes is not None and not alteracoes.empty:
+                        st.dataframe(alteracoes, use_container_width=True, hide_index=True)
+                elif alteracoes.empty:
+                    st.info(msg)
+                else:
+                    st.markdown(f"**{msg}**")
+                    st.dataframe(
+                        alteracoes[['nome', 'situacao', 'preco_anterior', 'preco_kg', 'unidade', 'fornecedor', 'estoque']]
+                        .rename(columns={'nome': 'Ingrediente', 'situacao': 'Situação', 'preco_anterior': 'Preço Atual',
+                                         'preco_kg': 'Novo Preço', 'unidade': 'Unidade', 'fornecedor': 'Fornecedor',
+                                         'estoque': 'Estoque Inicial'}),
+                        use_container_width=True, hide_index=True
+                    )
+                    if st.button(f"✅ Aplicar {len(alteracoes)} alterações"):
+                        arquivo_precos.seek(0)
+                        sucesso, msg, _, produtos = importar_ingredientes(arquivo_precos)
+                        if not sucesso:
+                            st.error(msg)
+                        else:
+                            st.success(msg)
+                            if produtos is not None and not produtos.empty:
+                                st.markdown("**Produtos com custo alterado**")
+                                st.dataframe(
+                                    produtos[['produto', 'custo_anterior', 'custo', 'preco_venda', 'margem']]
+                                    .rename(columns={'produto': 'Produto', 'custo_anterior': 'Custo Anterior',
+                                                     'custo': 'Novo Custo', 'preco_venda': 'Preço de Venda',
+                                                     'margem': 'Margem'})
+                                    .style.format({'Custo Anterior': 'R$ {:.2f}', 'Novo Custo': 'R$ {:.2f}',
+                                                   'Preço de Venda': 'R$ {:.2f}', 'Margem': 'R$ {:.2f}'}),
+                                    use_container_width=True, hide_index=True
+                                )
 
         # --- Tabela de ingredientes com filtros simples
-        ingredientes = get_dataframe("""
-            SELECT id, nome, preco_kg, estoque_atual, unidade, fornecedor,
-                   (preco_kg * estoque_atual) as valor_estoque
-            FROM ingredientes
-            ORDER BY nome
-        """)
+        ingredientes = get_ingredientes()
+        ingredientes['valor_estoque'] = ingredientes['preco_kg'] * ingredientes['estoque_atual']
         if ingredientes is None or ingredientes.empty:
             st.info("Nenhum ingrediente cadastrado.")
         else:
@@ -191,14 +221,15 @@ def modulo_estoque():
                     salvar, cancelar = st.columns(2)
                     with salvar:
                         if st.form_submit_button("💾 Salvar"):
-                            try:
-                                executar_query("UPDATE ingredientes SET nome=?, preco_kg=?, estoque_atual=?, unidade=?, fornecedor=? WHERE id=?",
-                                              (nome_e.strip(), float(preco_e), float(estoque_e), unidade_e, fornecedor_e or "Não informado", edit_id))
-                                st.success("Ingrediente atualizado.")
+                            # estoque não é editado direto: a diferença vira um ajuste no razão, na mesma transação
+                            sucesso, msg = atualizar_ingrediente(edit_id, nome_e.strip(), float(preco_e), unidade_e,
+                                                                 fornecedor_e or "Não informado", float(estoque_e))
+                            if sucesso:
+                                st.success(f"{msg}.")
                                 st.session_state.pop("edit_ingrediente", None)
                                 st.rerun()
-                            except Exception as e:
-                                st.error(f"Erro ao atualizar: {e}")
+                            else:
+                                st.error(msg)
                     with cancelar:
                         if st.form_submit_button("✖️ Cancelar"):
                             st.session_state.pop("edit_ingrediente", None)
@@ -209,7 +240,8 @@ def modulo_estoque():
     # ------------------------
     with tab2:
         st.subheader("Movimentação de Estoque")
-        ingredientes = get_dataframe("SELECT id, nome, estoque_atual, unidade FROM ingredientes ORDER BY nome")
+        ingredientes = get_ingredientes()
+        indice_ingredientes = get_indice_ingredientes()
         if ingredientes is None or ingredientes.empty:
             st.info("Cadastre ingredientes antes de movimentar.")
         else:
@@ -217,7 +249,7 @@ def modulo_estoque():
                 m1, m2, m3 = st.columns(3)
                 with m1:
                     ingr_id = st.selectbox("Ingrediente*", options=ingredientes['id'].tolist(),
-                                           format_func=lambda x: f"{ingredientes[ingredientes['id']==x]['nome'].iloc[0]} (Atual: {ingredientes[ingredientes['id']==x]['estoque_atual'].iloc[0]:.2f})")
+                                           format_func=lambda x: f"{indice_ingredientes[x]['nome']} (Atual: {indice_ingredientes[x]['estoque_atual']:.2f})")
                 with m2:
                     tipo = st.selectbox("Tipo*", ["entrada","saida"])
                     qtd = st.number_input("Quantidade*", min_value=0.01, format="%.2f")
@@ -228,19 +260,13 @@ def modulo_estoque():
                     if not motivo or qtd <= 0:
                         st.error("Preencha motivo e quantidade corretamente.")
                     else:
-                        try:
-                            # registra movimentação
-                            executar_query("INSERT INTO movimentacoes_estoque (ingrediente_id, tipo, quantidade, motivo, data_movimentacao) VALUES (?, ?, ?, ?, ?)",
-                                          (int(ingr_id), tipo, float(qtd), motivo, datetime.now()))
-                            # atualiza estoque
-                            if tipo == "entrada":
-                                executar_query("UPDATE ingredientes SET estoque_atual = estoque_atual + ? WHERE id = ?", (float(qtd), int(ingr_id)))
-                            else:
-                                executar_query("UPDATE ingredientes SET estoque_atual = estoque_atual - ? WHERE id = ?", (float(qtd), int(ingr_id)))
+                        # registra no razão; o estoque do ingrediente acompanha por trigger
+                        sucesso, msg = registrar_movimentacao(int(ingr_id), tipo, float(qtd), motivo)
+                        if sucesso:
                             st.success("Movimentação registrada.")
                             st.rerun()
-                        except Exception as e:
-                            st.error(f"Erro ao registrar movimentação: {e}")
+                        else:
+                            st.error(msg)
 
     # ------------------------
     # TAB 3 - HISTÓRICO MOVIMENTAÇÕES (com filtro e delete)
@@ -293,14 +319,29 @@ def modulo_estoque():
             sel = st.selectbox("Selecione movimentação", ["-- nada --"] + op)
             if sel != "-- nada --":
                 mid = mapa[sel]
+                st.caption("Excluir a movimentação reverte o efeito dela no estoque do ingrediente.")
                 if st.button("❌ Excluir movimentação"):
-                    try:
-                        # Observação: excluindo movimentação não reverte estoque automaticamente (evitar efeitos colaterais)
-                        executar_query("DELETE FROM movimentacoes_estoque WHERE id = ?", (mid,))
-                        st.success("Movimentação excluída.")
+                    sucesso, msg = excluir_movimentacao(mid)
+                    if sucesso:
+                        st.success(f"{msg}.")
                         st.rerun()
-                    except Exception as e:
-                        st.error(f"Erro ao excluir: {e}")
+                    else:
+                        st.error(msg)
+
+        # --- Saldo em uma data (snapshot + movimentações depois dele)
+        st.markdown("---")
+        st.subheader("Estoque em uma data")
+        data_saldo = st.date_input("Saldo ao fim do dia", value=datetime.now().date(), key="data_saldo_estoque")
+        saldos = get_saldos_estoque(data_saldo)
+        if saldos.empty:
+            st.info("Nenhum ingrediente cadastrado.")
+        else:
+            st.dataframe(
+                saldos[['nome','saldo','unidade']]
+                .rename(columns={'nome':'Ingrediente','saldo':'Saldo','unidade':'Unidade'})
+                .style.format({'Saldo':'{:.2f}'}),
+                use_container_width=True
+            )
 
     # ------------------------
     # TAB 4 - ALERTAS e LISTA DE COMPRAS
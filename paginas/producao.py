@@ -1,10 +1,7 @@
 import streamlit as st
-import pandas as pd
-import sqlite3
+from funcoesAux import get_dataframe, executar_query, get_produtos
 
 def modulo_producao():
-    conn = sqlite3.connect('natureba.db', check_same_thread=False)
-
     st.header("🥖 Gestão de Produção - Natureba")
 
     tab1, tab2 = st.tabs(["➕ Registrar Produção", "📋 Estoque Atual"])
@@ -16,7 +13,7 @@ def modulo_producao():
         st.subheader("Registrar nova produção")
         
         # Puxar produtos ativos
-        produtos = pd.read_sql_query("SELECT id, nome FROM produtos WHERE ativo=1 ORDER BY nome", conn)
+        produtos = get_produtos(apenas_ativos=True)
         produto_dict = {row['nome']: row['id'] for _, row in produtos.iterrows()}
         
         if produtos.empty:
@@ -33,22 +30,21 @@ def modulo_producao():
                 if submitted:
                     produto_id = produto_dict[produto_nome]
                     
-                    estoque = conn.execute(
+                    estoque = executar_query(
                         "SELECT quantidade_atual FROM estoque_pronto WHERE produto_id=?",
                         (produto_id,)
-                    ).fetchone()
+                    )
                     
                     if estoque:
-                        conn.execute(
+                        executar_query(
                             "UPDATE estoque_pronto SET quantidade_atual = quantidade_atual + ?, ultima_atualizacao = CURRENT_TIMESTAMP WHERE produto_id=?",
                             (quantidade, produto_id)
                         )
                     else:
-                        conn.execute(
+                        executar_query(
                             "INSERT INTO estoque_pronto (produto_id, quantidade_atual) VALUES (?, ?)",
                             (produto_id, quantidade)
                         )
-                    conn.commit()
                     st.success(f"{quantidade} unidades de {produto_nome} adicionadas ao estoque.")
 
     # ----------------------
@@ -56,12 +52,12 @@ def modulo_producao():
     # ----------------------
     with tab2:
         st.subheader("Estoque Atual de Produtos Prontos")
-        df_estoque = pd.read_sql_query('''
+        df_estoque = get_dataframe('''
             SELECT p.nome AS produto, e.quantidade_atual, e.ultima_atualizacao
             FROM estoque_pronto e
             JOIN produtos p ON e.produto_id = p.id
             ORDER BY p.nome
-        ''', conn)
+        ''')
         
         if df_estoque.empty:
             st.info("Estoque vazio.")
@@ -1,5 +1,5 @@
 import streamlit as st
-from funcoesAux import executar_query, get_dataframe
+from funcoesAux import executar_query, get_produtos, excluir_produto
 
 def modulo_produtos():
     st.header("📦 Gestão de Produtos")
@@ -45,7 +45,7 @@ def modulo_produtos():
     # ----------------------
     with tab2:
         st.subheader("Produtos Cadastrados")
-        produtos = get_dataframe("SELECT id, nome,preco_venda, categoria, ativo FROM produtos ORDER BY nome")
+        produtos = get_produtos()
         
         if produtos.empty:
             st.info("Nenhum produto cadastrado ainda.")
@@ -109,10 +109,13 @@ def modulo_produtos():
                     c1,c2 = st.columns(2)
                     with c1:
                         if st.button("Confirmar", key=f"confirm_yes_{row['id']}"):
-                            executar_query("DELETE FROM produtos WHERE id=?", (row['id'],))
-                            st.success("Produto excluído.")
-                            st.session_state.pop(f"confirm_delete_{row['id']}")
-                            st.rerun()
+                            sucesso, msg = excluir_produto(int(row['id']))
+                            if sucesso:
+                                st.success("Produto excluído.")
+                                st.session_state.pop(f"confirm_delete_{row['id']}")
+                                st.rerun()
+                            else:
+                                st.error(msg)
                     with c2:
                         if st.button("Cancelar", key=f"confirm_no_{row['id']}"):
                             st.session_state.pop(f"confirm_delete_{row['id']}")
@@ -6,10 +6,22 @@ from funcoesAux import (
     executar_query,
     adicionar_item_receita, 
     remover_item_receita,
+    adicionar_subreceita,
+    remover_subreceita,
     get_receita_produto,
+    get_subreceitas_produto,
+    get_receita_expandida_produto,
     calcular_custo_produto,
+    calcular_custos_produtos,
     verificar_disponibilidade_receita,
-    baixar_estoque_por_receita
+    registrar_producao_lote,
+    get_produtos,
+    get_produtos_com_receita,
+    get_ingredientes,
+    get_indice_produtos,
+    get_indice_ingredientes,
+    get_capacidade_producao,
+    plano_producao
 )
 import plotly.express as px
 
@@ -17,6 +29,10 @@ def modulo_receitas():
     """Módulo de gestão de receitas e estoque de produtos prontos"""
     st.header("📋 Receitas & Produção")
     
+    # Índices id → dados para os seletores (cacheados por versão dos dados)
+    indice_produtos = get_indice_produtos()
+    indice_ingredientes = get_indice_ingredientes()
+    
     tab1, tab2, tab3, tab4, tab5 = st.tabs([
         "🔧 Gerenciar Receitas", 
         "💰 Análise de Custos", 
@@ -31,8 +47,8 @@ def modulo_receitas():
     with tab1:
         st.subheader("Configurar Receitas dos Produtos")
         
-        produtos = get_dataframe("SELECT id, nome, preco_venda FROM produtos WHERE ativo=1 ORDER BY nome")
-        ingredientes = get_dataframe("SELECT id, nome, preco_kg, unidade, estoque_atual FROM ingredientes ORDER BY nome")
+        produtos = get_produtos(apenas_ativos=True)
+        ingredientes = get_ingredientes()
         
         if produtos.empty:
             st.warning("⚠️ Cadastre produtos antes de criar receitas")
@@ -47,20 +63,21 @@ def modulo_receitas():
             produto_id = st.selectbox(
                 "Selecione o Produto",
                 options=produtos['id'].tolist(),
-                format_func=lambda x: produtos[produtos['id']==x]['nome'].iloc[0]
+                format_func=lambda x: indice_produtos[x]['nome']
             )
         with col2:
-            produto_selecionado = produtos[produtos['id']==produto_id].iloc[0]
+            produto_selecionado = indice_produtos[produto_id]
             st.metric("Preço de Venda", f"R$ {produto_selecionado['preco_venda']:.2f}")
         
-        # Mostrar receita atual
+        # Mostrar receita atual (ingredientes diretos + sub-receitas)
         receita_atual = get_receita_produto(produto_id)
+        subreceitas_atual = get_subreceitas_produto(produto_id)
         
-        if not receita_atual.empty:
+        if not receita_atual.empty or not subreceitas_atual.empty:
             st.subheader(f"📝 Receita Atual - {produto_selecionado['nome']}")
             
-            # Calcular custo total
-            custo_total = receita_atual['custo_item'].sum()
+            # Custo total pela receita expandida (inclui sub-receitas)
+            custo_total = calcular_custo_produto(produto_id)
             margem = produto_selecionado['preco_venda'] - custo_total
             margem_percent = (margem / produto_selecionado['preco_venda'] * 100) if produto_selecionado['preco_venda'] > 0 else 0
             
@@ -70,6 +87,25 @@ def modulo_receitas():
             c3.metric("📊 Margem", f"R$ {margem:.2f}")
             c4.metric("📈 Margem %", f"{margem_percent:.1f}%")
             
+            # Tabela de sub-receitas (massas base, levain...)
+            if not subreceitas_atual.empty:
+                st.markdown("**🥣 Sub-receitas**")
+                st.dataframe(
+                    subreceitas_atual[['subproduto', 'quantidade', 'custo_unitario', 'custo_item']]
+                    .rename(columns={
+                        'subproduto': 'Sub-receita',
+                        'quantidade': 'Qtd/Unidade',
+                        'custo_unitario': 'Custo Unit. (R$)',
+                        'custo_item': 'Custo (R$)'
+                    })
+                    .style.format({
+                        'Qtd/Unidade': '{:.3f}',
+                        'Custo Unit. (R$)': 'R$ {:.2f}',
+                        'Custo (R$)': 'R$ {:.2f}'
+                    }),
+                    use_container_width=True
+                )
+            
             # Tabela de ingredientes
             st.dataframe(
                 receita_atual[['ingrediente', 'quantidade', 'unidade', 'preco_kg', 'custo_item', 'estoque_atual']]
@@ -111,6 +147,21 @@ def modulo_receitas():
                             st.rerun()
                         else:
                             st.error(msg)
+            
+            if not subreceitas_atual.empty:
+                mapa_remover_sub = {
+                    f"{row['subproduto']} ({row['quantidade']:.3f})": int(row['id'])
+                    for _, row in subreceitas_atual.iterrows()
+                }
+                sel_remover_sub = st.selectbox("Sub-receita para remover", ["-- selecione --"] + list(mapa_remover_sub))
+                if sel_remover_sub != "-- selecione --":
+                    if st.button("🗑️ Remover Sub-receita", key="btn_remover_sub"):
+                        sucesso, msg = remover_subreceita(mapa_remover_sub[sel_remover_sub])
+                        if sucesso:
+                            st.success(msg)
+                            st.rerun()
+                        else:
+                            st.error(msg)
         else:
             st.info(f"📝 Nenhuma receita cadastrada para **{produto_selecionado['nome']}**")
         
@@ -124,10 +175,10 @@ def modulo_receitas():
                 ingrediente_id = st.selectbox(
                     "Ingrediente",
                     options=ingredientes['id'].tolist(),
-                    format_func=lambda x: f"{ingredientes[ingredientes['id']==x]['nome'].iloc[0]} ({ingredientes[ingredientes['id']==x]['unidade'].iloc[0]})"
+                    format_func=lambda x: f"{indice_ingredientes[x]['nome']} ({indice_ingredientes[x]['unidade']})"
                 )
             with col2:
-                ing_sel = ingredientes[ingredientes['id']==ingrediente_id].iloc[0]
+                ing_sel = indice_ingredientes[ingrediente_id]
                 quantidade = st.number_input(
                     f"Quantidade por unidade de produto ({ing_sel['unidade']})",
                     min_value=0.001,
@@ -144,6 +195,34 @@ def modulo_receitas():
                     st.rerun()
                 else:
                     st.error(msg)
+        
+        # Adicionar sub-receita (outro produto, inclusive inativo, como componente)
+        st.subheader("➕ Adicionar Sub-receita")
+        outros_produtos = [p for p in get_produtos()['id'].tolist() if p != produto_id]
+        if outros_produtos:
+            with st.form("form_add_subreceita"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    subproduto_id = st.selectbox(
+                        "Produto usado como base",
+                        options=outros_produtos,
+                        format_func=lambda x: indice_produtos[x]['nome']
+                    )
+                with col2:
+                    quantidade_sub = st.number_input(
+                        "Unidades da base por unidade de produto",
+                        min_value=0.001,
+                        step=0.001,
+                        format="%.3f"
+                    )
+                
+                if st.form_submit_button("✅ Adicionar Sub-receita"):
+                    sucesso, msg = adicionar_subreceita(produto_id, subproduto_id, quantidade_sub)
+                    if sucesso:
+                        st.success(msg)
+                        st.rerun()
+                    else:
+                        st.error(msg)
     
     # =============================
     # TAB 2 - ANÁLISE DE CUSTOS
@@ -151,35 +230,26 @@ def modulo_receitas():
     with tab2:
         st.subheader("💰 Análise de Custos por Produto")
         
-        produtos_com_receita = get_dataframe("""
-            SELECT DISTINCT p.id, p.nome, p.preco_venda, p.categoria
-            FROM produtos p
-            JOIN receitas r ON p.id = r.produto_id
-            WHERE p.ativo = 1
-            ORDER BY p.nome
-        """)
+        produtos_com_receita = get_produtos_com_receita()
         
         if produtos_com_receita.empty:
             st.info("Nenhum produto com receita cadastrada")
             return
         
-        # Calcular custos para cada produto
-        analise_custos = []
-        for _, prod in produtos_com_receita.iterrows():
-            custo = calcular_custo_produto(prod['id'])
-            margem = prod['preco_venda'] - custo
-            margem_percent = (margem / prod['preco_venda'] * 100) if prod['preco_venda'] > 0 else 0
-            
-            analise_custos.append({
-                'Produto': prod['nome'],
-                'Categoria': prod['categoria'],
-                'Custo Variável': custo,
-                'Preço Venda': prod['preco_venda'],
-                'Margem R$': margem,
-                'Margem %': margem_percent
-            })
+        # Calcular custos de todos os produtos em uma consulta
+        custos = calcular_custos_produtos(produtos_com_receita['id'])
+        preco = produtos_com_receita['preco_venda'].astype(float)
+        custo = produtos_com_receita['id'].map(custos).astype(float)
+        margem = preco - custo
         
-        df_analise = pd.DataFrame(analise_custos)
+        df_analise = pd.DataFrame({
+            'Produto': produtos_com_receita['nome'],
+            'Categoria': produtos_com_receita['categoria'],
+            'Custo Variável': custo,
+            'Preço Venda': preco,
+            'Margem R$': margem,
+            'Margem %': (margem / preco * 100).where(preco > 0, 0)
+        })
         
         # Métricas gerais
         c1, c2, c3 = st.columns(3)
@@ -217,13 +287,7 @@ def modulo_receitas():
         st.subheader("📊 Simulador de Produção")
         st.markdown("Verifique se há estoque suficiente para produzir uma quantidade específica")
         
-        produtos_com_receita = get_dataframe("""
-            SELECT DISTINCT p.id, p.nome
-            FROM produtos p
-            JOIN receitas r ON p.id = r.produto_id
-            WHERE p.ativo = 1
-            ORDER BY p.nome
-        """)
+        produtos_com_receita = get_produtos_com_receita()
         
         if produtos_com_receita.empty:
             st.info("Nenhum produto com receita cadastrada")
@@ -234,7 +298,7 @@ def modulo_receitas():
             prod_sim_id = st.selectbox(
                 "Produto para Simular",
                 options=produtos_com_receita['id'].tolist(),
-                format_func=lambda x: produtos_com_receita[produtos_com_receita['id']==x]['nome'].iloc[0]
+                format_func=lambda x: indice_produtos[x]['nome']
             )
         with col2:
             qtd_simular = st.number_input("Quantidade a Produzir", min_value=1, value=10)
@@ -242,26 +306,20 @@ def modulo_receitas():
         if st.button("🔍 Verificar Disponibilidade"):
             disponivel, mensagem = verificar_disponibilidade_receita(prod_sim_id, qtd_simular)
             
-            # Mostrar receita detalhada
-            receita_sim = get_receita_produto(prod_sim_id)
+            # Mostrar receita detalhada (ingredientes crus, sub-receitas explodidas)
+            receita_sim = get_receita_expandida_produto(prod_sim_id)
             
             st.markdown("### Necessidades de Produção")
-            dados_simulacao = []
-            for _, item in receita_sim.iterrows():
-                necessario = item['quantidade'] * qtd_simular
-                disponivel_item = item['estoque_atual']
-                status = "✅ OK" if disponivel_item >= necessario else "❌ FALTA"
-                falta = max(0, necessario - disponivel_item)
-                
-                dados_simulacao.append({
-                    'Ingrediente': item['ingrediente'],
-                    'Necessário': f"{necessario:.3f} {item['unidade']}",
-                    'Disponível': f"{disponivel_item:.3f} {item['unidade']}",
-                    'Falta': f"{falta:.3f} {item['unidade']}",
-                    'Status': status
-                })
-            
-            df_simulacao = pd.DataFrame(dados_simulacao)
+            necessario = receita_sim['quantidade'] * qtd_simular
+            disponivel_item = receita_sim['estoque_atual']
+            unidade = " " + receita_sim['unidade']
+            df_simulacao = pd.DataFrame({
+                'Ingrediente': receita_sim['ingrediente'],
+                'Necessário': necessario.map('{:.3f}'.format) + unidade,
+                'Disponível': disponivel_item.map('{:.3f}'.format) + unidade,
+                'Falta': (necessario - disponivel_item).clip(lower=0).map('{:.3f}'.format) + unidade,
+                'Status': (disponivel_item >= necessario).map({True: "✅ OK", False: "❌ FALTA"})
+            })
             st.dataframe(df_simulacao, use_container_width=True)
             
             # Custo total da produção
@@ -277,6 +335,80 @@ def modulo_receitas():
                 st.success(f"✅ {mensagem}")
             else:
                 st.error(f"❌ {mensagem}")
+        
+        # Plano combinado: todos os produtos disputando os mesmos ingredientes
+        st.markdown("---")
+        st.markdown("### 🗓️ Plano de Produção Combinado")
+        
+        capacidade = get_capacidade_producao()
+        with st.expander("📦 Máximo por produto (cada um sozinho)"):
+            st.dataframe(
+                capacidade[['produto', 'max_unidades', 'gargalo']].rename(columns={
+                    'produto': 'Produto',
+                    'max_unidades': 'Máx. Unidades',
+                    'gargalo': 'Ingrediente Limitante'
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
+        
+        objetivo = st.radio(
+            "Objetivo",
+            ["margem", "metas"],
+            format_func=lambda x: {"margem": "💰 Maximizar margem", "metas": "🎯 Atender metas"}[x],
+            horizontal=True
+        )
+        metas = None
+        if objetivo == "metas":
+            editadas = st.data_editor(
+                capacidade[['produto_id', 'produto']].assign(meta=0),
+                column_config={
+                    'produto_id': None,
+                    'produto': st.column_config.TextColumn("Produto", disabled=True),
+                    'meta': st.column_config.NumberColumn("Meta (un.)", min_value=0, step=1)
+                },
+                use_container_width=True,
+                hide_index=True,
+                key="metas_plano"
+            )
+            metas = dict(zip(editadas['produto_id'], editadas['meta']))
+        
+        if st.button("🧮 Calcular Plano"):
+            plano, consumo = plano_producao(metas, objetivo)
+            if plano.empty:
+                st.warning("⚠️ Nenhum produto cabe no estoque atual com esse objetivo")
+            else:
+                c1, c2, c3 = st.columns(3)
+                c1.metric("📦 Unidades", f"{plano['quantidade'].sum():.0f}")
+                c2.metric("💰 Receita", f"R$ {plano['receita_total'].sum():.2f}")
+                c3.metric("📊 Margem", f"R$ {plano['margem_total'].sum():.2f}")
+                
+                colunas_plano = ['produto', 'quantidade', 'margem_unitaria', 'margem_total']
+                if objetivo == "metas":
+                    colunas_plano.insert(2, 'meta')
+                st.dataframe(
+                    plano[colunas_plano].rename(columns={
+                        'produto': 'Produto',
+                        'quantidade': 'Produzir',
+                        'meta': 'Meta',
+                        'margem_unitaria': 'Margem Unit.',
+                        'margem_total': 'Margem Total'
+                    }).style.format({'Meta': '{:.0f}', 'Margem Unit.': 'R$ {:.2f}', 'Margem Total': 'R$ {:.2f}'}),
+                    use_container_width=True,
+                    hide_index=True
+                )
+                st.markdown("#### Consumo de Ingredientes")
+                st.dataframe(
+                    consumo[['ingrediente', 'disponivel', 'consumo', 'sobra', 'unidade']].rename(columns={
+                        'ingrediente': 'Ingrediente',
+                        'disponivel': 'Disponível',
+                        'consumo': 'Consumo',
+                        'sobra': 'Sobra',
+                        'unidade': 'Unidade'
+                    }).style.format({'Disponível': '{:.3f}', 'Consumo': '{:.3f}', 'Sobra': '{:.3f}'}),
+                    use_container_width=True,
+                    hide_index=True
+                )
 
     # =============================
     # TAB 4 - ESTOQUE DE PRODUTOS PRONTOS
@@ -285,17 +417,6 @@ def modulo_receitas():
         st.subheader("🍞 Estoque de Produtos Prontos")
         st.markdown("Gerencie o estoque de pães e produtos já fabricados")
         
-        # Criar tabela se não existir
-        executar_query("""
-            CREATE TABLE IF NOT EXISTS estoque_pronto (
-                id INTEGER PRIMARY KEY,
-                produto_id INTEGER NOT NULL,
-                quantidade_atual REAL DEFAULT 0,
-                ultima_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (produto_id) REFERENCES produtos (id)
-            )
-        """)
-        
         # Buscar estoque atual
         estoque_pronto = get_dataframe("""
             SELECT 
@@ -352,7 +473,7 @@ def modulo_receitas():
         st.markdown("---")
         st.subheader("🔧 Ajustar Estoque Manualmente")
         
-        produtos_ativos = get_dataframe("SELECT id, nome FROM produtos WHERE ativo=1 ORDER BY nome")
+        produtos_ativos = get_produtos(apenas_ativos=True)
         
         if not produtos_ativos.empty:
             with st.form("form_ajuste_estoque"):
@@ -361,7 +482,7 @@ def modulo_receitas():
                     prod_ajuste_id = st.selectbox(
                         "Produto",
                         options=produtos_ativos['id'].tolist(),
-                        format_func=lambda x: produtos_ativos[produtos_ativos['id']==x]['nome'].iloc[0]
+                        format_func=lambda x: indice_produtos[x]['nome']
                     )
                 with col2:
                     tipo_ajuste = st.selectbox("Tipo", ["Adicionar", "Remover", "Definir"])
@@ -412,69 +533,55 @@ def modulo_receitas():
         st.subheader("📈 Registrar Produção")
         st.markdown("Registre a produção de produtos e baixe automaticamente o estoque de ingredientes")
         
-        produtos_com_receita = get_dataframe("""
-            SELECT DISTINCT p.id, p.nome
-            FROM produtos p
-            JOIN receitas r ON p.id = r.produto_id
-            WHERE p.ativo = 1
-            ORDER BY p.nome
-        """)
+        produtos_com_receita = get_produtos_com_receita()
         
         if produtos_com_receita.empty:
             st.warning("⚠️ Cadastre receitas antes de registrar produção")
             return
         
+        # Lote do dia: grade produto × quantidade, enviada de uma vez (um único rerun)
         with st.form("form_producao"):
-            col1, col2, col3 = st.columns([2, 1, 2])
-            
-            with col1:
-                prod_producao_id = st.selectbox(
-                    "Produto Produzido",
-                    options=produtos_com_receita['id'].tolist(),
-                    format_func=lambda x: produtos_com_receita[produtos_com_receita['id']==x]['nome'].iloc[0]
-                )
-            
-            with col2:
-                qtd_producao = st.number_input("Quantidade", min_value=1, value=10, step=1)
-            
-            with col3:
-                data_producao = st.date_input("Data", value=datetime.now().date())
+            grade = st.data_editor(
+                produtos_com_receita[['id', 'nome']].assign(quantidade=0),
+                column_config={
+                    'id': None,
+                    'nome': st.column_config.TextColumn("Produto", disabled=True),
+                    'quantidade': st.column_config.NumberColumn("Quantidade", min_value=0, step=1)
+                },
+                use_container_width=True,
+                hide_index=True,
+                key="grade_producao"
+            )
+            data_producao = st.date_input("Data", value=datetime.now().date())
             
-            submit_producao = st.form_submit_button("✅ Registrar Produção")
+            submit_producao = st.form_submit_button("✅ Registrar Produção do Lote")
             
             if submit_producao:
-                # Verificar disponibilidade
-                disponivel, msg = verificar_disponibilidade_receita(prod_producao_id, qtd_producao)
+                lote = grade[grade['quantidade'] > 0]
+                # Disponibilidade do lote inteiro, baixa e estoque pronto em uma transação
+                sucesso, msg, faltantes = registrar_producao_lote(
+                    zip(lote['id'].astype(int), lote['quantidade'].astype(int)),
+                    datetime.combine(data_producao, datetime.now().time())
+                )
                 
-                if not disponivel:
-                    st.error(f"❌ {msg}")
+                if sucesso:
+                    st.success(f"✅ {msg}")
+                    st.balloons()
+                    st.rerun()
                 else:
-                    # Baixar estoque de ingredientes
-                    sucesso_baixa, msg_baixa = baixar_estoque_por_receita(prod_producao_id, qtd_producao)
-                    
-                    if sucesso_baixa:
-                        # Atualizar estoque de produtos prontos
-                        existe = get_dataframe(
-                            "SELECT quantidade_atual FROM estoque_pronto WHERE produto_id = ?",
-                            (prod_producao_id,)
+                    st.error(f"❌ {msg}")
+                    if faltantes is not None and not faltantes.empty:
+                        st.dataframe(
+                            faltantes[['ingrediente', 'necessario', 'disponivel', 'falta', 'unidade']].rename(columns={
+                                'ingrediente': 'Ingrediente',
+                                'necessario': 'Necessário',
+                                'disponivel': 'Disponível',
+                                'falta': 'Falta',
+                                'unidade': 'Unidade'
+                            }),
+                            use_container_width=True,
+                            hide_index=True
                         )
-                        
-                        if existe.empty:
-                            executar_query(
-                                "INSERT INTO estoque_pronto (produto_id, quantidade_atual) VALUES (?, ?)",
-                                (prod_producao_id, qtd_producao)
-                            )
-                        else:
-                            executar_query(
-                                "UPDATE estoque_pronto SET quantidade_atual = quantidade_atual + ?, ultima_atualizacao = ? WHERE produto_id = ?",
-                                (qtd_producao, datetime.now(), prod_producao_id)
-                            )
-                        
-                        st.success(f"✅ Produção registrada: {qtd_producao} unidades de {produtos_com_receita[produtos_com_receita['id']==prod_producao_id]['nome'].iloc[0]}")
-                        st.balloons()
-                        st.rerun()
-                    else:
-                        st.error(f"❌ Erro ao baixar estoque: {msg_baixa}")
         
         # Histórico de produção (últimos 7 dias)
         st.markdown("---")
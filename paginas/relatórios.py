@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-from funcoesAux import get_dataframe, format_brl_currency, format_brl_percent
+from funcoesAux import get_dataframe, get_totais_vendas, get_custo_entradas, format_brl_currency, format_brl_percent
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
@@ -21,20 +21,9 @@ def modulo_relatorios():
         with col2:
             data_fim = st.date_input("Data Fim", value=datetime.now().date())
 
-        # Receita total
-        receita_total = float(get_dataframe(
-            "SELECT COALESCE(SUM(total),0) as total FROM vendas WHERE data_venda BETWEEN ? AND ?", 
-            (data_inicio, data_fim)
-        )['total'].iloc[0])
-
-        # Custos variáveis (entradas de estoque)
-        custos_variaveis = float(get_dataframe("""
-            SELECT COALESCE(SUM(m.quantidade * i.preco_kg), 0) AS total_custo
-            FROM movimentacoes_estoque m
-            JOIN ingredientes i ON m.ingrediente_id = i.id
-            WHERE m.tipo = 'entrada' 
-            AND DATE(m.data_movimentacao) BETWEEN ? AND ?
-        """, (data_inicio, data_fim))['total_custo'].iloc[0])
+        # Receita total e custos variáveis (entradas de estoque), incluindo meses arquivados
+        receita_total = float(get_totais_vendas(data_inicio, data_fim)['faturamento'])
+        custos_variaveis = get_custo_entradas(data_inicio, data_fim)
 
         # Custos fixos
         custos_fixos = float(get_dataframe("""
@@ -78,21 +67,20 @@ def modulo_relatorios():
     with tab2:
         st.subheader("Análise de Produtos")
 
+        # Rollup produto/dia: cobre também os meses já arquivados
         ranking_produtos = get_dataframe("""
-       SELECT 
-    p.id,
-    p.nome AS produto,
-    p.categoria,
-    SUM(iv.quantidade) AS quantidade_vendida,
-    SUM(iv.subtotal) AS receita
-FROM itens_venda iv
-JOIN produtos p ON iv.produto_id = p.id
-JOIN vendas v ON iv.venda_id = v.id
-WHERE v.data_venda BETWEEN ? AND ?
-GROUP BY p.id, p.nome, p.categoria
-ORDER BY receita DESC
-
-    """, (data_inicio, data_fim))
+            SELECT
+                p.id,
+                p.nome AS produto,
+                p.categoria,
+                SUM(vp.quantidade) AS quantidade_vendida,
+                SUM(vp.faturamento) AS receita
+            FROM vendas_produto_dia vp
+            JOIN produtos p ON vp.produto_id = p.id
+            WHERE vp.data_venda BETWEEN ? AND ?
+            GROUP BY p.id, p.nome, p.categoria
+            ORDER BY receita DESC
+        """, (data_inicio, data_fim))
 
 
         if not ranking_produtos.empty:
@@ -1,380 +1,499 @@
 import streamlit as st
+import uuid
 import pandas as pd
 from datetime import datetime, timedelta
 from funcoesAux import (
     get_dataframe,
-    executar_query,
     criar_venda,
-    get_resumo_vendas,
+    excluir_venda,
+    get_resumo_vendas_pagina,
+    get_itens_vendas,
+    get_totais_vendas,
+    get_produtos,
+    get_indice_produtos,
     calcular_custo_produto,
-    verificar_disponibilidade_receita
+    verificar_disponibilidade_cesta,
+    reservar_cesta,
+    liberar_reserva
 )
+from arquivamento import get_corte_arquivo
 import plotly.express as px
+from streamlit.errors import StreamlitAPIException
+
+def rerun_fragmento():
+    """Reexecuta só o fragmento atual (ou a página, se estiver numa execução completa)"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
 def modulo_vendas():
     st.header("💰 Vendas")
 
     tab1, tab2, tab3 = st.tabs(["🛒 Nova Venda", "📋 Histórico de Vendas", "📊 Análises"])
 
-    # =============================
-    # TAB 1 - NOVA VENDA (CARRINHO)
-    # =============================
+    # Cada aba é um fragmento: interações dentro dela reexecutam só a própria aba
     with tab1:
-        st.subheader("🛒 Registrar Nova Venda")
+        secao_carrinho()
+    with tab2:
+        secao_historico()
+    with tab3:
+        secao_analises()
+
+# =============================
+# TAB 1 - NOVA VENDA (CARRINHO)
+# =============================
+@st.fragment
+def secao_carrinho():
+    st.subheader("🛒 Registrar Nova Venda")
+    
+    # Inicializar carrinho na sessão
+    if 'carrinho' not in st.session_state:
+        st.session_state.carrinho = []
+    # Identifica o carrinho desta sessão nas reservas de estoque
+    if 'sessao_caixa' not in st.session_state:
+        st.session_state.sessao_caixa = uuid.uuid4().hex
+    sessao = st.session_state.sessao_caixa
+    
+    st.markdown("### 🛍️ Adicionar Produtos ao Pedido")
+    
+    produtos = get_produtos(apenas_ativos=True)
+    indice_produtos = get_indice_produtos()
+    
+    if produtos.empty:
+        st.warning("⚠️ Cadastre produtos antes de registrar vendas!")
+        return
+    
+    # Formulário para adicionar produtos
+    with st.form("form_add_produto", clear_on_submit=True):
+        col1, col2, col3, col4 = st.columns([3, 1, 2, 1])
         
-        # Inicializar carrinho na sessão
-        if 'carrinho' not in st.session_state:
-            st.session_state.carrinho = []
+        with col1:
+            produto_id = st.selectbox(
+                "Produto",
+                options=produtos['id'].tolist(),
+                format_func=lambda x: indice_produtos[x]['nome']
+            )
         
-        st.markdown("### 🛍️ Adicionar Produtos ao Pedido")
+        with col2:
+            qtd = st.number_input("Qtd", min_value=1, value=1, key="qtd_produto")
         
-        produtos = get_dataframe("SELECT id, nome, preco_venda FROM produtos WHERE ativo=1 ORDER BY nome")
+        with col3:
+            produto_sel = indice_produtos[produto_id]
+            
+            # Atualiza o valor inicial do número com base no produto selecionado
+            # key fixa, mas value dinâmico
+            preco = st.number_input(
+                "Preço Unit.", 
+                min_value=0.01, 
+                value=float(produto_sel['preco_venda']), 
+                format="%.2f", 
+                key=f"preco_produto_{produto_id}"  # chave única por produto
+            )
+
         
-        if produtos.empty:
-            st.warning("⚠️ Cadastre produtos antes de registrar vendas!")
-            return
+        with col4:
+            st.markdown("<br>", unsafe_allow_html=True)
+            adicionar = st.form_submit_button("➕ Adicionar", use_container_width=True)
         
-        # Formulário para adicionar produtos
-        with st.form("form_add_produto", clear_on_submit=True):
-            col1, col2, col3, col4 = st.columns([3, 1, 2, 1])
+        if adicionar:
+            # Reservar o pedido inteiro (itens já no carrinho + o novo) contra outros caixas
+            cesta = [(i['produto_id'], i['quantidade']) for i in st.session_state.carrinho]
+            disponivel, msg_estoque, _ = reservar_cesta(sessao, cesta + [(int(produto_id), int(qtd))])
             
+            if not disponivel:
+                st.error(f"⚠️ {msg_estoque}")
+            else:
+                item = {
+                    'produto_id': int(produto_id),
+                    'nome': produto_sel['nome'],
+                    'quantidade': int(qtd),
+                    'preco_unitario': float(preco),
+                    'subtotal': float(qtd * preco)
+                }
+                st.session_state.carrinho.append(item)
+                st.success(f"✅ {item['nome']} adicionado ao pedido")
+                rerun_fragmento()
+    
+    # Mostrar carrinho
+    if st.session_state.carrinho:
+        st.markdown("---")
+        st.markdown("### 🛒 Itens do Pedido")
+        
+        df_carrinho = pd.DataFrame(st.session_state.carrinho)
+        total_venda = df_carrinho['subtotal'].sum()
+        
+        # Tabela do carrinho
+        for idx, item in enumerate(st.session_state.carrinho):
+            col1, col2, col3, col4, col5 = st.columns([3, 1, 2, 2, 1])
             with col1:
-                produto_id = st.selectbox(
-                    "Produto",
-                    options=produtos['id'].tolist(),
-                    format_func=lambda x: produtos[produtos['id']==x]['nome'].iloc[0]
-                )
-            
+                st.write(f"**{item['nome']}**")
             with col2:
-                qtd = st.number_input("Qtd", min_value=1, value=1, key="qtd_produto")
-            
+                st.write(f"{item['quantidade']}x")
             with col3:
-                produto_sel = produtos[produtos['id'] == produto_id].iloc[0]
-                
-                # Atualiza o valor inicial do número com base no produto selecionado
-                # key fixa, mas value dinâmico
-                preco = st.number_input(
-                    "Preço Unit.", 
-                    min_value=0.01, 
-                    value=float(produto_sel['preco_venda']), 
-                    format="%.2f", 
-                    key=f"preco_produto_{produto_id}"  # chave única por produto
-                )
-
-            
+                st.write(f"R$ {item['preco_unitario']:.2f}")
             with col4:
-                st.markdown("<br>", unsafe_allow_html=True)
-                adicionar = st.form_submit_button("➕ Adicionar", use_container_width=True)
-            
-            if adicionar:
-                # Verificar estoque antes de adicionar
-                disponivel, msg_estoque = verificar_disponibilidade_receita(produto_id, qtd)
-                
-                if not disponivel:
-                    st.error(f"⚠️ {msg_estoque}")
-                else:
-                    item = {
-                        'produto_id': int(produto_id),
-                        'nome': produto_sel['nome'],
-                        'quantidade': int(qtd),
-                        'preco_unitario': float(preco),
-                        'subtotal': float(qtd * preco)
-                    }
-                    st.session_state.carrinho.append(item)
-                    st.success(f"✅ {item['nome']} adicionado ao pedido")
-                    st.rerun()
+                st.write(f"**R$ {item['subtotal']:.2f}**")
+            with col5:
+                if st.button("🗑️", key=f"remove_{idx}"):
+                    st.session_state.carrinho.pop(idx)
+                    cesta = [(i['produto_id'], i['quantidade']) for i in st.session_state.carrinho]
+                    reservar_cesta(sessao, cesta)
+                    rerun_fragmento()
         
-        # Mostrar carrinho
-        if st.session_state.carrinho:
-            st.markdown("---")
-            st.markdown("### 🛒 Itens do Pedido")
-            
-            df_carrinho = pd.DataFrame(st.session_state.carrinho)
-            total_venda = df_carrinho['subtotal'].sum()
-            
-            # Tabela do carrinho
-            for idx, item in enumerate(st.session_state.carrinho):
-                col1, col2, col3, col4, col5 = st.columns([3, 1, 2, 2, 1])
-                with col1:
-                    st.write(f"**{item['nome']}**")
-                with col2:
-                    st.write(f"{item['quantidade']}x")
-                with col3:
-                    st.write(f"R$ {item['preco_unitario']:.2f}")
-                with col4:
-                    st.write(f"**R$ {item['subtotal']:.2f}**")
-                with col5:
-                    if st.button("🗑️", key=f"remove_{idx}"):
-                        st.session_state.carrinho.pop(idx)
-                        st.rerun()
-            
-            st.markdown("---")
-            
-            # Total e ações
-            col1, col2, col3 = st.columns([2, 1, 1])
-            with col1:
-                st.markdown(f"### 💰 Total: R$ {total_venda:.2f}")
-            with col2:
-                if st.button("🗑️ Limpar Carrinho", use_container_width=True):
-                    st.session_state.carrinho = []
-                    st.rerun()
-            with col3:
-                pass  # Espaçamento
-            
-            # Dados finais da venda
-            st.markdown("---")
-            col1, col2 = st.columns([2, 3])
-            with col1:
-                data_venda = st.date_input("📅 Data da Venda", value=datetime.now().date())
-            with col2:
-                observacao = st.text_input("📝 Observação (opcional)", placeholder="Ex: Cliente pediu sem glúten")
-            
-            if st.button("✅ Finalizar Venda", type="primary", use_container_width=True):
-                if not st.session_state.carrinho:
-                    st.error("❌ Carrinho vazio!")
-                else:
-                    # Preparar itens para a venda
-                    itens_venda = [
-                        {
-                            'produto_id': item['produto_id'],
-                            'quantidade': item['quantidade'],
-                            'preco_unitario': item['preco_unitario']
-                        }
-                        for item in st.session_state.carrinho
-                    ]
-                    
-                    # Criar venda
-                    sucesso, msg, venda_id = criar_venda(data_venda, itens_venda, observacao)
-                    
-                    if sucesso:
-                        st.success(f"✅ Venda #{venda_id} registrada com sucesso!")
-                        st.balloons()
-                        st.session_state.carrinho = []
-                        st.rerun()
-                    else:
-                        st.error(f"❌ {msg}")
-        else:
-            st.info("🛒 Carrinho vazio. Adicione produtos ao pedido.")
-    
-    # =============================
-    # TAB 2 - HISTÓRICO DE VENDAS
-    # =============================
-    with tab2:
-        st.subheader("📋 Histórico de Vendas")
+        st.markdown("---")
         
-        # Filtros
-        col1, col2 = st.columns(2)
+        # Total e ações
+        col1, col2, col3 = st.columns([2, 1, 1])
         with col1:
-            inicio = st.date_input("Data Início", value=datetime.now().date() - timedelta(days=7), key="hist_inicio")
+            st.markdown(f"### 💰 Total: R$ {total_venda:.2f}")
         with col2:
-            fim = st.date_input("Data Fim", value=datetime.now().date(), key="hist_fim")
-        
-        # Buscar resumo de vendas
-        vendas = get_resumo_vendas(inicio, fim)
-        
-        if vendas.empty:
-            st.info("Nenhuma venda encontrada no período")
-            return
-        
-        # Métricas do período
-        total_periodo = vendas['total'].sum()
-        qtd_vendas = len(vendas)
-        ticket_medio = total_periodo / qtd_vendas if qtd_vendas > 0 else 0
-        margem_total = vendas['margem_total'].sum()
+            if st.button("🗑️ Limpar Carrinho", use_container_width=True):
+                st.session_state.carrinho = []
+                liberar_reserva(sessao)
+                rerun_fragmento()
+        with col3:
+            pass  # Espaçamento
         
-        c1, c2, c3, c4 = st.columns(4)
-        c1.metric("💰 Faturamento", f"R$ {total_periodo:.2f}")
-        c2.metric("🛒 Nº de Vendas", qtd_vendas)
-        c3.metric("🎯 Ticket Médio", f"R$ {ticket_medio:.2f}")
-        c4.metric("📊 Margem Total", f"R$ {margem_total:.2f}")
+        # Conferir o carrinho inteiro contra o estoque (descontadas reservas de outros caixas)
+        cesta = [(i['produto_id'], i['quantidade']) for i in st.session_state.carrinho]
+        estoque_ok, msg_estoque, faltantes = verificar_disponibilidade_cesta(cesta, sessao)
+        if not estoque_ok:
+            st.warning("⚠️ O pedido excede o estoque de ingredientes:")
+            st.dataframe(
+                faltantes[['ingrediente', 'necessario', 'disponivel', 'falta', 'unidade']].rename(columns={
+                    'ingrediente': 'Ingrediente',
+                    'necessario': 'Necessário',
+                    'disponivel': 'Disponível',
+                    'falta': 'Falta',
+                    'unidade': 'Unidade'
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
         
+        # Dados finais da venda
         st.markdown("---")
+        col1, col2 = st.columns([2, 3])
+        with col1:
+            data_venda = st.date_input("📅 Data da Venda", value=datetime.now().date())
+        with col2:
+            observacao = st.text_input("📝 Observação (opcional)", placeholder="Ex: Cliente pediu sem glúten")
         
-        # Lista de vendas com expander
-        for _, venda in vendas.iterrows():
-            venda_id = int(venda['id'])
-            data_formatada = pd.to_datetime(venda['data_venda']).strftime('%d/%m/%Y')
-            hora = venda['hora_venda'] if pd.notna(venda['hora_venda']) else ''
-            
-            # Título do expander
-            titulo = f"Venda #{venda_id} - {data_formatada} {hora} - R$ {venda['total']:.2f}"
-            if pd.notna(venda['observacao']) and venda['observacao']:
-                titulo += f" | 📝 {venda['observacao']}"
-            
-            with st.expander(titulo):
-                # Buscar itens da venda
-                itens = get_dataframe("""
-                    SELECT p.nome as produto, iv.quantidade, iv.preco_unitario, 
-                           iv.subtotal, iv.custo_variavel,
-                           (iv.subtotal - iv.custo_variavel) as margem
-                    FROM itens_venda iv
-                    JOIN produtos p ON iv.produto_id = p.id
-                    WHERE iv.venda_id = ?
-                """, (venda_id,))
+        if st.button("✅ Finalizar Venda", type="primary", use_container_width=True):
+            if not st.session_state.carrinho:
+                st.error("❌ Carrinho vazio!")
+            elif not estoque_ok:
+                st.error(f"❌ {msg_estoque}")
+            else:
+                # Preparar itens para a venda
+                itens_venda = [
+                    {
+                        'produto_id': item['produto_id'],
+                        'quantidade': item['quantidade'],
+                        'preco_unitario': item['preco_unitario']
+                    }
+                    for item in st.session_state.carrinho
+                ]
                 
-                if not itens.empty:
-                    # Tabela de itens
-                    st.dataframe(
-                        itens.rename(columns={
-                            'produto': 'Produto',
-                            'quantidade': 'Qtd',
-                            'preco_unitario': 'Preço Unit.',
-                            'subtotal': 'Subtotal',
-                            'custo_variavel': 'Custo Var.',
-                            'margem': 'Margem'
-                        }).style.format({
-                            'Preço Unit.': 'R$ {:.2f}',
-                            'Subtotal': 'R$ {:.2f}',
-                            'Custo Var.': 'R$ {:.2f}',
-                            'Margem': 'R$ {:.2f}'
-                        }),
-                        use_container_width=True
-                    )
-                    
-                    # Totais
-                    c1, c2, c3, c4 = st.columns(4)
-                    c1.metric("💰 Total", f"R$ {venda['total']:.2f}")
-                    c2.metric("📦 Itens", int(venda['qtd_itens']))
-                    c3.metric("💸 Custo", f"R$ {venda['custo_total']:.2f}")
-                    c4.metric("📊 Margem", f"R$ {venda['margem_total']:.2f}")
+                # Criar venda
+                sucesso, msg, venda_id = criar_venda(data_venda, itens_venda, observacao, sessao=sessao)
                 
-                # Botão de excluir
-                st.markdown("---")
-                if st.button("🗑️ Excluir Venda", key=f"del_venda_{venda_id}"):
-                    st.session_state[f"confirm_del_venda_{venda_id}"] = True
+                if sucesso:
+                    st.success(f"✅ Venda #{venda_id} registrada com sucesso!")
+                    st.balloons()
+                    st.session_state.carrinho = []
+                    # Venda nova muda histórico e análises: rerun da página inteira
+                    st.rerun()
+                else:
+                    st.error(f"❌ {msg}")
+    else:
+        st.info("🛒 Carrinho vazio. Adicione produtos ao pedido.")
+
+# =============================
+# TAB 2 - HISTÓRICO DE VENDAS
+# =============================
+@st.fragment
+def secao_historico():
+    st.subheader("📋 Histórico de Vendas")
+    
+    # Filtros
+    col1, col2 = st.columns(2)
+    with col1:
+        inicio = st.date_input("Data Início", value=datetime.now().date() - timedelta(days=7), key="hist_inicio")
+    with col2:
+        fim = st.date_input("Data Fim", value=datetime.now().date(), key="hist_fim")
+    
+    # Totais do período vêm do rollup (sem carregar todas as vendas)
+    totais = get_totais_vendas(inicio, fim)
+    qtd_vendas = int(totais['num_vendas'])
+    
+    if qtd_vendas == 0:
+        st.info("Nenhuma venda encontrada no período")
+        return
+    
+    # Métricas do período
+    total_periodo = totais['faturamento']
+    ticket_medio = total_periodo / qtd_vendas if qtd_vendas > 0 else 0
+    margem_total = totais['margem']
+    
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("💰 Faturamento", f"R$ {total_periodo:.2f}")
+    c2.metric("🛒 Nº de Vendas", qtd_vendas)
+    c3.metric("🎯 Ticket Médio", f"R$ {ticket_medio:.2f}")
+    c4.metric("📊 Margem Total", f"R$ {margem_total:.2f}")
+    
+    st.markdown("---")
+    
+    # A lista só alcança as vendas que ainda estão no banco: antes do corte do
+    # arquivamento elas entram nos totais (rollup), mas não na paginação
+    inicio_lista = inicio
+    corte = get_corte_arquivo()
+    if corte is not None and str(inicio) < corte:
+        inicio_lista = datetime.strptime(corte, '%Y-%m-%d').date()
+        st.caption(
+            f"🗄️ Vendas anteriores a {inicio_lista:%d/%m/%Y} foram arquivadas: contam nas métricas acima, "
+            "mas não aparecem na lista (exporte o relatório em Configurações para consultá-las)."
+        )
+        if inicio_lista > fim:
+            return
+        qtd_lista = int(get_totais_vendas(inicio_lista, fim)['num_vendas'])
+        if qtd_lista == 0:
+            st.info("Nenhuma venda do período ainda está no banco")
+            return
+    else:
+        qtd_lista = qtd_vendas
+    
+    # Paginação por chave (data_venda, id): guarda o cursor de início de cada página
+    por_pagina = st.selectbox("Vendas por página", [20, 50, 100], key="hist_por_pagina")
+    filtro = (inicio_lista, fim, por_pagina)
+    if st.session_state.get("hist_filtro") != filtro:
+        st.session_state["hist_filtro"] = filtro
+        st.session_state["hist_cursores"] = [None]
+    cursores = st.session_state["hist_cursores"]
+    pagina = len(cursores)
+    total_paginas = max(1, -(-qtd_lista // por_pagina))
+    
+    vendas = get_resumo_vendas_pagina(inicio_lista, fim, limite=por_pagina, apos=cursores[-1])
+    
+    # Itens de todas as vendas da página em uma consulta
+    itens_pagina = get_itens_vendas(vendas['id'].tolist())
+    itens_por_venda = {int(vid): df for vid, df in itens_pagina.groupby('venda_id')}
+    
+    # Lista de vendas com expander
+    for _, venda in vendas.iterrows():
+        venda_id = int(venda['id'])
+        data_formatada = pd.to_datetime(venda['data_venda']).strftime('%d/%m/%Y')
+        hora = venda['hora_venda'] if pd.notna(venda['hora_venda']) else ''
+        
+        # Título do expander
+        titulo = f"Venda #{venda_id} - {data_formatada} {hora} - R$ {venda['total']:.2f}"
+        if pd.notna(venda['observacao']) and venda['observacao']:
+            titulo += f" | 📝 {venda['observacao']}"
+        
+        with st.expander(titulo):
+            itens = itens_por_venda.get(venda_id)
+            
+            if itens is not None and not itens.empty:
+                # Tabela de itens
+                st.dataframe(
+                    itens.drop(columns=['venda_id']).rename(columns={
+                        'produto': 'Produto',
+                        'quantidade': 'Qtd',
+                        'preco_unitario': 'Preço Unit.',
+                        'subtotal': 'Subtotal',
+                        'custo_variavel': 'Custo Var.',
+                        'margem': 'Margem'
+                    }).style.format({
+                        'Preço Unit.': 'R$ {:.2f}',
+                        'Subtotal': 'R$ {:.2f}',
+                        'Custo Var.': 'R$ {:.2f}',
+                        'Margem': 'R$ {:.2f}'
+                    }),
+                    use_container_width=True
+                )
                 
-                # Confirmação de exclusão
-                if st.session_state.get(f"confirm_del_venda_{venda_id}", False):
-                    st.warning("⚠️ Atenção: Esta ação NÃO reverterá o estoque automaticamente. Confirma?")
-                    col_y, col_n = st.columns(2)
-                    with col_y:
-                        if st.button("✅ Confirmar Exclusão", key=f"yes_del_venda_{venda_id}"):
-                            try:
-                                executar_query("DELETE FROM vendas WHERE id=?", (venda_id,))
-                                st.success("✅ Venda excluída")
-                                st.session_state.pop(f"confirm_del_venda_{venda_id}")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Erro: {e}")
-                    with col_n:
-                        if st.button("❌ Cancelar", key=f"no_del_venda_{venda_id}"):
+                # Totais
+                c1, c2, c3, c4 = st.columns(4)
+                c1.metric("💰 Total", f"R$ {venda['total']:.2f}")
+                c2.metric("📦 Itens", int(venda['qtd_itens']))
+                c3.metric("💸 Custo", f"R$ {venda['custo_total']:.2f}")
+                c4.metric("📊 Margem", f"R$ {venda['margem_total']:.2f}")
+            
+            # Botão de excluir
+            st.markdown("---")
+            if st.button("🗑️ Excluir Venda", key=f"del_venda_{venda_id}"):
+                st.session_state[f"confirm_del_venda_{venda_id}"] = True
+            
+            # Confirmação de exclusão
+            if st.session_state.get(f"confirm_del_venda_{venda_id}", False):
+                st.warning("⚠️ Atenção: Esta ação NÃO reverterá o estoque automaticamente. Confirma?")
+                col_y, col_n = st.columns(2)
+                with col_y:
+                    if st.button("✅ Confirmar Exclusão", key=f"yes_del_venda_{venda_id}"):
+                        sucesso, msg = excluir_venda(venda_id)
+                        if sucesso:
+                            st.success(f"✅ {msg}")
                             st.session_state.pop(f"confirm_del_venda_{venda_id}")
                             st.rerun()
+                        else:
+                            st.error(f"Erro: {msg}")
+                with col_n:
+                    if st.button("❌ Cancelar", key=f"no_del_venda_{venda_id}"):
+                        st.session_state.pop(f"confirm_del_venda_{venda_id}")
+                        rerun_fragmento()
     
-    # =============================
-    # TAB 3 - ANÁLISES
-    # =============================
-    with tab3:
-        st.subheader("📊 Análises de Vendas")
+    # Navegação entre páginas
+    st.markdown("---")
+    col_ant, col_pag, col_prox = st.columns([1, 2, 1])
+    with col_ant:
+        if st.button("⬅️ Anterior", key="hist_anterior", disabled=pagina == 1):
+            cursores.pop()
+            rerun_fragmento()
+    with col_pag:
+        st.caption(f"Página {pagina} de {total_paginas}")
+    with col_prox:
+        if st.button("Próxima ➡️", key="hist_proxima", disabled=len(vendas) < por_pagina or pagina >= total_paginas):
+            ultima = vendas.iloc[-1]
+            cursores.append((ultima['data_venda'], int(ultima['id'])))
+            rerun_fragmento()
+
+# =============================
+# TAB 3 - ANÁLISES
+# =============================
+@st.fragment
+def secao_analises():
+    st.subheader("📊 Análises de Vendas")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        data_ini_analise = st.date_input("Data Início", value=datetime.now().date() - timedelta(days=30), key="analise_ini")
+    with col2:
+        data_fim_analise = st.date_input("Data Fim", value=datetime.now().date(), key="analise_fim")
+    
+    # Produtos mais vendidos (rollup produto/dia)
+    produtos_vendidos = get_dataframe("""
+        SELECT p.nome, 
+               SUM(vp.quantidade) as qtd_vendida, 
+               SUM(vp.faturamento) as receita,
+               SUM(vp.custo_variavel) as custo,
+               SUM(vp.faturamento - vp.custo_variavel) as margem,
+               SUM(vp.num_vendas) as num_vendas
+        FROM vendas_produto_dia vp
+        JOIN produtos p ON vp.produto_id = p.id
+        WHERE vp.data_venda BETWEEN ? AND ?
+        GROUP BY p.id, p.nome
+        ORDER BY receita DESC
+    """, (data_ini_analise, data_fim_analise))
+    
+    if not produtos_vendidos.empty:
+        st.markdown("### 🏆 Produtos Mais Vendidos")
         
-        col1, col2 = st.columns(2)
-        with col1:
-            data_ini_analise = st.date_input("Data Início", value=datetime.now().date() - timedelta(days=30), key="analise_ini")
-        with col2:
-            data_fim_analise = st.date_input("Data Fim", value=datetime.now().date(), key="analise_fim")
+        # Gráfico de barras
+        fig = px.bar(
+            produtos_vendidos.head(10),
+            x='nome',
+            y='receita',
+            text='receita',
+            color='margem',
+            color_continuous_scale=['#FF6B6B', '#FFA07A', '#5C977C'],
+            labels={'nome': 'Produto', 'receita': 'Receita (R$)', 'margem': 'Margem (R$)'}
+        )
+        fig.update_traces(texttemplate='R$ %{text:.2f}', textposition='outside')
+        st.plotly_chart(fig, use_container_width=True)
+        
+        # Tabela detalhada
+        st.markdown("### 📋 Detalhamento")
+        st.dataframe(
+            produtos_vendidos.rename(columns={
+                'nome': 'Produto',
+                'qtd_vendida': 'Qtd Vendida',
+                'receita': 'Receita',
+                'custo': 'Custo',
+                'margem': 'Margem',
+                'num_vendas': 'Nº Vendas'
+            }).style.format({
+                'Receita': 'R$ {:.2f}',
+                'Custo': 'R$ {:.2f}',
+                'Margem': 'R$ {:.2f}',
+                'Qtd Vendida': '{:.0f}',
+                'Nº Vendas': '{:.0f}'
+            }).background_gradient(subset=['Margem'], cmap='Greens'),
+            use_container_width=True
+        )
         
-        # Produtos mais vendidos
-        produtos_vendidos = get_dataframe("""
-            SELECT p.nome, 
-                   SUM(iv.quantidade) as qtd_vendida, 
-                   SUM(iv.subtotal) as receita,
-                   SUM(iv.custo_variavel) as custo,
-                   SUM(iv.subtotal - iv.custo_variavel) as margem,
-                   COUNT(DISTINCT iv.venda_id) as num_vendas
-            FROM itens_venda iv
-            JOIN produtos p ON iv.produto_id = p.id
-            JOIN vendas v ON iv.venda_id = v.id
-            WHERE v.data_venda BETWEEN ? AND ?
-            GROUP BY p.id, p.nome
-            ORDER BY receita DESC
+        # Análise de performance
+        st.markdown("---")
+        st.markdown("### 🎯 Performance de Vendas")
+        
+        # Vendas por dia da semana
+        vendas_semana = get_dataframe("""
+            SELECT 
+                CASE CAST(strftime('%w', data_venda) AS INTEGER)
+                    WHEN 0 THEN 'Domingo'
+                    WHEN 1 THEN 'Segunda'
+                    WHEN 2 THEN 'Terça'
+                    WHEN 3 THEN 'Quarta'
+                    WHEN 4 THEN 'Quinta'
+                    WHEN 5 THEN 'Sexta'
+                    WHEN 6 THEN 'Sábado'
+                END as dia_semana,
+                SUM(num_vendas) as num_vendas,
+                SUM(faturamento) as faturamento,
+                SUM(faturamento) / SUM(num_vendas) as ticket_medio
+            FROM vendas_dia
+            WHERE data_venda BETWEEN ? AND ?
+            GROUP BY strftime('%w', data_venda)
+            ORDER BY strftime('%w', data_venda)
         """, (data_ini_analise, data_fim_analise))
         
-        if not produtos_vendidos.empty:
-            st.markdown("### 🏆 Produtos Mais Vendidos")
+        if not vendas_semana.empty:
+            col1, col2 = st.columns(2)
             
-            # Gráfico de barras
-            fig = px.bar(
-                produtos_vendidos.head(10),
-                x='nome',
-                y='receita',
-                text='receita',
-                color='margem',
-                color_continuous_scale=['#FF6B6B', '#FFA07A', '#5C977C'],
-                labels={'nome': 'Produto', 'receita': 'Receita (R$)', 'margem': 'Margem (R$)'}
-            )
-            fig.update_traces(texttemplate='R$ %{text:.2f}', textposition='outside')
-            st.plotly_chart(fig, use_container_width=True)
+            with col1:
+                fig_semana = px.bar(
+                    vendas_semana,
+                    x='dia_semana',
+                    y='faturamento',
+                    text='faturamento',
+                    title="Faturamento por Dia da Semana",
+                    color_discrete_sequence=['#5C977C']
+                )
+                fig_semana.update_traces(texttemplate='R$ %{text:.2f}', textposition='outside')
+                st.plotly_chart(fig_semana, use_container_width=True)
             
-            # Tabela detalhada
-            st.markdown("### 📋 Detalhamento")
-            st.dataframe(
-                produtos_vendidos.rename(columns={
-                    'nome': 'Produto',
-                    'qtd_vendida': 'Qtd Vendida',
-                    'receita': 'Receita',
-                    'custo': 'Custo',
-                    'margem': 'Margem',
-                    'num_vendas': 'Nº Vendas'
-                }).style.format({
-                    'Receita': 'R$ {:.2f}',
-                    'Custo': 'R$ {:.2f}',
-                    'Margem': 'R$ {:.2f}',
-                    'Qtd Vendida': '{:.0f}',
-                    'Nº Vendas': '{:.0f}'
-                }).background_gradient(subset=['Margem'], cmap='Greens'),
-                use_container_width=True
+            with col2:
+                fig_ticket = px.bar(
+                    vendas_semana,
+                    x='dia_semana',
+                    y='ticket_medio',
+                    text='ticket_medio',
+                    title="Ticket Médio por Dia da Semana",
+                    color_discrete_sequence=['#7FBFA0']
+                )
+                fig_ticket.update_traces(texttemplate='R$ %{text:.2f}', textposition='outside')
+                st.plotly_chart(fig_ticket, use_container_width=True)
+        
+        # Vendas por hora do dia (rollup por hora)
+        vendas_hora = get_dataframe("""
+            SELECT hora, SUM(num_vendas) as num_vendas, SUM(faturamento) as faturamento
+            FROM vendas_hora
+            WHERE data_venda BETWEEN ? AND ?
+            GROUP BY hora
+            ORDER BY hora
+        """, (data_ini_analise, data_fim_analise))
+        
+        if not vendas_hora.empty:
+            fig_hora = px.bar(
+                vendas_hora,
+                x='hora',
+                y='num_vendas',
+                text='num_vendas',
+                title="Vendas por Hora do Dia",
+                labels={'hora': 'Hora', 'num_vendas': 'Nº Vendas'},
+                color_discrete_sequence=['#5C977C']
             )
-            
-            # Análise de performance
-            st.markdown("---")
-            st.markdown("### 🎯 Performance de Vendas")
-            
-            # Vendas por dia da semana
-            vendas_semana = get_dataframe("""
-                SELECT 
-                    CASE CAST(strftime('%w', data_venda) AS INTEGER)
-                        WHEN 0 THEN 'Domingo'
-                        WHEN 1 THEN 'Segunda'
-                        WHEN 2 THEN 'Terça'
-                        WHEN 3 THEN 'Quarta'
-                        WHEN 4 THEN 'Quinta'
-                        WHEN 5 THEN 'Sexta'
-                        WHEN 6 THEN 'Sábado'
-                    END as dia_semana,
-                    COUNT(*) as num_vendas,
-                    SUM(total) as faturamento,
-                    AVG(total) as ticket_medio
-                FROM vendas
-                WHERE data_venda BETWEEN ? AND ?
-                GROUP BY strftime('%w', data_venda)
-                ORDER BY strftime('%w', data_venda)
-            """, (data_ini_analise, data_fim_analise))
-            
-            if not vendas_semana.empty:
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    fig_semana = px.bar(
-                        vendas_semana,
-                        x='dia_semana',
-                        y='faturamento',
-                        text='faturamento',
-                        title="Faturamento por Dia da Semana",
-                        color_discrete_sequence=['#5C977C']
-                    )
-                    fig_semana.update_traces(texttemplate='R$ %{text:.2f}', textposition='outside')
-                    st.plotly_chart(fig_semana, use_container_width=True)
-                
-                with col2:
-                    fig_ticket = px.bar(
-                        vendas_semana,
-                        x='dia_semana',
-                        y='ticket_medio',
-                        text='ticket_medio',
-                        title="Ticket Médio por Dia da Semana",
-                        color_discrete_sequence=['#7FBFA0']
-                    )
-                    fig_ticket.update_traces(texttemplate='R$ %{text:.2f}', textposition='outside')
-                    st.plotly_chart(fig_ticket, use_container_width=True)
-        else:
-            st.info("Nenhuma venda no período selecionado")
\ No newline at end of file
+            fig_hora.update_traces(textposition='outside')
+            st.plotly_chart(fig_hora, use_container_width=True)
+    else:
+        st.info("Nenhuma venda no período selecionado")